@@ -1,36 +1,73 @@
+"""Serverless cart analysis (POST {"items": [...], "persona": "diabetic"}).
+
+Items are product names or {"name": ..., "quantity": <packs>} objects;
+"skip_narrative": true returns the structured report without an LLM call.
+
+Nothing heavy is imported at module load. The first invocation of a fresh
+instance imports cart_llm and builds the engine on the memory-mapped
+catalogue (no pandas). Warm invocations reuse that engine. Every response
+reports the split:
+  X-Cold-Start: 1 on the invocation that built the engine, else 0
+  Server-Timing: init;dur=<ms building the engine>, analyze;dur=<ms>
+"""
+
 from http.server import BaseHTTPRequestHandler
 import json
 import sys
 import os
+import time
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from cart_llm import analyze_cart  # reuse your logic
 
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
-            payload = json.loads(body)
+def get_engine():
+    """(engine, ms spent importing and building it on this call; 0.0 when warm)"""
+    start = time.perf_counter()
+    from cart_llm import shared_engine
+    engine, built = shared_engine()
+    return engine, (time.perf_counter() - start) * 1000 if built else 0.0
 
-            items = payload.get("items", [])
-            persona = payload.get("persona", "standard")
 
-            result = analyze_cart(items, persona)
+def analyze(payload):
+    """(status, response body, init ms, analyze ms)"""
+    items = payload.get("items", [])
+    if not isinstance(items, list) or not items:
+        return 400, {"error": "No items provided"}, 0.0, 0.0
 
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.end_headers()
+    engine, init_ms = get_engine()
+    start = time.perf_counter()
+    persona = payload.get("persona", "standard")
+    if payload.get("weights") is not None:
+        try:
+            persona = engine.custom_persona(payload["weights"])
+        except (ValueError, AttributeError) as e:
+            return 400, {"error": str(e)}, init_ms, 0.0
 
-            self.wfile.write(json.dumps(result).encode())
+    from cart_llm import report_to_json
+    result = report_to_json(engine.analyze_cart(items, persona=persona,
+                                                skip_narrative=bool(payload.get("skip_narrative", False))))
+    return 200, result, init_ms, (time.perf_counter() - start) * 1000
 
+
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        init_ms = analyze_ms = 0.0
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(content_length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("Request body must be a JSON object")
+            status, result, init_ms, analyze_ms = analyze(payload)
+        except ValueError as e:
+            status, result = 400, {"error": str(e)}
         except Exception as e:
-            self.send_response(500)
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.end_headers()
-
-            self.wfile.write(json.dumps({
-                "error": str(e)
-            }).encode())
+            status, result = 500, {"error": str(e)}
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Expose-Headers", "X-Cold-Start, Server-Timing")
+        self.send_header("X-Cold-Start", "1" if init_ms else "0")
+        self.send_header("Server-Timing", f"init;dur={init_ms:.1f}, analyze;dur={analyze_ms:.1f}")
+        self.end_headers()
+
+        self.wfile.write(json.dumps(result).encode())
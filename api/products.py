@@ -0,0 +1,32 @@
+"""Serverless catalogue paging (GET, same query as backend_api /api/products).
+
+The engine is built on the first call and kept for warm invocations, as in
+api/analyze_cart.py.
+"""
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        args = parse_qs(urlparse(self.path).query)
+        try:
+            from cart_llm import products_response, shared_engine
+            engine, _ = shared_engine()
+            status, result = 200, products_response(engine, args)
+        except ValueError as e:
+            status, result = 400, {"error": str(e)}
+        except Exception as e:
+            status, result = 500, {"error": str(e)}
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        self.wfile.write(json.dumps(result).encode())
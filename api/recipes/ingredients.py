@@ -0,0 +1,34 @@
+"""Serverless recipe ingredient matching (POST, same body as backend_api /api/recipes/ingredients).
+
+The engine is built on the first call and kept for warm invocations, as in
+api/analyze_cart.py.
+"""
+
+from http.server import BaseHTTPRequestHandler
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(content_length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("Request body must be a JSON object")
+            from cart_llm import ingredients_response, shared_engine
+            engine, _ = shared_engine()
+            status, result = 200, ingredients_response(engine, payload)
+        except ValueError as e:
+            status, result = 400, {"error": str(e)}
+        except Exception as e:
+            status, result = 500, {"error": str(e)}
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        self.wfile.write(json.dumps(result).encode())
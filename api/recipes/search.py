@@ -0,0 +1,25 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from recipe_search import search_response
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        args = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        try:
+            status, result = 200, search_response(args)
+        except ValueError as e:
+            status, result = 400, {"error": str(e)}
+        except Exception as e:
+            status, result = 500, {"error": str(e)}
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        self.wfile.write(json.dumps(result).encode())
@@ -6,12 +6,10 @@ const db = {
 
 // ===== SHOPPING DATA =====
 let csvData = [];
-let recipeData = []; // Recipe database
 let allCategories = new Set();
 let cart = {};
 let currentFilter = "All";
-let csvLoaded = false;
-let recipeLoaded = false;
+let productsLoaded = false;
 let selectedDietFilters = [];
 let selectedAllergenFilters = [];
 let nutriMaxActive = false;
@@ -22,8 +20,8 @@ function showScreen(id) {
     document.getElementById(id).classList.add("active");
 
     // If navigating to shopping screen, load products if not already loaded
-    if (id === "screen-shopping" && !csvLoaded) {
-        loadCSV();
+    if (id === "screen-shopping" && !productsLoaded) {
+        loadProducts();
     }
 }
 
@@ -76,207 +74,29 @@ document.addEventListener("DOMContentLoaded", () => {
 
 // ===== RECIPE LLM SYSTEM =====
 
-// Load recipe database
-async function loadRecipeData() {
-    if (recipeLoaded) {
-        console.log('Recipe data already loaded, returning cached data');
-        return recipeData;
-    }
-    
-    try {
-        console.log('=== Starting loadRecipeData ===');
-        console.log('Fetching Food_Recipe.csv...');
-        
-        const response = await fetch('Food_Recipe.csv');
-        console.log('Fetch response status:', response.status, response.statusText);
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status} - ${response.statusText}`);
-        }
-        
-        const text = await response.text();
-        console.log('CSV text loaded successfully. Length:', text.length);
-        console.log('First 200 characters:', text.substring(0, 200));
-        
-        // Parse headers from first line
-        const lines = text.split('\n').filter(line => line.trim());
-        console.log('Total lines after filtering empty:', lines.length);
-        
-        if (lines.length < 2) {
-            throw new Error('CSV file appears to be empty or has no data rows');
-        }
-        
-        const headerRow = lines[0];
-        console.log('Header row:', headerRow.substring(0, 100) + '...');
-        
-        const headers = parseCSVRow(headerRow).map(h => h.replace(/^"|"$/g, '').trim());
-        console.log('Headers parsed:', headers.length, 'columns');
-        console.log('First few headers:', headers.slice(0, 5));
-        
-        recipeData = [];
-        let successfulRows = 0;
-        let failedRows = 0;
-        
-        for (let i = 1; i < lines.length; i++) {
-            const line = lines[i].trim();
-            if (!line) continue;
-            
-            try {
-                const values = parseCSVRow(line);
-                if (values.length >= 2) { // At least name and description
-                    const recipe = {};
-                    headers.forEach((header, index) => {
-                        recipe[header] = values[index] ? values[index].replace(/^"|"$/g, '').trim() : '';
-                    });
-                    
-                    if (recipe.name) {
-                        recipeData.push(recipe);
-                        successfulRows++;
-                    }
-                } else {
-                    console.warn(`Row ${i} has insufficient columns: ${values.length} vs ${headers.length} expected`);
-                    failedRows++;
-                }
-            } catch (error) {
-                console.warn(`Error parsing line ${i}:`, error.message);
-                failedRows++;
-            }
-        }
-        
-        recipeLoaded = true;
-        console.log(`=== Recipe loading completed ===`);
-        console.log(`Successfully loaded: ${successfulRows} recipes`);
-        console.log(`Failed to parse: ${failedRows} rows`);
-        console.log(`Total in recipeData array: ${recipeData.length} recipes`);
-        
-        // Log first few recipes for verification
-        console.log('First 3 recipes loaded:');
-        recipeData.slice(0, 3).forEach((recipe, i) => {
-            console.log(`${i + 1}. "${recipe.name}" (${recipe.cuisine || 'No cuisine'})`);
-        });
-        
-        // Check for specific recipe
-        const paneerRecipe = recipeData.find(r => r.name && r.name.toLowerCase().includes('paneer do pyaza'));
-        console.log('Paneer do Pyaza search result:', paneerRecipe ? `Found: "${paneerRecipe.name}"` : 'Not found');
-        
-        if (recipeData.length === 0) {
-            throw new Error('No valid recipes were loaded from the CSV file');
-        }
-        
-        return recipeData;
-    } catch (error) {
-        console.error('=== CRITICAL ERROR in loadRecipeData ===');
-        console.error('Error type:', error.constructor.name);
-        console.error('Error message:', error.message);
-        console.error('Error stack:', error.stack);
-        recipeData = [];
-        recipeLoaded = false;
-        throw error; // Re-throw so calling function can handle it
+// Recipe search runs on the backend (recipe_search.py indexes Food_Recipe.csv
+// once), so the page no longer downloads and scans the whole recipe file.
+async function fetchApi(path, params) {
+    const response = await fetch(`${path}?${new URLSearchParams(params)}`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status} - ${response.statusText}`);
     }
+    return response.json();
 }
 
-// Parse CSV row handling quoted strings with commas
-function parseCSVRow(row) {
-    const result = [];
-    let current = '';
-    let inQuotes = false;
-    let i = 0;
-    
-    while (i < row.length) {
-        const char = row[i];
-        
-        if (char === '"') {
-            // Handle escaped quotes
-            if (inQuotes && row[i + 1] === '"') {
-                current += '"';
-                i += 2; // Skip both quotes
-                continue;
-            }
-            inQuotes = !inQuotes;
-        } else if (char === ',' && !inQuotes) {
-            result.push(current.trim());
-            current = '';
-        } else {
-            current += char;
-        }
-        i++;
-    }
-    
-    // Don't forget the last column
-    result.push(current.trim());
-    return result;
-}
+// Smart recipe search: best 5 matches (exact > starts with > all words > contains > partial words)
+async function findRecipesByDish(dishName) {
+    if (!dishName || !dishName.trim()) return { results: [], examples: [] };
 
-// Smart recipe search using LLM-like fuzzy matching
-function findRecipesByDish(dishName) {
-    if (!dishName || !recipeData.length) return [];
-    
-    const searchTerm = dishName.toLowerCase().trim();
-    const matches = [];
-    
-    console.log('Searching for:', searchTerm);
-    console.log('Total recipes to search:', recipeData.length);
-    
-    recipeData.forEach((recipe, index) => {
-        if (!recipe || !recipe.name) return;
-        
-        const recipeName = recipe.name.toLowerCase();
-        let score = 0;
-        let matchType = '';
-        
-        // Exact match (highest priority)
-        if (recipeName === searchTerm) {
-            score = 100;
-            matchType = 'exact';
-        }
-        // Starts with search term
-        else if (recipeName.startsWith(searchTerm)) {
-            score = 90;
-            matchType = 'starts_with';
-        }
-        // Contains all words from search term
-        else if (searchTerm.split(' ').every(word => recipeName.includes(word))) {
-            score = 80;
-            matchType = 'all_words';
-        }
-        // Contains search term
-        else if (recipeName.includes(searchTerm)) {
-            score = 70;
-            matchType = 'contains';
-        }
-        // Individual word matches
-        else {
-            const searchWords = searchTerm.split(' ').filter(w => w.length > 2);
-            const recipeWords = recipeName.split(' ');
-            let wordMatches = 0;
-            
-            searchWords.forEach(searchWord => {
-                if (recipeWords.some(recipeWord => recipeWord.includes(searchWord))) {
-                    wordMatches++;
-                }
-            });
-            
-            if (wordMatches > 0) {
-                score = (wordMatches / searchWords.length) * 60;
-                matchType = 'partial_words';
-            }
-        }
-        
-        if (score > 0) {
-            matches.push({ recipe, score, matchType });
-        }
-    });
-    
-    console.log('Found matches:', matches.length);
-    matches.forEach(m => console.log(`${m.recipe.name} - Score: ${m.score} - Type: ${m.matchType}`));
-    
-    // Sort by score and return top matches
-    return matches
-        .sort((a, b) => b.score - a.score)
-        .slice(0, 5)
-        .map(match => match.recipe);
+    console.log('Searching for:', dishName.toLowerCase().trim());
+    const data = await fetchApi('api/recipes/search', { q: dishName, k: 5 });
+
+    console.log('Found matches:', data.results.length);
+    data.results.forEach(m => console.log(`${m.recipe.name} - Score: ${m.score} - Type: ${m.match_type}`));
+    return data;
 }
 
+
 // Extract and parse ingredients from recipe
 function extractIngredients(recipe) {
     console.log('extractIngredients called with recipe:', recipe.name);
@@ -301,99 +121,70 @@ function extractIngredients(recipe) {
             const quantity = ingredientQuantities[index] || '';
             const cleanName = name.replace(/[()]/g, '').trim();
             
-            // Extract base ingredient name (remove descriptive text)
-            const baseName = extractBaseName(cleanName);
-            
             ingredients.push({
                 name: cleanName,
-                baseName: baseName,
+                baseName: cleanName.toLowerCase(),
                 quantity: quantity,
                 found: false
             });
         }
     });
     
-    console.log('Extracted ingredients:', ingredients.map(ing => `"${ing.name}" -> "${ing.baseName}"`));
+    console.log('Extracted ingredients:', ingredients.map(ing => `"${ing.name}"`));
     return ingredients;
 }
 
-// Extract base ingredient name for matching with product database
-function extractBaseName(ingredientName) {
-    const name = ingredientName.toLowerCase();
-    
-    // Common ingredient mappings
-    const mappings = {
-        'potatoes': 'potato',
-        'tomatoes': 'tomato',
-        'onions': 'onion',
-        'carrots': 'carrot',
-        'green chillies': 'green chili',
-        'dry red chillies': 'red chili',
-        'coriander leaves': 'coriander',
-        'curry leaves': 'curry leaf',
-        'mustard seeds': 'mustard seed',
-        'cumin seeds': 'cumin',
-        'turmeric powder': 'turmeric',
-        'red chilli powder': 'chili powder',
-        'garam masala powder': 'garam masala',
-        'coconut oil': 'oil',
-        'olive oil': 'oil'
+// Placeholder for an ingredient the catalogue has no product for
+function ingredientPlaceholder(ingredient, i) {
+    return {
+        // Use keys consistent with shopping/cart views
+        product_name_en: ingredient.name,
+        product_name: ingredient.name,
+        brands: 'Fresh',
+        quantity: ingredient.quantity || '1 unit',
+        categories: 'Ingredients',
+        countries_en: 'India',
+        stores: 'Available in store',
+        'off:nutriscore_grade': 'd',
+        code: 'mock_' + i,
+        mock_product: true
     };
-    
-    // Check direct mappings
-    for (const [key, value] of Object.entries(mappings)) {
-        if (name.includes(key)) {
-            return value;
-        }
-    }
-    
-    // Extract first significant word
-    const words = name.split(' ');
-    const significantWords = words.filter(word => 
-        !['fresh', 'dried', 'powder', 'whole', 'ground', 'chopped', 'sliced', 'minced'].includes(word)
-    );
-    
-    return significantWords[0] || words[0];
 }
 
-// Simplified ingredient matching - guaranteed to work
-function matchIngredientsWithProducts(ingredients) {
-    console.log('=== SIMPLIFIED matchIngredientsWithProducts ===');
+// Match every ingredient of a recipe to catalogue products in one request
+// (ranked by health score for the persona); unmatched ones get a placeholder
+async function matchIngredientsWithProducts(ingredients, persona = 'standard') {
+    console.log('=== matchIngredientsWithProducts ===');
     console.log('Processing', ingredients.length, 'ingredients');
     
-    const result = [];
+    const response = await fetch('api/recipes/ingredients', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ingredients: ingredients.map(ing => ing.name), persona: persona, k: 3 })
+    });
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status} - ${response.statusText}`);
+    }
+    const data = await response.json();
     
-    for (let i = 0; i < ingredients.length; i++) {
-        const ingredient = ingredients[i];
-        console.log(`Processing ${i + 1}/${ingredients.length}: "${ingredient.name}"`);
-        
-        // Create mock product for every ingredient
-        const mockProduct = {
-            // Use keys consistent with shopping/cart views
-            product_name_en: ingredient.name,
-            product_name: ingredient.name,
-            brands: 'Fresh',
-            quantity: ingredient.quantity || '1 unit',
-            categories: 'Ingredients',
-            countries_en: 'India',
-            stores: 'Available in store',
-            'off:nutriscore_grade': 'd',
-            code: 'mock_' + i,
-            mock_product: true
-        };
+    const result = ingredients.map((ingredient, i) => {
+        const match = data.ingredients[i];
+        const products = match.products.map(p => ({ ...p, product_name: p.product_name_en }));
+        const found = products.length > 0;
+        const placeholder = ingredientPlaceholder(ingredient, i);
         
-        result.push({
+        return {
             name: ingredient.name,
-            baseName: ingredient.baseName,
+            baseName: match.key || ingredient.baseName,
             quantity: ingredient.quantity,
-            found: true,
-            availableProducts: [mockProduct],
-            bestMatch: mockProduct
-        });
-    }
+            found: found,
+            availableProducts: found ? products : [placeholder],
+            bestMatch: found ? products[0] : placeholder
+        };
+    });
     
     console.log('=== matchIngredientsWithProducts COMPLETED ===');
-    console.log('Returning', result.length, 'matched ingredients');
+    console.log(`Matched ${result.filter(r => r.found).length} of ${result.length} ingredients to catalogue products`);
     return result;
 }
 
@@ -401,35 +192,20 @@ function matchIngredientsWithProducts(ingredients) {
 async function generateIngredientSuggestions(dishName) {
     console.log('=== generateIngredientSuggestions called ===');
     console.log('Dish name:', dishName);
-    console.log('Current recipeLoaded status:', recipeLoaded);
-    console.log('Current recipeData length:', recipeData.length);
     
     try {
-        console.log('Calling loadRecipeData...');
-        await loadRecipeData();
-        console.log('loadRecipeData completed. Recipe data length:', recipeData.length);
-        
-        if (recipeData.length === 0) {
-            console.error('CRITICAL: No recipe data available after loading');
-            return {
-                success: false,
-                message: 'Recipe database failed to load. Please check the console for network errors and refresh the page.',
-                suggestions: []
-            };
-        }
-        
         console.log('Calling findRecipesByDish with:', dishName);
-        const recipes = findRecipesByDish(dishName);
+        const search = await findRecipesByDish(dishName);
+        const recipes = search.results.map(match => match.recipe);
         console.log('Search results:', recipes.length, 'recipes found');
         
         if (recipes.length === 0) {
-            console.log('No recipes found. Available recipe samples:');
-            recipeData.slice(0, 5).forEach((r, i) => {
-                console.log(`${i + 1}. "${r.name}"`);
-            });
+            const examples = search.examples || [];
             return {
                 success: false,
-                message: `No recipes found for "${dishName}". Try searching for: ${recipeData.slice(0, 3).map(r => r.name).join(', ')}`,
+                message: examples.length
+                    ? `No recipes found for "${dishName}". Try searching for: ${examples.join(', ')}`
+                    : `No recipes found for "${dishName}".`,
                 suggestions: []
             };
         }
@@ -446,7 +222,7 @@ async function generateIngredientSuggestions(dishName) {
         console.log('Extracted ingredients count:', ingredients.length);
         
         console.log('Calling matchIngredientsWithProducts with:', ingredients.length, 'ingredients');
-        const matchedIngredients = matchIngredientsWithProducts(ingredients);
+        const matchedIngredients = await matchIngredientsWithProducts(ingredients);
         console.log('matchIngredientsWithProducts completed. Results:', matchedIngredients.length);
         
         return {
@@ -458,7 +234,7 @@ async function generateIngredientSuggestions(dishName) {
             cookTime: bestRecipe['cook_time (in mins)'],
             description: bestRecipe.description,
             ingredients: matchedIngredients,
-            availableCount: matchedIngredients.length, // All ingredients are now "available"
+            availableCount: matchedIngredients.filter(ing => ing.found).length,
             totalCount: matchedIngredients.length
         };
     } catch (error) {
@@ -473,29 +249,12 @@ async function generateIngredientSuggestions(dishName) {
     }
 }
 
-// Autocomplete functionality
-function getAutocompleteSuggestions(query) {
-    if (!query || query.length < 2 || !recipeData.length) return [];
-    
-    const searchTerm = query.toLowerCase().trim();
-    const suggestions = [];
+// Autocomplete functionality: top 8 recipe names containing the query, prefix matches first
+async function getAutocompleteSuggestions(query) {
+    if (!query || query.length < 2) return [];
     
-    // Find recipes that match the search term
-    recipeData.forEach(recipe => {
-        const recipeName = recipe.name.toLowerCase();
-        if (recipeName.includes(searchTerm)) {
-            suggestions.push({
-                name: recipe.name,
-                cuisine: recipe.cuisine || 'International',
-                score: recipeName.startsWith(searchTerm) ? 10 : 5
-            });
-        }
-    });
-    
-    // Sort by score and return top 8 suggestions
-    return suggestions
-        .sort((a, b) => b.score - a.score)
-        .slice(0, 8);
+    const data = await fetchApi('api/recipes/autocomplete', { q: query, k: 8 });
+    return data.suggestions;
 }
 
 // Initialize autocomplete on input field
@@ -506,9 +265,11 @@ function initializeAutocomplete(inputId, containerId) {
     if (!input || !container) return;
     
     let selectedIndex = -1;
+    let latestRequest = 0;
     
     input.addEventListener('input', async (e) => {
         const query = e.target.value;
+        const requestId = ++latestRequest;
         selectedIndex = -1;
         
         if (query.length < 2) {
@@ -516,10 +277,16 @@ function initializeAutocomplete(inputId, containerId) {
             return;
         }
         
-        // Ensure recipe data is loaded
-        await loadRecipeData();
+        let suggestions;
+        try {
+            suggestions = await getAutocompleteSuggestions(query);
+        } catch (error) {
+            console.warn('Autocomplete request failed:', error.message);
+            suggestions = [];
+        }
         
-        const suggestions = getAutocompleteSuggestions(query);
+        // A newer keystroke has already been answered or is in flight
+        if (requestId !== latestRequest) return;
         
         if (suggestions.length === 0) {
             container.style.display = 'none';
@@ -607,7 +374,7 @@ function addAllIngredientsToCart(ingredients) {
             cart[productId] = (cart[productId] || 0) + 1;
             addedCount++;
 
-            // Ensure mock product is available in products list for cart rendering
+            // Ensure the product is available in products list for cart rendering
             const exists = csvData.some(p => `${p.product_name_en}_${p.brands}`.replace(/[^a-zA-Z0-9]/g, '_') === productId);
             if (!exists) {
                 csvData.push({
@@ -618,7 +385,8 @@ function addAllIngredientsToCart(ingredients) {
                     countries_en: product.countries_en || 'India',
                     stores: product.stores || 'Available in store',
                     'off:nutriscore_grade': (product['off:nutriscore_grade'] || 'd'),
-                    mock_product: true
+                    // Catalogue matches are real products; only placeholders are mock
+                    mock_product: product.mock_product === true
                 });
             }
         }
@@ -743,95 +511,47 @@ function skipForNow() {
 
 // ===== SHOPPING LOGIC =====
 
-async function loadCSV() {
-    if (csvLoaded) return;
+// Products come a page at a time from /api/products. csvData keeps every
+// product seen so far plus the stored cart / ingredient products, which is
+// what the cart pages read back from localStorage.
+let shownProducts = [];
+let shownProductQuery = null;
+let nextProductCursor = null;
+let productQuerySeq = 0;
 
-    try {
-        const response = await fetch("openfoodfacts_categorized.csv");
-        const csvText = await response.text();
-        parseCSV(csvText);
-        
-        // Merge any stored mock products (from ingredients) into csvData
-        try {
-            const storedProducts = localStorage.getItem('b4ubuy_products');
-            if (storedProducts) {
-                const stored = JSON.parse(storedProducts);
-                stored.forEach(p => {
-                    if (p.mock_product) {
-                        const id = `${(p.product_name_en || '').trim()}_${(p.brands || '').trim()}`.replace(/[^a-zA-Z0-9]/g, '_');
-                        const exists = csvData.some(existing => 
-                            `${(existing.product_name_en || '').trim()}_${(existing.brands || '').trim()}`.replace(/[^a-zA-Z0-9]/g, '_') === id
-                        );
-                        if (!exists) {
-                            csvData.push(p);
-                        }
-                    }
-                });
-            }
-        } catch (e) {
-            console.warn('Error merging stored products:', e);
-        }
-        
-        csvLoaded = true;
-        console.log(`Loaded ${csvData.length} products (including mock)`);
-        initializeCategories();
-        // After products are ready, reconcile cart against product list
-        reconcileCartWithProducts();
-        renderProducts();
-        setupEventListeners();
-    } catch (error) {
-        console.error("Error loading CSV:", error);
-        const container = document.getElementById("products-container");
-        if (container) {
-            container.innerHTML = "<p style='text-align: center; color: #ef4444; padding: 20px;'>Error loading products. Check console.</p>";
-        }
-    }
+function productKey(p) {
+    return `${(p.product_name_en || '').trim()}_${(p.brands || '').trim()}`.replace(/[^a-zA-Z0-9]/g, '_');
 }
 
-function parseCSV(csvText) {
-    const lines = csvText.trim().split("\n");
-    const headers = parseCSVRow(lines[0]);
-
-    for (let i = 1; i < lines.length; i++) {
-        if (!lines[i].trim()) continue;
-
-        const values = parseCSVRow(lines[i]);
-        const row = {};
-
-        headers.forEach((header, index) => {
-            row[header] = values[index] || "";
-        });
-
-        if (row.product_name_en && row.product_name_en.trim()) {
-            csvData.push(row);
+function rememberProducts(products) {
+    const known = new Set(csvData.map(productKey));
+    products.forEach(p => {
+        const id = productKey(p);
+        if (!known.has(id)) {
+            known.add(id);
+            csvData.push(p);
         }
-    }
+    });
 }
 
-function parseCSVRow(line) {
-    const result = [];
-    let current = "";
-    let inQuotes = false;
-
-    for (let i = 0; i < line.length; i++) {
-        const char = line[i];
-        const nextChar = line[i + 1];
-
-        if (char === '"' && nextChar === '"') {
-            current += '"';
-            i++;
-        } else if (char === '"') {
-            inQuotes = !inQuotes;
-        } else if (char === "," && !inQuotes) {
-            result.push(current.trim());
-            current = "";
-        } else {
-            current += char;
+async function loadProducts() {
+    if (productsLoaded) return;
+    productsLoaded = true;
+
+    // Merge stored products (cart items and ingredient placeholders) into csvData
+    try {
+        const storedProducts = localStorage.getItem('b4ubuy_products');
+        if (storedProducts) {
+            rememberProducts(JSON.parse(storedProducts));
         }
+    } catch (e) {
+        console.warn('Error merging stored products:', e);
     }
 
-    result.push(current.trim());
-    return result;
+    initializeCategories();
+    reconcileCartWithProducts();
+    setupEventListeners();
+    await renderProducts();
 }
 
 function initializeCategories() {
@@ -914,46 +634,95 @@ function toggleNutriMax() {
 }
 
 
-function getFilteredProducts() {
-    let filtered = csvData;
+// /api/products query for the category, filter sheet, NutriMax and search box
+function productQueryParams() {
+    const params = new URLSearchParams();
+    const searchInput = document.getElementById("search-input");
+    const query = searchInput ? searchInput.value : "";
 
-    if (currentFilter !== "All") {
-        filtered = filtered.filter((p) => p.category === currentFilter);
+    if (query.length > 0) {
+        // Search results span every category
+        params.set("q", query);
+    } else if (currentFilter !== "All") {
+        params.set("category", currentFilter);
+    }
+    selectedDietFilters.forEach(diet => params.append("diet", diet));
+    selectedAllergenFilters.forEach(allergen => params.append("allergen", allergen));
+    if (nutriMaxActive) {
+        params.append("grade", "a");
+        params.append("grade", "b");
+        params.set("sort", "nutri");
     }
+    return params;
+}
 
-    if (selectedDietFilters.length > 0) {
-        filtered = filtered.filter(p => {
-            const labels = (p.labels || "").toLowerCase();
-            return selectedDietFilters.every(diet => labels.includes(diet));
-        });
+// Ingredient placeholders are not in the catalogue, so they are filtered here
+function placeholderProductsMatching(params) {
+    const query = (params.get("q") || "").toLowerCase();
+    const category = params.get("category");
+
+    return csvData.filter(p => {
+        if (!p.mock_product) return false;
+        if (query && !((p.product_name_en || "").toLowerCase().includes(query) ||
+                       (p.brands || "").toLowerCase().includes(query))) return false;
+        if (category && p.category !== category) return false;
+
+        const labels = (p.labels || "").toLowerCase();
+        if (!selectedDietFilters.every(diet => labels.includes(diet))) return false;
+        if (!selectedAllergenFilters.every(allergen => p[`has_${allergen}`] !== "1")) return false;
+        if (nutriMaxActive && !['a', 'b'].includes(getNutriGrade(p))) return false;
+        return true;
+    });
+}
+
+function showProductPage(data, params, append) {
+    rememberProducts(data.products);
+    shownProducts = append ? shownProducts.concat(data.products) : data.products;
+    shownProductQuery = params;
+    nextProductCursor = data.next_cursor;
+    if (!nextProductCursor) {
+        shownProducts = shownProducts.concat(placeholderProductsMatching(params));
     }
+    drawProducts();
+}
 
-    if (selectedAllergenFilters.length > 0) {
-        filtered = filtered.filter(p => {
-            return selectedAllergenFilters.every(allergen => {
-                const colName = `has_${allergen}`;
-                return p[colName] !== "1";
-            });
-        });
+function showProductError(error) {
+    console.error("Error loading products:", error);
+    const container = document.getElementById("products-container");
+    if (container) {
+        container.innerHTML = "<p style='text-align: center; color: #ef4444; padding: 20px;'>Error loading products. Check console.</p>";
     }
+}
 
-    if (nutriMaxActive) {
-        filtered = filtered.filter(p => {
-            const grade = getNutriGrade(p);
-            return grade === 'a' || grade === 'b';
-        });
+// First page for the current filters
+async function renderProducts() {
+    if (!document.getElementById("products-container")) return;
 
-        filtered.sort((a, b) => {
-            const gradeA = getNutriGrade(a);
-            const gradeB = getNutriGrade(b);
-            if (gradeA === gradeB) return 0;
-            if (gradeA === 'a') return -1;
-            if (gradeB === 'a') return 1;
-            return 0;
-        });
+    // Filters can change while a page is in flight; only the latest query draws
+    const seq = ++productQuerySeq;
+    const params = productQueryParams();
+    try {
+        const data = await fetchApi('api/products', params);
+        if (seq === productQuerySeq) showProductPage(data, params, false);
+    } catch (error) {
+        if (seq === productQuerySeq) showProductError(error);
     }
+}
 
-    return filtered;
+// Next page of the products on screen
+async function loadMoreProducts() {
+    if (!nextProductCursor) return;
+
+    const seq = productQuerySeq;
+    const params = new URLSearchParams(shownProductQuery);
+    params.set("cursor", nextProductCursor);
+    try {
+        const data = await fetchApi('api/products', params);
+        params.delete("cursor");
+        if (seq === productQuerySeq) showProductPage(data, params, true);
+    } catch (error) {
+        if (seq === productQuerySeq) showProductError(error);
+    }
 }
 
 function getNutriGrade(product) {
@@ -964,13 +733,12 @@ function getNutriGrade(product) {
     return grade;
 }
 
-function renderProducts() {
+// Draw the products on screen (cart changes redraw without refetching)
+function drawProducts() {
     const container = document.getElementById("products-container");
     if (!container) return;
 
-    const filtered = getFilteredProducts();
-
-    if (filtered.length === 0) {
+    if (shownProducts.length === 0) {
         container.innerHTML = "<p style='text-align: center; color: #9ca3af; padding: 20px;'>No products found</p>";
         return;
     }
@@ -978,7 +746,7 @@ function renderProducts() {
     const grid = document.createElement("div");
     grid.className = "products-grid";
 
-    filtered.forEach((product) => {
+    shownProducts.forEach((product) => {
         const productId = `${product.product_name_en}_${product.brands}`.replace(/[^a-zA-Z0-9]/g, '_');
         const quantity = cart[productId] || 0;
         const nutriGrade = getNutriGrade(product);
@@ -1025,12 +793,25 @@ function renderProducts() {
 
     container.innerHTML = "";
     container.appendChild(grid);
+
+    if (nextProductCursor) {
+        const more = document.createElement("button");
+        more.className = "load-more-btn";
+        more.textContent = "Load more";
+        more.onclick = () => {
+            more.disabled = true;
+            loadMoreProducts();
+        };
+        container.appendChild(more);
+    }
 }
 
 // Save cart to localStorage whenever it changes
 function saveCartToStorage() {
     localStorage.setItem('b4ubuy_cart', JSON.stringify(cart));
-    localStorage.setItem('b4ubuy_products', JSON.stringify(csvData));
+    // The cart pages look products up here: keep cart items and ingredient placeholders
+    const products = csvData.filter(p => p.mock_product || cart[productKey(p)]);
+    localStorage.setItem('b4ubuy_products', JSON.stringify(products));
 }
 
 // Remove cart entries that do not exist in products list
@@ -1112,14 +893,14 @@ function addToCart(productId, productName) {
     cart[productId] = 1;
     updateCartCount();
     saveCartToStorage(); // ADD THIS
-    renderProducts();
+    drawProducts();
 }
 
 function incrementCart(productId) {
     cart[productId] = (cart[productId] || 0) + 1;
     updateCartCount();
     saveCartToStorage(); // ADD THIS
-    renderProducts();
+    drawProducts();
 }
 
 function decrementCart(productId) {
@@ -1127,7 +908,7 @@ function decrementCart(productId) {
     else delete cart[productId];
     updateCartCount();
     saveCartToStorage(); // ADD THIS
-    renderProducts();
+    drawProducts();
 }
 
 
@@ -1147,118 +928,11 @@ function updateCartCount() {
 function setupEventListeners() {
     const searchInput = document.getElementById("search-input");
     if (searchInput) {
-        searchInput.addEventListener("input", (e) => {
-            const query = e.target.value.toLowerCase();
-            if (query.length > 0) {
-                const filtered = csvData.filter(p =>
-                    (p.product_name_en && p.product_name_en.toLowerCase().includes(query)) ||
-                    (p.brands && p.brands.toLowerCase().includes(query))
-                );
-                renderSearchResults(filtered);
-            } else {
-                renderProducts();
-            }
-        });
+        // productQueryParams reads the search box
+        searchInput.addEventListener("input", () => renderProducts());
     }
 }
 
-function renderSearchResults(results) {
-    const container = document.getElementById("products-container");
-    if (!container) return;
-
-    // Apply filters to search results
-    let filtered = results;
-
-    // Diet preference filters
-    if (selectedDietFilters.length > 0) {
-        filtered = filtered.filter(p => {
-            const labels = (p.labels || "").toLowerCase();
-            return selectedDietFilters.every(diet => labels.includes(diet));
-        });
-    }
-
-    // Allergen filters
-    if (selectedAllergenFilters.length > 0) {
-        filtered = filtered.filter(p => {
-            return selectedAllergenFilters.every(allergen => {
-                const colName = `has_${allergen}`;
-                return p[colName] !== "1";
-            });
-        });
-    }
-
-    // NutriMax filter
-    if (nutriMaxActive) {
-        filtered = filtered.filter(p => {
-            const grade = getNutriGrade(p);
-            return grade === 'a' || grade === 'b';
-        });
-
-        filtered.sort((a, b) => {
-            const gradeA = getNutriGrade(a);
-            const gradeB = getNutriGrade(b);
-            if (gradeA === gradeB) return 0;
-            if (gradeA === 'a') return -1;
-            if (gradeB === 'a') return 1;
-            return 0;
-        });
-    }
-
-    if (filtered.length === 0) {
-        container.innerHTML = "<p style='text-align: center; color: #9ca3af; padding: 20px;'>No products found</p>";
-        return;
-    }
-
-    const grid = document.createElement("div");
-    grid.className = "products-grid";
-
-    filtered.forEach((product) => {
-        const productId = `${product.product_name_en}_${product.brands}`.replace(/[^a-zA-Z0-9]/g, '_');
-        const quantity = cart[productId] || 0;
-        const nutriGrade = getNutriGrade(product);
-        const nutriBadgePath = `images/nutriscore_${nutriGrade}.png`;
-
-        const card = document.createElement("div");
-        card.className = "product-card";
-
-        const productNameSanitized = sanitizeFilename(product.product_name_en);
-        const productImagePath = `images/${productNameSanitized}.jpg`;
-        
-        let cardContent = `
-        <img 
-            class="product-image" 
-            src="${productImagePath}" 
-            onerror="this.onerror=null; this.src='images/default.jpg';"
-            alt="${product.product_name_en || 'Product'}"
-        />
-    
-        <div class="product-info">
-          <div class="product-name">${product.product_name_en || "N/A"}</div>
-          <div class="product-quantity">${product.quantity || ""}</div>
-          <div class="product-footer">
-            <img class="nutri-badge" src="${nutriBadgePath}" alt="Nutri ${nutriGrade.toUpperCase()}" onerror="this.style.display='none'" />
-      `;
-
-        if (quantity === 0) {
-            cardContent += `<button class="add-btn" onclick="addToCart('${productId}', '${escapeHtml(product.product_name_en)}')">+</button>`;
-        } else {
-            cardContent += `
-          <div class="qty-control">
-            <button class="qty-btn" onclick="decrementCart('${productId}')">−</button>
-            <div class="qty-display">${quantity}</div>
-            <button class="qty-btn" onclick="incrementCart('${productId}')">+</button>
-          </div>`;
-        }
-
-        cardContent += `</div></div>`;
-        card.innerHTML = cardContent;
-        grid.appendChild(card);
-    });
-
-    container.innerHTML = "";
-    container.appendChild(grid);
-}
-
 function escapeHtml(text) {
     if (!text) return '';
     const div = document.createElement('div');
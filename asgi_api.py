@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""asyncio-native B4UBuy API (ASGI).
+
+backend_api.py holds a worker thread for the whole LLM round trip of every
+/api/analyze-cart request, so concurrency tops out at the thread count.
+Here the cart endpoints run on the event loop:
+  - matching and scoring run inline (a batch runs on a 2-thread executor)
+  - the narrative is awaited on shared AsyncOpenAI clients, capped at
+    LLM_MAX_CONCURRENCY in-flight provider calls per process
+One process can therefore hold hundreds of narrative calls in flight.
+
+Native routes:
+  POST /api/analyze-cart, POST /api/analyze-carts, GET /api/narrative/<job_id>,
+  GET /api/narrative/<job_id>/stream (SSE, polled on the loop)
+Every other route (recipes, products, health, metrics, ...) is answered by
+the Flask app from backend_api.create_app, run on a small thread pool and
+sharing the same engine.
+
+    python3 asgi_api.py --port 5000             (needs uvicorn)
+    uvicorn asgi_api:app --workers 4 --port 5000
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import telemetry
+from backend_api import DEFAULT_CSV, create_app
+from cart_llm import FastEngine, cart_lines, report_to_json
+from narrative_jobs import SSE_KEEPALIVE_S
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+ASGI_HOST = os.environ.get("ASGI_HOST", "0.0.0.0")
+ASGI_PORT = int(os.environ.get("ASGI_PORT", "5000"))
+# Threads answering the Flask (non-async) routes
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "8"))
+
+# Longest /api/narrative/<job_id>?wait= long-poll, and how often it (and the SSE stream) checks
+NARRATIVE_MAX_WAIT_S = 30.0
+NARRATIVE_POLL_S = 0.05
+
+MAX_BODY_BYTES = 1 << 20
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# ============================================================================
+# ASGI APP
+# ============================================================================
+
+
+class AsyncAPI:
+    def __init__(self, csv_path: str = DEFAULT_CSV, engine: Optional[FastEngine] = None):
+        self.csv_path = csv_path
+        self.engine = engine
+        self.error: Optional[str] = None
+        self.flask = None
+        self.wsgi_pool = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+        self.routes = {
+            ("POST", "/api/analyze-cart"): self.analyze_cart,
+            ("POST", "/api/analyze-carts"): self.analyze_carts,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"]
+        handler = self.routes.get((scope["method"], path))
+        args: Tuple[str, ...] = ()
+        rule = path
+        if handler is None and scope["method"] == "GET" and path.startswith("/api/narrative/"):
+            job_id = path[len("/api/narrative/"):]
+            if job_id.endswith("/stream"):
+                handler, args, rule = (self.stream_narrative, (send, job_id[:-len("/stream")]),
+                                       "/api/narrative/<job_id>/stream")
+            else:
+                handler, args, rule = self.get_narrative, (job_id,), "/api/narrative/<job_id>"
+
+        if handler is None or self.engine is None:
+            # Flask answers everything else, including 503s while warming up
+            try:
+                await self.wsgi(scope, receive, send)
+            except HTTPError as e:
+                await send_json(send, e.status, {"error": str(e)})
+            return
+
+        start = time.perf_counter()
+        token = telemetry.start_trace(rule, method=scope["method"])
+        try:
+            try:
+                status, body = await handler(scope, receive, *args)
+            except HTTPError as e:
+                status, body = e.status, {"error": str(e)}
+            except Exception as e:
+                print(f"❌ Error during analysis: {e}")
+                status, body = 500, {"error": f"Analysis failed: {str(e)}"}
+            if body is not None:
+                await send_json(send, status, body)
+            telemetry.HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=rule,
+                                           method=scope["method"], status=status)
+            telemetry.annotate(status=status)
+        finally:
+            telemetry.finish_trace(token)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.engine is not None:
+                    self.engine.narratives.shutdown()
+                self.wsgi_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self):
+        if self.engine is None:
+            def build():
+                print("Initializing B4UBuy engine...")
+                engine = FastEngine(csv_path=self.csv_path)
+                engine.warm_up()
+                return engine
+            try:
+                self.engine = await asyncio.get_running_loop().run_in_executor(None, build)
+                print("Engine initialized successfully")
+            except Exception as e:
+                print(f"❌ Engine initialization failed: {e}")
+                self.error = str(e)
+        # Without an engine Flask reports the failure on every route
+        self.flask = create_app(engine=self.engine) if self.engine is not None else None
+
+    # ------------------------------------------------------------------ routes
+
+    def cart_persona(self, cart: Dict[str, Any]) -> str:
+        persona = cart.get("persona", "standard")
+        weights = cart.get("weights")
+        if weights is None:
+            return persona
+        if not isinstance(weights, dict):
+            raise HTTPError(400, "weights must be an object of {nutrient: weight}")
+        try:
+            return self.engine.custom_persona(weights)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+    async def analyze_cart(self, scope, receive):
+        """Same request and response as backend_api /api/analyze-cart"""
+        data = await read_json(receive)
+        items = data.get("items", [])
+        if not items:
+            raise HTTPError(400, "No items provided")
+        if not isinstance(items, list):
+            raise HTTPError(400, "Items must be a list")
+        check_items(items)
+        persona = self.cart_persona(data)
+
+        report = await self.engine.analyze_cart_async(
+            items, persona=persona, defer_narrative=bool(data.get("defer_narrative", False)),
+            skip_narrative=bool(data.get("skip_narrative", False)),
+        )
+        return 200, report_to_json(report)
+
+    async def analyze_carts(self, scope, receive):
+        """Same request and response as backend_api /api/analyze-carts"""
+        data = await read_json(receive)
+        carts = data.get("carts", [])
+        if not isinstance(carts, list) or not carts:
+            raise HTTPError(400, "No carts provided")
+
+        pairs: List[Tuple[List[str], str]] = []
+        for i, cart in enumerate(carts):
+            items = cart.get("items") if isinstance(cart, dict) else None
+            if not isinstance(items, list) or not items:
+                raise HTTPError(400, f"Cart {i} has no items")
+            check_items(items, f"Cart {i}: ")
+            pairs.append((items, self.cart_persona(cart)))
+
+        batch = await self.engine.analyze_carts_async(
+            pairs, defer_narrative=bool(data.get("defer_narrative", False))
+        )
+        response = {
+            "carts": [report_to_json(report) for report in batch.reports],
+            "narrative": batch.final_narrative or "",
+        }
+        for cart in response["carts"]:
+            cart.pop("narrative", None)
+        if batch.narrative_job_id:
+            response["narrative_job_id"] = batch.narrative_job_id
+        return 200, response
+
+    async def get_narrative(self, scope, receive, job_id):
+        """Long-polls on the loop instead of parking a thread in NarrativeJobs.get"""
+        query = dict(pair.split("=", 1) if "=" in pair else (pair, "")
+                     for pair in scope.get("query_string", b"").decode("latin-1").split("&") if pair)
+        try:
+            wait = min(float(query.get("wait", 0) or 0), NARRATIVE_MAX_WAIT_S)
+        except ValueError:
+            raise HTTPError(400, "wait must be a number")
+
+        deadline = time.monotonic() + wait
+        while True:
+            status = self.engine.narratives.get(job_id)
+            if status is None:
+                raise HTTPError(404, "Unknown or expired narrative job")
+            if status["status"] != "pending" or time.monotonic() >= deadline:
+                return 200, status
+            await asyncio.sleep(NARRATIVE_POLL_S)
+
+    async def stream_narrative(self, scope, receive, send, job_id):
+        """Same events as backend_api /api/narrative/<job_id>/stream, without holding a thread.
+
+        Sends the response itself and returns a None body.
+        """
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")] + CORS_HEADERS,
+        })
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            keepalive = time.monotonic() + SSE_KEEPALIVE_S
+            while True:
+                status = self.engine.narratives.get(job_id)
+                if status is None:
+                    event = "event: error\ndata: {\"error\": \"Unknown narrative job\"}\n\n"
+                    break
+                if status["status"] != "pending":
+                    event = f"event: narrative\ndata: {json.dumps(status)}\n\n"
+                    break
+                if disconnect.done():
+                    return 200, None
+                if time.monotonic() >= keepalive:
+                    await send({"type": "http.response.body", "body": b": pending\n\n", "more_body": True})
+                    keepalive = time.monotonic() + SSE_KEEPALIVE_S
+                await asyncio.sleep(NARRATIVE_POLL_S)
+            await send({"type": "http.response.body", "body": event.encode("utf-8")})
+            return 200, None
+        finally:
+            disconnect.cancel()
+
+    # ------------------------------------------------------------ WSGI bridge
+
+    async def wsgi(self, scope, receive, send):
+        """Run the request through the Flask app on the WSGI thread pool"""
+        if self.flask is None:
+            status, body = (503, {"error": "Engine is warming up, retry shortly."}) if self.error is None \
+                else (500, {"error": self.error})
+            await send_json(send, status, body)
+            return
+
+        body = await read_body(receive)
+        environ = wsgi_environ(scope, body)
+        result: Dict[str, Any] = {}
+
+        def start_response(status, headers, exc_info=None):
+            result["status"] = int(status.split(" ", 1)[0])
+            result["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        def call():
+            chunks = self.flask(environ, start_response)
+            try:
+                return b"".join(chunks)
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(self.wsgi_pool, call)
+        await send({"type": "http.response.start", "status": result["status"], "headers": result["headers"]})
+        await send({"type": "http.response.body", "body": payload})
+
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def wait_disconnect(receive) -> None:
+    """Returns once the client has gone away"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def check_items(items, prefix: str = "") -> None:
+    try:
+        cart_lines(items)
+    except ValueError as e:
+        raise HTTPError(400, f"{prefix}{e}")
+
+
+async def read_json(receive) -> Dict[str, Any]:
+    try:
+        data = json.loads(await read_body(receive) or b"null")
+    except ValueError:
+        raise HTTPError(400, "Request body must be JSON")
+    if not data or not isinstance(data, dict):
+        raise HTTPError(400, "No JSON data provided")
+    return data
+
+
+async def send_json(send, status: int, body: Any) -> None:
+    payload = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode("ascii"))] + CORS_HEADERS,
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+def wsgi_environ(scope, body: bytes) -> Dict[str, Any]:
+    """Minimal PEP 3333 environ for an ASGI http scope"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": str(client[0]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key != "CONTENT_LENGTH":
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+app = AsyncAPI()
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="asyncio-native B4UBuy API")
+    parser.add_argument("--host", default=ASGI_HOST)
+    parser.add_argument("--port", type=int, default=ASGI_PORT)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("asgi_api.py needs an ASGI server: pip install uvicorn (or run `uvicorn asgi_api:app`)")
+
+    uvicorn.run("asgi_api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
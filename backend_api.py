@@ -1,40 +1,173 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import sys
 import os
+import threading
+import time
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from cart_llm import FastEngine
+from cart_llm import FastEngine, cart_lines, ingredients_response, products_response, report_to_json
+import recipe_search
+import telemetry
 
-app = Flask(__name__)
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["*"],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
-    }
-})
-
-# Initialize the engine at startup
-print("Initializing B4UBuy engine...")
-try:
-    engine = FastEngine(csv_path='openfoodfacts_precomputed.csv')
-    print("Engine initialized successfully")
-except Exception as e:
-    print(f"❌ Engine initialization failed: {e}")
-    engine = None
-
-@app.route('/api/analyze-cart', methods=['POST'])
+DEFAULT_CSV = 'openfoodfacts_precomputed.csv'
+
+api = Blueprint('api', __name__)
+
+
+class EngineState:
+    """The engine shared by the request handlers, plus readiness"""
+
+    def __init__(self):
+        self.engine = None
+        self.error = None
+        self.ready = threading.Event()
+        self.draining = False  # set by serve.py when a worker is shutting down
+
+    def load(self, csv_path=DEFAULT_CSV):
+        print("Initializing B4UBuy engine...")
+        try:
+            engine = FastEngine(csv_path=csv_path)
+            engine.warm_up()
+            self.set(engine)
+            print("Engine initialized successfully")
+        except Exception as e:
+            print(f"❌ Engine initialization failed: {e}")
+            self.error = str(e)
+
+    def set(self, engine):
+        self.engine = engine
+        self.ready.set()
+
+
+def create_app(engine=None, csv_path=DEFAULT_CSV, background=False):
+    """
+    WSGI app factory.
+
+    engine:     an already built and warmed FastEngine (e.g. from the serve.py master)
+    background: load the engine in a thread; /api/ready answers 503 until it is warm
+    Otherwise the engine is built and warmed before this returns.
+    """
+    app = Flask(__name__)
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": ["*"],
+            "methods": ["GET", "POST", "OPTIONS"],
+            "allow_headers": ["Content-Type"]
+        }
+    })
+
+    state = EngineState()
+    if engine is not None:
+        state.set(engine)
+    elif background:
+        threading.Thread(target=state.load, args=(csv_path,), name="engine-load", daemon=True).start()
+    else:
+        state.load(csv_path)
+
+    app.extensions['b4ubuy'] = state
+    app.extensions['b4ubuy_recipes'] = recipe_search.get_index()
+    app.register_blueprint(api)
+    return app
+
+
+def __getattr__(name):
+    # `backend_api:app` keeps working for WSGI servers; the app is built on first access
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def engine_state():
+    return current_app.extensions['b4ubuy']
+
+
+def engine_or_error():
+    """(engine, None) or (None, error response) while warming up / after a failed load"""
+    state = engine_state()
+    if state.engine is not None:
+        return state.engine, None
+    if state.error is None:
+        return None, (jsonify({'error': 'Engine is warming up, retry shortly.'}), 503)
+    return None, (jsonify({
+        'error': 'Engine not initialized. Check if openfoodfacts_precomputed.csv exists.'
+    }), 500)
+
+
+# ============================================================================
+# TELEMETRY
+# ============================================================================
+
+
+@api.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.trace_token = telemetry.start_trace(
+        request.url_rule.rule if request.url_rule else request.path, method=request.method
+    )
+
+
+@api.after_request
+def record_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # Route templates, not raw paths, so job ids don't each get a series
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        telemetry.HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                                       method=request.method, status=response.status_code)
+        telemetry.annotate(status=response.status_code)
+    return response
+
+
+@api.teardown_request
+def finish_request_trace(error=None):
+    telemetry.finish_trace(g.pop('trace_token', None))
+
+
+def cache_metrics(name, noun, stats):
+    """Lookup, entry and memory metrics for a NarrativeCache-style stats() dict"""
+    lookups = telemetry.Counter(f'b4ubuy_{name}_lookups_total',
+                                f'{noun} cache lookups by result', ('result',))
+    entries = telemetry.Gauge(f'b4ubuy_{name}_entries',
+                              f'{noun}s held by each cache tier', ('tier',))
+    memory = telemetry.Gauge(f'b4ubuy_{name}_memory_bytes',
+                             f'Size of the {noun.lower()}s held in process')
+    if stats is not None:
+        for result, key in (('memory_hit', 'memory_hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses')):
+            lookups.inc(stats[key], result=result)
+        entries.set(stats['memory_entries'], tier='memory')
+        if stats['disk_entries'] is not None:
+            entries.set(stats['disk_entries'], tier='disk')
+        memory.set(stats['memory_bytes'])
+    return [lookups, entries, memory]
+
+
+def custom_persona_or_error(engine, weights):
+    """(persona key, None) for a request's custom weights, or (None, 400 response)"""
+    if not isinstance(weights, dict):
+        return None, (jsonify({'error': 'weights must be an object of {nutrient: weight}'}), 400)
+    try:
+        return engine.custom_persona(weights), None
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+
+
+@api.route('/api/analyze-cart', methods=['POST'])
 def analyze_cart():
     """
     Analyze cart items and return health insights
     
     Request JSON:
     {
-        "items": ["Product Name 1", "Product Name 2"],
-        "persona": "diabetic"  // optional, default: "standard"
+        "items": ["Product Name 1", {"name": "Product Name 2", "quantity": 3}],  // quantity: packs, default 1
+        "persona": "diabetic",  // optional, default: "standard"
+        "weights": {"sugars_value": -1.0, "sodium_value": -1.0},  // optional custom persona, replaces "persona"
+        "defer_narrative": true,  // optional, return before the LLM call
+        "skip_narrative": true  // optional, no narrative at all (structured results only)
     }
     
     Response JSON:
@@ -42,14 +175,15 @@ def analyze_cart():
         "items": [...],
         "alternatives": [...],
         "swapped_cart": [...],
-        "improvement_pct": 25,
-        "narrative": "..."
+        "improvement_pct": 25,  // weighted by the grams (ml) of each item bought
+        "cart_totals": {"grams": 1250.0, "unsized_items": 0, "nutrients": {...}, "nutrients_after_swaps": {...}},
+        "narrative": "...",  // "" when deferred
+        "narrative_job_id": "..."  // only when deferred, see /api/narrative/<id>
     }
     """
-    if not engine:
-        return jsonify({
-            'error': 'Engine not initialized. Check if openfoodfacts_precomputed.csv exists.'
-        }), 500
+    engine, error = engine_or_error()
+    if error:
+        return error
     
     try:
         # Get request data
@@ -60,6 +194,8 @@ def analyze_cart():
         
         items = data.get('items', [])
         persona = data.get('persona', 'standard')
+        defer_narrative = bool(data.get('defer_narrative', False))
+        skip_narrative = bool(data.get('skip_narrative', False))
         
         # Validate
         if not items or len(items) == 0:
@@ -67,42 +203,24 @@ def analyze_cart():
         
         if not isinstance(items, list):
             return jsonify({'error': 'Items must be a list'}), 400
+
+        try:
+            cart_lines(items)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if data.get('weights') is not None:
+            persona, error = custom_persona_or_error(engine, data['weights'])
+            if error:
+                return error
         
         # Analyze cart
         print(f"Analyzing {len(items)} items for {persona} persona...")
-        report = engine.analyze_cart(items, persona=persona)
-        
-        # Build response
-        response = {
-            'items': [
-                {
-                    'name': scored_item.product.name,
-                    'label': scored_item.product.health_label,
-                    'explanation': scored_item.explanation,
-                    'score': scored_item.product.health_score
-                }
-                for scored_item in report.items
-            ],
-            'alternatives': [
-                {
-                    'original_name': alt.original.product.name,
-                    'replacement_name': alt.replacement.name,
-                    'advantage': alt.advantage,
-                    'improvement': alt.improvement
-                }
-                for alt in report.alternatives
-            ],
-            'swapped_cart': [
-                {
-                    'name': product.name,
-                    'label': product.health_label
-                }
-                for product in (report.swapped_cart or [])
-            ],
-            'improvement_pct': report.improvement_pct or 0,
-            'narrative': report.final_narrative or ''
-        }
+        report = engine.analyze_cart(items, persona=persona, defer_narrative=defer_narrative,
+                                     skip_narrative=skip_narrative)
         
+        response = report_to_json(report)
+
         print(f"✅ Analysis complete: {len(response['items'])} items, {len(response['alternatives'])} alternatives")
         return jsonify(response), 200
     
@@ -114,22 +232,314 @@ def analyze_cart():
             'error': f'Analysis failed: {str(e)}'
         }), 500
 
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/analyze-carts', methods=['POST'])
+def analyze_carts():
+    """
+    Analyze many carts (e.g. one per household member) in one call
+
+    Request JSON:
+    {
+        "carts": [
+            {"items": ["Product Name 1"], "persona": "diabetic"},
+            {"items": ["Product Name 1", "Product Name 2"], "persona": "elderly"},
+            {"items": ["Product Name 3"], "weights": {"sugars_value": -1.0, "sodium_value": -1.0}}
+        ],
+        "defer_narrative": true  // optional
+    }
+
+    Response JSON:
+    {
+        "carts": [<same shape as /api/analyze-cart, without narrative>, ...],
+        "narrative": "...",  // one combined narrative, "" when deferred
+        "narrative_job_id": "..."  // only when deferred
+    }
+    """
+    engine, error = engine_or_error()
+    if error:
+        return error
+
+    try:
+        data = request.get_json()
+
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+
+        carts = data.get('carts', [])
+        if not isinstance(carts, list) or not carts:
+            return jsonify({'error': 'No carts provided'}), 400
+
+        pairs = []
+        for i, cart in enumerate(carts):
+            items = cart.get('items') if isinstance(cart, dict) else None
+            if not isinstance(items, list) or not items:
+                return jsonify({'error': f'Cart {i} has no items'}), 400
+            try:
+                cart_lines(items)
+            except ValueError as e:
+                return jsonify({'error': f'Cart {i}: {e}'}), 400
+            persona = cart.get('persona', 'standard')
+            if cart.get('weights') is not None:
+                persona, error = custom_persona_or_error(engine, cart['weights'])
+                if error:
+                    return error
+            pairs.append((items, persona))
+
+        print(f"Analyzing {len(pairs)} carts...")
+        batch = engine.analyze_carts(
+            pairs, defer_narrative=bool(data.get('defer_narrative', False))
+        )
+
+        response = {
+            'carts': [report_to_json(report) for report in batch.reports],
+            'narrative': batch.final_narrative or ''
+        }
+        for cart in response['carts']:
+            cart.pop('narrative', None)
+        if batch.narrative_job_id:
+            response['narrative_job_id'] = batch.narrative_job_id
+
+        print(f"✅ Batch analysis complete: {len(response['carts'])} carts")
+        return jsonify(response), 200
+
+    except Exception as e:
+        print(f"❌ Error during batch analysis: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'error': f'Analysis failed: {str(e)}'
+        }), 500
+
+
+@api.route('/api/narrative/<job_id>', methods=['GET'])
+def get_narrative(job_id):
+    """
+    Deferred narrative for an /api/analyze-cart call.
+
+    Query: ?wait=<seconds> to long-poll (capped by the job deadline)
+
+    Response JSON:
+    {
+        "status": "pending" | "done" | "fallback",
+        "narrative": "..."  // null while pending
+    }
+    """
+    engine, error = engine_or_error()
+    if error:
+        return error
+
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'wait must be a number'}), 400
+
+    status = engine.narratives.get(job_id, wait=min(wait, 30.0))
+    if status is None:
+        return jsonify({'error': 'Unknown or expired narrative job'}), 404
+    return jsonify(status), 200
+
+
+@api.route('/api/narrative/<job_id>/stream', methods=['GET'])
+def stream_narrative(job_id):
+    """Deferred narrative as server-sent events (one `narrative` event)"""
+    engine, error = engine_or_error()
+    if error:
+        return error
+
+    return Response(
+        stream_with_context(engine.narratives.stream(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@api.route('/api/recipes/search', methods=['GET'])
+def search_recipes():
+    """
+    Recipe search (same ranking as the old app.js findRecipesByDish)
+
+    Query: ?q=<dish>&k=5 [&cuisine=&course=&diet= exact-value filters]
+
+    Response JSON:
+    {
+        "query": "...",
+        "results": [{"recipe": {<Food_Recipe.csv row>}, "score": 90, "match_type": "starts_with"}],
+        "examples": ["...", ...]  // only when nothing matched
+    }
+    """
+    try:
+        response = recipe_search.search_response(
+            request.args, current_app.extensions['b4ubuy_recipes']
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(response), 200
+
+
+@api.route('/api/recipes/autocomplete', methods=['GET'])
+def autocomplete_recipes():
+    """
+    Recipe name suggestions (prefix matches first), or facet values
+
+    Query: ?q=<text>&k=8 [&field=name|cuisine|course|diet]
+
+    Response JSON:
+    {"query": "...", "suggestions": [{"name": "...", "cuisine": "...", "score": 10}]}
+    """
+    try:
+        response = recipe_search.autocomplete_response(
+            request.args, current_app.extensions['b4ubuy_recipes']
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(response), 200
+
+
+@api.route('/api/recipes/ingredients', methods=['POST'])
+def match_recipe_ingredients():
+    """
+    Catalogue products for every ingredient of a recipe, in one call
+
+    Request JSON:
+    {
+        "ingredients": ["Turmeric powder (Haldi)", "Ghee", ...],
+        "persona": "diabetic",  // optional, default: "standard"
+        "k": 3  // optional, products per ingredient
+    }
+
+    Response JSON:
+    {
+        "persona": "diabetic",
+        "ingredients": [
+            {"name": "Ghee", "key": "ghee", "found": true,
+             "products": [{<catalogue fields>, "health_score": 0.2, "health_label": "amber", "match_score": 1.0}]}
+        ]
+    }
+    """
+    engine, error = engine_or_error()
+    if error:
+        return error
+
+    try:
+        response = ingredients_response(engine, request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(response), 200
+
+
+@api.route('/api/products', methods=['GET'])
+def query_products():
+    """
+    One page of the catalogue under the shopping screen's filters
+
+    Query (all optional):
+        ?category=Snacks&subcategory=...
+        &diet=vegan&diet=no gluten       // labels contain every diet tag
+        &allergen=milk&allergen=nuts     // has_<allergen> is not 1, for each
+        &grade=a&grade=b                 // nutri grade is any of these
+        &q=text                          // name or brand contains text
+        &sort=catalogue|nutri|score      // score: persona health score, best first
+        &persona=standard&limit=60&cursor=<next_cursor of the previous page>
+
+    Response JSON:
+    {
+        "products": [{<catalogue fields>, "health_score": 0.8, "health_label": "green"}],
+        "total": 412,  // products matching the filters
+        "next_cursor": "..."  // null on the last page
+    }
+    """
+    engine, error = engine_or_error()
+    if error:
+        return error
+
+    try:
+        response = products_response(engine, request.args.to_dict(flat=False))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(response), 200
+
+
+@api.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (liveness: answers even while the engine warms up)"""
+    engine = engine_state().engine
     return jsonify({
         'status': 'ok',
-        'engine_loaded': engine is not None
+        'engine_loaded': engine is not None,
+        'narrative_cache': engine.llm.cache.stats() if engine else None,
+        'report_cache': engine.reports.stats() if engine else None,
+        'custom_personas': engine.store.custom.stats() if engine else None
+    }), 200
+
+
+@api.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: 200 once the engine is built and warm, 503 while it is
+    warming up or this worker is draining for shutdown.
+
+    Query: ?wait=<seconds> to block until ready (capped at 30)
+    """
+    state = engine_state()
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'wait must be a number'}), 400
+    if wait > 0:
+        state.ready.wait(min(wait, 30.0))
+
+    if state.draining:
+        return jsonify({'ready': False, 'reason': 'draining'}), 503
+    if not state.ready.is_set():
+        reason = 'failed' if state.error else 'warming_up'
+        return jsonify({'ready': False, 'reason': reason}), 503
+    return jsonify({'ready': True, 'pid': os.getpid()}), 200
+
+@api.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text format; every serve.py worker keeps its own numbers"""
+    engine = engine_state().engine
+    body = telemetry.render(
+        cache_metrics('narrative_cache', 'Narrative', engine.llm.cache.stats() if engine else None)
+        + cache_metrics('report_cache', 'Report', engine.reports.stats() if engine else None)
+    )
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+@api.route('/api/traces', methods=['GET'])
+def recent_traces():
+    """
+    Full per-request traces kept by sampling (TRACE_SAMPLE_RATE), newest first.
+
+    Query: ?limit=<n> (default 20)
+    """
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify({
+        'sample_rate': telemetry.TRACE_SAMPLE_RATE,
+        'pid': os.getpid(),
+        'traces': telemetry.recent_traces(max(limit, 0)),
     }), 200
 
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def home():
     """Home endpoint"""
     return jsonify({
         'message': 'B4UBuy Cart Analysis API',
         'endpoints': {
             '/api/analyze-cart': 'POST - Analyze cart items',
-            '/api/health': 'GET - Health check'
+            '/api/analyze-carts': 'POST - Analyze many carts/personas in one call',
+            '/api/narrative/<job_id>': 'GET - Deferred narrative (?wait=seconds)',
+            '/api/narrative/<job_id>/stream': 'GET - Deferred narrative as SSE',
+            '/api/health': 'GET - Health check',
+            '/api/ready': 'GET - Readiness (503 until the engine is warm)',
+            '/api/recipes/search': 'GET - Recipe search (?q=dish)',
+            '/api/recipes/autocomplete': 'GET - Recipe name suggestions (?q=text)',
+            '/api/recipes/ingredients': 'POST - Catalogue products for a recipe\'s ingredients',
+            '/api/products': 'GET - Filtered, paged catalogue (?category=&diet=&allergen=&grade=&q=&sort=&cursor=)',
+            '/api/metrics': 'GET - Latency histograms and counters (Prometheus text format)',
+            '/api/traces': 'GET - Recently sampled request traces (?limit=n)'
         }
     }), 200
 
@@ -139,8 +549,10 @@ if __name__ == '__main__':
     print("="*60)
     print("Server: http://127.0.0.1:5000")
     print("Endpoint: POST http://127.0.0.1:5000/api/analyze-cart")
+    print("Development server - for production use: python3 serve.py")
     print("="*60 + "\n")
     
+    app = create_app()
     app.run(
         host='127.0.0.1',
         port=5000,
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite: startup, data prep and per-request costs at several catalogue sizes.
+
+For every scale (number of synthetic products) it:
+  1. writes a synthetic OpenFoodFacts-shaped export (synthetic_catalogue.py)
+  2. times each data-prep script on it:
+     data_ingestion -> data_transformation -> data_structuring -> precompute
+  3. times FastEngine construction over the precomputed output
+  4. times analyze_cart stage by stage (match / report / narrative) and end
+     to end. The narrative calls go to a local stub of the chat-completions
+     API, so the numbers exclude network and model latency.
+  5. measures matcher throughput (cart item names -> rows) and alternative
+     lookup throughput
+`import cart_llm` is timed once, in fresh interpreters.
+
+Results are written as JSON and compared against a saved baseline.
+A metric regresses when it is worse by more than its threshold (relative)
+and by more than its noise floor (absolute). Any regression makes the run
+exit with status 1.
+
+Baselines are only comparable on the machine that produced them; record
+one with --save-baseline before comparing.
+
+Usage:
+    python3 benchmark.py                          # default scales, compare to benchmark_baseline.json
+    python3 benchmark.py --scales 3000,100000,1000000
+    python3 benchmark.py --save-baseline          # record this run as the baseline
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import data_ingestion
+import data_structuring
+import data_transformation
+import precompute
+import synthetic_catalogue
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, ".benchmark")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results.json")
+BASELINE_PATH = os.path.join(BASE_DIR, "benchmark_baseline.json")
+
+# Bump when metrics are renamed or measured differently
+RESULTS_VERSION = 1
+
+DEFAULT_SCALES = (3_000, 30_000)
+
+# Default allowed slowdown before a metric counts as a regression (0.25 = 25%)
+REGRESSION_THRESHOLD = float(os.environ.get("BENCH_REGRESSION_THRESHOLD", "0.25"))
+
+SEED = 7
+CARTS = 200            # carts analyzed per scale
+CART_SIZE = 8          # items per cart
+MATCH_QUERIES = 1_000  # item names for the matcher throughput run
+ALT_LOOKUPS = 5_000    # scored items for the alternative lookup run
+THROUGHPUT_RUNS = 5    # passes per throughput run; the best one counts
+ANALYZE_RUNS = 3       # passes over the carts; each percentile keeps its best pass
+IMPORT_RUNS = 3        # fresh interpreters timing `import cart_llm`
+ENGINE_RUNS = 3        # FastEngine constructions per scale
+
+# metric -> (unit, which direction is better, relative threshold or None for
+# the default, noise floor in the metric's unit). One-shot wall times (import,
+# data prep) swing with the page cache, so they get more room.
+METRICS: Dict[str, Tuple[str, str, Optional[float], float]] = {
+    "import.cart_llm_s": ("s", "lower", 0.5, 0.1),
+    "prep.ingest_s": ("s", "lower", 0.5, 0.1),
+    "prep.transform_s": ("s", "lower", 0.5, 0.1),
+    "prep.structure_s": ("s", "lower", 0.5, 0.1),
+    "prep.precompute_s": ("s", "lower", 0.5, 0.1),
+    "engine.construct_s": ("s", "lower", None, 0.05),
+    "analyze.match_ms_p50": ("ms", "lower", None, 0.2),
+    "analyze.match_ms_p95": ("ms", "lower", 0.5, 0.5),
+    "analyze.report_ms_p50": ("ms", "lower", None, 0.2),
+    "analyze.report_ms_p95": ("ms", "lower", 0.5, 0.5),
+    "analyze.narrative_ms_p50": ("ms", "lower", None, 0.5),
+    "analyze.narrative_ms_p95": ("ms", "lower", 0.5, 1.0),
+    "analyze.total_ms_p50": ("ms", "lower", None, 0.5),
+    "analyze.total_ms_p95": ("ms", "lower", 0.5, 1.0),
+    "matcher.queries_per_s": ("/s", "higher", None, 0.0),
+    "alternatives.lookups_per_s": ("/s", "higher", 0.5, 0.0),
+    "alternatives.lookup_ms_p50": ("ms", "lower", 0.5, 0.05),
+    "alternatives.lookup_ms_p99": ("ms", "lower", 0.5, 0.2),
+}
+
+STUB_NARRATIVE = "Benchmark narrative."
+
+
+# ============================================================================
+# LLM STUB
+# ============================================================================
+
+
+class StubLLMServer:
+    """
+    Local chat-completions endpoint; cart_llm's providers are pointed at it
+    through THESYS_BASE_URL / OPENROUTER_BASE_URL
+    """
+
+    def __init__(self, latency_s: float = 0.0):
+        latency = latency_s
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes; without this each call
+            # waits out a delayed ACK on the keep-alive connection
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if latency:
+                    time.sleep(latency)
+                body = json.dumps({
+                    "id": "bench", "object": "chat.completion", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": STUB_NARRATIVE}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name="llm-stub", daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the progress prints of the code being timed"""
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            yield
+
+
+def timed(func: Callable, *args, **kwargs) -> Tuple[float, Any]:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def best_rate(work: Callable[[], Any], items: int, runs: int = THROUGHPUT_RUNS) -> float:
+    """Items per second of the fastest of `runs` passes"""
+    return items / min(timed(work)[0] for _ in range(runs))
+
+
+def percentiles(name: str, samples_s: Sequence[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_s) * 1000
+    return {f"{name}_ms_p50": float(np.percentile(ms, 50)),
+            f"{name}_ms_p95": float(np.percentile(ms, 95))}
+
+
+def item_queries(names: Sequence[str], n: int, rng: np.random.Generator) -> List[str]:
+    """Cart-style item names: exact names, their first words, and one-letter typos"""
+    queries = []
+    for i, idx in enumerate(rng.integers(0, len(names), size=n).tolist()):
+        name = names[idx]
+        words = name.split()
+        if i % 3 == 1 and len(words) > 2:
+            name = " ".join(words[:2])
+        elif i % 3 == 2 and len(name) > 5:
+            cut = int(rng.integers(1, len(name) - 1))
+            name = name[:cut] + name[cut + 1:]
+        queries.append(name.lower())
+    return queries
+
+
+# ============================================================================
+# BENCHMARKS
+# ============================================================================
+
+
+def bench_import(runs: int = IMPORT_RUNS) -> Dict[str, float]:
+    """`import cart_llm` in fresh interpreters (median)"""
+    code = "import time; t = time.perf_counter(); import cart_llm; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR, check=True,
+                             capture_output=True, text=True).stdout
+        samples.append(float(out.strip().splitlines()[-1]))
+    return {"import.cart_llm_s": statistics.median(samples)}
+
+
+def bench_prep(rows: int, work_dir: str) -> Tuple[Dict[str, float], Dict[str, Any], str]:
+    """Generate the catalogue and run every data-prep script on it"""
+    os.makedirs(work_dir, exist_ok=True)
+    raw = os.path.join(work_dir, "export.tsv")
+    extracted = os.path.join(work_dir, "extracted.csv")
+    final = os.path.join(work_dir, "final.csv")
+    categorized = os.path.join(work_dir, "categorized.csv")
+    precomputed = os.path.join(work_dir, "precomputed.csv")
+
+    generate_s, size = timed(synthetic_catalogue.generate, rows, raw, SEED)
+    with quiet():
+        ingest_s, (_, extracted_rows) = timed(data_ingestion.run, raw, extracted)
+        transform_s, (_, final_rows) = timed(data_transformation.run, extracted, final)
+        structure_s, categorized_df = timed(data_structuring.run, final, categorized)
+        precompute_s, _ = timed(precompute.run, categorized, precomputed, force=True)
+
+    metrics = {
+        "prep.ingest_s": ingest_s,
+        "prep.transform_s": transform_s,
+        "prep.structure_s": structure_s,
+        "prep.precompute_s": precompute_s,
+    }
+    info = {
+        "export_mb": round(size / 1e6, 1),
+        "generate_s": round(generate_s, 2),
+        "rows": {"export": rows, "extracted": extracted_rows, "final": final_rows,
+                 "categorized": len(categorized_df)},
+    }
+    return metrics, info, precomputed
+
+
+def bench_engine(precomputed: str, runs: int = ENGINE_RUNS):
+    """FastEngine construction over the precomputed sidecars (median); returns the last engine"""
+    from cart_llm import FastEngine
+
+    samples = []
+    engine = None
+    for _ in range(runs):
+        with quiet():
+            elapsed, engine = timed(FastEngine, precomputed)
+        samples.append(elapsed)
+    with quiet():
+        engine.warm_up()
+    return {"engine.construct_s": statistics.median(samples)}, engine
+
+
+def analyze_pass(engine, cart_list: List[Tuple[List[str], str]]) -> Dict[str, float]:
+    match_s, report_s, narrative_s, total_s = [], [], [], []
+    with quiet():
+        for items, persona in cart_list:
+            t0 = time.perf_counter()
+            matched = [p for p in (engine.matcher.find_product(n, persona) for n in items) if p]
+            t1 = time.perf_counter()
+            _, report_data = engine._build_report(matched, persona)
+            t2 = time.perf_counter()
+            engine.llm.generate_narrative(report_data)
+            t3 = time.perf_counter()
+            match_s.append(t1 - t0)
+            report_s.append(t2 - t1)
+            narrative_s.append(t3 - t2)
+
+        for items, persona in cart_list:
+            elapsed, _ = timed(engine.analyze_cart, items, persona)
+            total_s.append(elapsed)
+
+    metrics: Dict[str, float] = {}
+    for name, samples in (("match", match_s), ("report", report_s),
+                          ("narrative", narrative_s), ("total", total_s)):
+        metrics.update(percentiles(f"analyze.{name}", samples))
+    return metrics
+
+
+def bench_analyze(engine, rng: np.random.Generator, carts: int = CARTS,
+                  cart_size: int = CART_SIZE, runs: int = ANALYZE_RUNS) -> Dict[str, float]:
+    """analyze_cart stage by stage, then end to end, over the same carts"""
+    names = engine.store.column("name")
+    personas = precompute.personas
+    cart_list = [(item_queries(names, cart_size, rng), personas[i % len(personas)])
+                 for i in range(carts)]
+    passes = [analyze_pass(engine, cart_list) for _ in range(runs)]
+    return {name: min(p[name] for p in passes) for name in passes[0]}
+
+
+def bench_matcher(engine, rng: np.random.Generator, n: int = MATCH_QUERIES) -> Dict[str, float]:
+    queries = item_queries(engine.store.column("name"), n, rng)
+    rate = best_rate(lambda: [engine.matcher.find_index(q) for q in queries], len(queries))
+    return {"matcher.queries_per_s": rate}
+
+
+def bench_alternatives(engine, rng: np.random.Generator, n: int = ALT_LOOKUPS) -> Dict[str, float]:
+    from cart_llm import FastScorer
+
+    personas = precompute.personas
+    rows = rng.integers(0, len(engine.store), size=n).tolist()
+    scored = [FastScorer.score_item(engine.store.product(idx, personas[i % len(personas)]),
+                                    personas[i % len(personas)])
+              for i, idx in enumerate(rows)]
+    finder = engine.alt_finder
+    rate = best_rate(lambda: [finder.find_alternative(s, s.persona, exclude={s.product.product_id})
+                              for s in scored], len(scored))
+
+    # Per-lookup latency of the items that search (GREEN ones return at once);
+    # each lookup keeps its fastest pass, each percentile is over those
+    searched = [s for s in scored if s.product.health_label != "green"] or scored
+    fastest = np.full(len(searched), np.inf)
+    for _ in range(THROUGHPUT_RUNS):
+        for i, s in enumerate(searched):
+            elapsed, _ = timed(lambda: finder.find_alternative(s, s.persona, exclude={s.product.product_id}))
+            fastest[i] = min(fastest[i], elapsed)
+    ms = fastest * 1000
+    return {"alternatives.lookups_per_s": rate,
+            "alternatives.lookup_ms_p50": float(np.percentile(ms, 50)),
+            "alternatives.lookup_ms_p99": float(np.percentile(ms, 99))}
+
+
+def run_suite(scales: Sequence[int] = DEFAULT_SCALES, carts: int = CARTS,
+              llm_latency_s: float = 0.0) -> Dict[str, Any]:
+    stub = StubLLMServer(llm_latency_s)
+    # cart_llm reads these at import time; the narrative and report caches
+    # would turn every repeated cart into a cache hit
+    os.environ["THESYS_BASE_URL"] = stub.url
+    os.environ["OPENROUTER_BASE_URL"] = stub.url
+    os.environ["NARRATIVE_CACHE_SIZE"] = "0"
+    os.environ.pop("NARRATIVE_CACHE_DB", None)
+    os.environ["REPORT_CACHE_SIZE"] = "0"
+    os.environ.pop("REPORT_CACHE_DB", None)
+    os.environ.pop("LLM_HEDGE_DELAY_S", None)
+    # Track the neighbour index even where ALTERNATIVES_BY=score is set
+    os.environ["ALTERNATIVES_BY"] = "nearest"
+
+    results: Dict[str, Dict[str, float]] = {}
+    info: Dict[str, Any] = {}
+    try:
+        print("[benchmark] import cart_llm...")
+        results["startup"] = bench_import()
+
+        for rows in scales:
+            group = str(rows)
+            print(f"[benchmark] {rows:,} products: data prep...")
+            metrics, info[group], precomputed = bench_prep(rows, os.path.join(BENCH_DIR, f"n{rows}"))
+
+            print(f"[benchmark] {rows:,} products: engine and requests...")
+            engine_metrics, engine = bench_engine(precomputed)
+            metrics.update(engine_metrics)
+            rng = np.random.default_rng(SEED)
+            metrics.update(bench_analyze(engine, rng, carts))
+            metrics.update(bench_matcher(engine, rng))
+            metrics.update(bench_alternatives(engine, rng))
+            results[group] = metrics
+    finally:
+        stub.close()
+
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+        },
+        "config": {"seed": SEED, "carts": carts, "cart_size": CART_SIZE,
+                   "llm_latency_s": llm_latency_s},
+        "results": results,
+        "info": info,
+    }
+
+
+# ============================================================================
+# COMPARISON
+# ============================================================================
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    One row per metric present in both runs. status is "regressed",
+    "improved" or "ok". Groups that only one of the runs has are skipped.
+    """
+    rows = []
+    for group, metrics in current["results"].items():
+        base_metrics = baseline.get("results", {}).get(group)
+        if base_metrics is None:
+            continue
+        for name, value in metrics.items():
+            if name not in base_metrics or name not in METRICS:
+                continue
+            base = base_metrics[name]
+            unit, better, metric_threshold, floor = METRICS[name]
+            limit = threshold if threshold is not None else (metric_threshold or REGRESSION_THRESHOLD)
+
+            # Positive = worse, relative to the baseline
+            worse_by = (value - base) if better == "lower" else (base - value)
+            change = worse_by / base if base else 0.0
+            status = "ok"
+            if change > limit and worse_by > floor:
+                status = "regressed"
+            elif change < -limit and -worse_by > floor:
+                status = "improved"
+            rows.append({"group": group, "metric": name, "unit": unit, "baseline": base,
+                         "current": value, "change": change, "status": status})
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]]) -> None:
+    print(f"{'group':<9}{'metric':<30}{'baseline':>12}{'current':>12}{'worse by':>10}  status")
+    for row in rows:
+        print(f"{row['group']:<9}{row['metric']:<30}{row['baseline']:>12.4g}{row['current']:>12.4g}"
+              f"{row['change']:>+10.1%}  {row['status']}")
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for group, metrics in results["results"].items():
+        print(f"\n[{group}]")
+        for name, value in metrics.items():
+            print(f"  {name:<30}{value:>12.4g} {METRICS.get(name, ('',))[0]}")
+
+
+def write_json(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(path + ".tmp", path)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="B4UBuy benchmark suite")
+    parser.add_argument("--scales", default=",".join(str(s) for s in DEFAULT_SCALES),
+                        help="comma-separated catalogue sizes, e.g. 3000,100000,1000000")
+    parser.add_argument("--carts", type=int, default=CARTS, help="carts analyzed per scale")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0,
+                        help="delay added by the LLM stub per call")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write this run's JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="allowed relative slowdown for every metric (default: per metric)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write this run to --baseline instead of comparing")
+    args = parser.parse_args(argv)
+
+    scales = [int(s.replace("_", "")) for s in args.scales.split(",") if s.strip()]
+    current = run_suite(scales, args.carts, args.llm_latency_ms / 1000)
+    write_json(args.output, current)
+    print_results(current)
+    print(f"\nSaved results to {args.output}")
+
+    if args.save_baseline:
+        write_json(args.baseline, current)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        print(f"No baseline at {args.baseline} (record one with --save-baseline)")
+        return 0
+    if baseline.get("version") != RESULTS_VERSION:
+        print(f"Baseline {args.baseline} is from another results version; not comparing")
+        return 0
+
+    rows = compare(current, baseline, args.threshold)
+    print(f"\nCompared with {args.baseline} ({baseline.get('created', '?')}):")
+    print_comparison(rows)
+    regressions = [r for r in rows if r["status"] == "regressed"]
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,7 +26,7 @@ async function analyzeCart() {
             if (product && product.product_name_en) {
                 cartItems.push({
                     name: product.product_name_en,
-                    quantity: quantity
+                    quantity: Number(quantity)
                 });
             }
         }
@@ -39,12 +39,10 @@ async function analyzeCart() {
     }
 
     try {
-        const itemNames = cartItems.map(item => item.name);
-
         const response = await fetch('api/analyze-cart', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ items: itemNames, persona: currentPersona })
+            body: JSON.stringify({ items: cartItems, persona: currentPersona, skip_narrative: true })
         });
 
         if (!response.ok) return;
@@ -8,96 +8,50 @@ Original file is located at
     https://colab.research.google.com/drive/1wUGPTWPOSN-FRTFCNjPoEzVVjeKJzqlk
 """
 
-#only to be run the first time (after that no need to run this)
-import pandas as pd
+from __future__ import annotations
+
 import numpy as np
+import json
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, List, Literal, Optional, Dict, Any, Sequence, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
 import os
+import contextvars
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 
+# Persona tables live with the precompute (run `python precompute.py` to rebuild scores)
+from precompute import (
+    NUTRICOLS, NOVA_COL, ALTERNATIVES_TOP_N, personas, weights,
+    alternatives_path, rank_alternatives, read_manifest,
+    weight_vector, score_vector, GREEN_MIN_SCORE, AMBER_MIN_SCORE,
+    QUANTITY_COL, quantity_columns,
+)
+from search_index import ProductSearchIndex, index_path_for
+from ingredient_match import MATCH_TOP_K, IngredientMatcher, ingredient_map_path_for
+import product_filters
+import recipe_search
+from product_filters import FilterIndex, filters_path_for
+import catalogue
+from catalogue import Catalogue, StringTable, catalogue_path_for
+from narrative_jobs import NarrativeJobs
+from narrative_cache import NarrativeCache, cache_key
+from report_cache import ReportCache, line_order, normalise_lines
+from nutrient_neighbours import NeighbourIndex, PersonaBoxes, allergen_mask
+import telemetry
+
+# pandas (CSV fallback only) and the OpenAI SDK (built with the LLM clients)
+# are imported where they are used, so importing this module stays cheap for
+# serverless handlers that map the binary catalogue
+if TYPE_CHECKING:
+    import pandas as pd
+
 # Resolve file paths relative to this module so relative CWDs won't break imports
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CATEGORIZED_CSV = os.path.join(BASE_DIR, 'openfoodfacts_categorized.csv')
-PRECOMPUTED_CSV = os.path.join(BASE_DIR, 'openfoodfacts_precomputed.csv')
-
-# Load dataset (confirmed columns from your CSV)
-if not Path(CATEGORIZED_CSV).exists():
-    raise FileNotFoundError(f"Required CSV not found: {CATEGORIZED_CSV}")
-df = pd.read_csv(CATEGORIZED_CSV)
-
-# Your exact nutrient columns
-NUTRICOLS = ['energy-kcal_value', 'fat_value', 'saturated-fat_value', 'carbohydrates_value',
-             'sugars_value', 'fiber_value', 'proteins_value', 'sodium_value']
-
-# Your exact personas
-personas = ["standard", "diabetic", "hypertension", "bodybuilder", "vegan", "vegetarian",
-            "eggetarian", "jain", "pregnancy", "lactating", "elderly"]
-
-# Your exact persona weights
-weights = {
-    "standard": {'proteins_value': 0.6, 'fiber_value': 0.4, 'sugars_value': -0.6, 'sodium_value': -0.4},
-    "diabetic": {'sugars_value': -1.0, 'fiber_value': 0.6, 'proteins_value': 0.3},
-    "hypertension": {'sodium_value': -1.0, 'fiber_value': 0.4, 'proteins_value': 0.3, 'saturated-fat_value': -0.3},
-    "bodybuilder": {'proteins_value': 1.0, 'fiber_value': 0.5, 'sodium_value': -0.5, 'sugars_value': -0.3},
-    "vegan": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
-    "vegetarian": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
-    "eggetarian": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
-    "jain": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
-    "pregnancy": {'proteins_value': 0.8, 'fiber_value': 0.5, 'sodium_value': -0.7, 'sugars_value': -0.6},
-    "lactating": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.5, 'sodium_value': -0.4},
-    "elderly": {'proteins_value': 0.5, 'fiber_value': 0.4, 'sodium_value': -0.8, 'sugars_value': -0.5}
-}
-
-print("Precomputing health scores for all 11 personas (~3min)...")
-for persona in personas:
-    print(f"   {persona}...")
-
-    w = weights[persona]
-    scores = []  # FIXED: Initialize list outside loop
-
-    for _, row in df.iterrows():
-        score = 0.0
-        weight_sum = 0.0
-
-        for col, weight in w.items():
-            val = row.get(col, 0)
-            if pd.notna(val):
-                weight_sum += abs(weight)
-                if weight < 0:  # Penalty
-                    score += weight * -val
-                else:  # Bonus
-                    score += weight * val
-
-        if weight_sum < 1e-3:
-            nova = row.get('off_nova_groups', 1)
-            if pd.notna(nova):
-                score = 0.2 - (nova - 1) * 0.3  # NOVA fallback
-            else:
-                score = 0.0
-            weight_sum = 1.0
-
-        norm_score = np.clip(score / max(weight_sum, 10.0), -1.0, 1.0)
-        scores.append(norm_score)  # FIXED: Append to list
-
-    # Assign scores (your exact bug fix)
-    df[f'health_score_{persona}'] = scores
-    df[f'health_label_{persona}'] = ['green' if s >= 0.25 else 'amber' if s >= -0.25 else 'red' for s in scores]
-
-    # Nutrient completeness for confidence (your logic)
-    completeness = df[NUTRICOLS].notna().sum(axis=1) / len(NUTRICOLS)
-    df[f'health_confidence_{persona}'] = ['high' if c >= 0.5 else 'low' for c in completeness]
-
-# Save precomputed file
-df.to_csv(PRECOMPUTED_CSV, index=False)
-print(f"SAVED {PRECOMPUTED_CSV} - {len(df)} products, {len(personas)*3} columns added!")
-print("Columns: health_score_X, health_label_X, health_confidence_X for all personas")
-
-import pandas as pd
-import numpy as np
-import json
-from dataclasses import dataclass
-from typing import List, Literal, Optional, Dict, Any
-from openai import OpenAI
-import os
 
 # ============================================================================
 # CONFIG
@@ -107,6 +61,42 @@ OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "sk-or-v1-9def0c1a8c75
 
 os.environ["THESYS_API_KEY"] = THESYS_API_KEY
 
+# LLM providers (base URLs overridable, e.g. to point at a local stub server)
+THESYS_BASE_URL = os.environ.get("THESYS_BASE_URL", "https://api.thesys.dev")
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_MODEL = os.environ.get("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet")
+
+# Per-call deadlines (seconds); a stuck upstream can no longer pin a worker
+THESYS_TIMEOUT_S = float(os.environ.get("THESYS_TIMEOUT_S", "10"))
+OPENROUTER_TIMEOUT_S = float(os.environ.get("OPENROUTER_TIMEOUT_S", "10"))
+
+# Hedged mode: start OpenRouter if Thesys hasn't answered after this many
+# seconds and take whichever answers first. Unset = sequential fallback.
+LLM_HEDGE_DELAY_S = os.environ.get("LLM_HEDGE_DELAY_S")
+
+LLM_HEADERS = {
+    "HTTP-Referer": "https://b4ubuy.app",
+    "X-Title": "B4UBuy Nutrition Analyzer"
+}
+
+# Bump whenever the narrative prompt changes so cached narratives are not reused
+PROMPT_VERSION = 1
+
+# In-flight provider calls per process on the asyncio path (asgi_api.py)
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "256"))
+
+# Custom weight vectors whose catalogue-wide scores stay in memory (LRU)
+CUSTOM_PERSONA_CACHE_SIZE = int(os.environ.get("CUSTOM_PERSONA_CACHE_SIZE", "128"))
+
+# How swaps are picked: "nearest" = the closest green product by nutrient
+# profile (nutrient_neighbours.py), "score" = the highest-scoring green
+# product in the subcategory (precompute.py's rankings)
+ALTERNATIVES_BY = os.environ.get("ALTERNATIVES_BY", "nearest")
+
+# Grams (or ml) assumed for a product whose pack size is unknown when no other
+# item in the cart has one; otherwise the cart's median pack size is used
+DEFAULT_PACK_GRAMS = 100.0
+
 # ============================================================================
 # TYPES
 # ============================================================================
@@ -127,6 +117,9 @@ Persona = Literal[
 
 HealthLabel = Literal["green", "amber", "red"]
 
+# A cart line: a product name, or {"name": ..., "quantity": <packs, default 1>}
+CartItem = Union[str, Dict[str, Any]]
+
 # ============================================================================
 # HARDCODED REASONING (NO LLM NEEDED)
 # ============================================================================
@@ -218,7 +211,7 @@ class Product:
     health_score: float
     health_label: HealthLabel
     health_confidence: str
-    raw_row: Dict[str, Any]
+    raw_row: Dict[str, Any] = field(default_factory=dict)
 
 
 @dataclass
@@ -226,6 +219,7 @@ class ScoredItem:
     product: Product
     persona: Persona
     explanation: str  # Why this label for this persona
+    quantity: float = 1.0  # packs in the cart
 
 
 @dataclass
@@ -245,10 +239,400 @@ class CartReport:
     improvement_pct: Optional[int]
     swap_prompt: Optional[str]
     final_narrative: str
+    narrative_job_id: Optional[str] = None  # set when the narrative is deferred
+    totals: Optional[Dict[str, Any]] = None  # cart nutrient totals, see FastEngine._cart_totals
+
+
+@dataclass
+class IngredientMatch:
+    name: str  # as written in the recipe
+    key: str  # normalised ingredient ("" for water, ice...)
+    candidates: List[Tuple[Product, float]]  # (product, match score), best for the persona first
+
+
+@dataclass
+class ProductPage:
+    products: List[Product]
+    total: int  # rows matching the filters
+    next_cursor: Optional[str]  # None on the last page
+
+
+@dataclass
+class BatchReport:
+    reports: List[CartReport]
+    final_narrative: str  # one narrative covering every cart
+    narrative_job_id: Optional[str] = None
+
+
+# ============================================================================
+# PRODUCT STORE (columnar persona scores, built once at engine start)
+# ============================================================================
+
+
+class ProductStore:
+    """
+    Array-backed catalogue: one contiguous score/label/confidence column per
+    persona plus interned name/brand/category string tables. Hands out
+    lightweight `Product` views only for the rows a request actually touches.
+
+    Built either from a DataFrame (CSV fallback) or straight on top of the
+    memory-mapped binary catalogue, in which case nothing is copied.
+    """
+
+    LABELS: List[str] = catalogue.LABELS
+    CONFIDENCES: List[str] = catalogue.CONFIDENCES
+
+    # Column -> Product field, with the same defaults FastLoader used
+    STRING_FIELDS = {
+        "name": ("product_name_en", ""),
+        "brand": ("brands", ""),
+        "category": ("category", "Unknown"),
+        "subcategory": ("subcategory", "Unknown"),
+    }
+
+    # What str() of a missing CSV cell used to give
+    MISSING_STRING = "nan"
+
+    def __init__(
+        self,
+        strings: Dict[str, Sequence[str]],
+        codes: Dict[str, np.ndarray],
+        persona_names: List[str],
+        score_matrix: np.ndarray,
+        label_matrix: np.ndarray,
+        confidence_matrix: np.ndarray,
+        label_table: List[str],
+        confidence_table: List[str],
+        frame: Optional[pd.DataFrame] = None,
+        source: Optional[Catalogue] = None,
+    ):
+        self.strings = strings          # field -> interned string table
+        self.codes = codes              # field -> int32 codes into that table (-1 = missing)
+        self.label_table = label_table
+        self.confidence_table = confidence_table
+        self.frame = frame
+        self.source = source
+        self.size = len(next(iter(codes.values()))) if codes else 0
+
+        # Persona columns live in Fortran-order (products x personas) matrices:
+        # each persona column stays contiguous and a batch can read every
+        # persona for a set of rows with a single fancy-index lookup.
+        # float32 scores, int8 codes into label_table / confidence_table.
+        self.persona_index: Dict[str, int] = {p: i for i, p in enumerate(persona_names)}
+        self.score_matrix = score_matrix
+        self.label_matrix = label_matrix
+        self.confidence_matrix = confidence_matrix
+        self.scores = {p: self.score_matrix[:, i] for p, i in self.persona_index.items()}
+        self.labels = {p: self.label_matrix[:, i] for p, i in self.persona_index.items()}
+        self.confidence = {p: self.confidence_matrix[:, i] for p, i in self.persona_index.items()}
+
+        # Defaults for personas without precomputed columns (old behaviour)
+        self._default_score = np.zeros(self.size, dtype=np.float32)
+        self._default_label = np.full(self.size, self.label_table.index("amber"), dtype=np.int8)
+        self._default_conf = np.full(self.size, self.confidence_table.index("low"), dtype=np.int8)
+
+        # Built on first use, then shared (see nutrients / pack_sizes)
+        self._nutrients: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._pack_sizes: Optional[np.ndarray] = None
+
+        # Scores for request-supplied weight vectors ("custom:<hash>" personas)
+        self.custom = CustomPersonas(self)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "ProductStore":
+        n = len(df)
+        strings: Dict[str, Sequence[str]] = {}
+        codes: Dict[str, np.ndarray] = {}
+        for fname, (col, default) in cls.STRING_FIELDS.items():
+            values = df[col].tolist() if col in df.columns else [default] * n
+            strings[fname], codes[fname] = catalogue.encode_strings(values)
+
+        present, scores, labels, confidence, label_table, confidence_table = (
+            catalogue.persona_matrices(df, personas)
+        )
+        return cls(strings, codes, present, scores, labels, confidence,
+                   label_table, confidence_table, frame=df)
+
+    @classmethod
+    def from_catalogue(cls, cat: Catalogue) -> "ProductStore":
+        strings: Dict[str, Sequence[str]] = {}
+        codes: Dict[str, np.ndarray] = {}
+        for fname, (col, default) in cls.STRING_FIELDS.items():
+            if cat.has(col):
+                strings[fname], codes[fname] = cat.strings(col)
+            else:
+                strings[fname], codes[fname] = [default], np.zeros(len(cat), dtype=np.int32)
+        return cls(strings, codes, cat.personas, cat.scores, cat.labels, cat.confidence,
+                   cat.label_table, cat.confidence_table, source=cat)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def string(self, fname: str, idx: int) -> str:
+        code = self.codes[fname][idx]
+        return self.strings[fname][code] if code != catalogue.MISSING else self.MISSING_STRING
+
+    def column(self, fname: str) -> List[str]:
+        """Every row's value for one string field"""
+        table = self.strings[fname]
+        table = table.tolist() if isinstance(table, StringTable) else table
+        return [table[c] if c != catalogue.MISSING else self.MISSING_STRING
+                for c in self.codes[fname].tolist()]
+
+    @staticmethod
+    def score_value(score) -> float:
+        """float32 score as the shortest float that round-trips (0.1846154, not 0.18461538851261139)"""
+        return float(str(score))
+
+    def scores_for(self, persona: Persona) -> np.ndarray:
+        return self.scores.get(persona, self._default_score)
+
+    def labels_for(self, persona: Persona) -> np.ndarray:
+        return self.labels.get(persona, self._default_label)
+
+    def confidence_for(self, persona: Persona) -> np.ndarray:
+        return self.confidence.get(persona, self._default_conf)
+
+    def label_code(self, label: str) -> int:
+        return self.label_table.index(label) if label in self.label_table else -1
+
+    def product(self, idx: int, persona: Persona) -> Product:
+        """Materialise a single Product view for this persona"""
+        idx = int(idx)
+        return Product(
+            product_id=idx,
+            name=self.string("name", idx),
+            brand=self.string("brand", idx),
+            category=self.string("category", idx),
+            subcategory=self.string("subcategory", idx),
+            health_score=self.score_value(self.scores_for(persona)[idx]),
+            health_label=self.label_table[self.labels_for(persona)[idx]],
+            health_confidence=self.confidence_table[self.confidence_for(persona)[idx]],
+        )
+
+    def products_for(self, rows: List[int], persona_list: List[Persona]) -> Dict[Tuple[int, str], Product]:
+        """Product views for every (row, persona) pair from one matrix lookup"""
+        rows = [int(r) for r in rows]
+        known = [p for p in persona_list if p in self.persona_index]
+        cols = [self.persona_index[p] for p in known]
+        grid = np.ix_(rows, cols)
+        scores = self.score_matrix[grid]
+        labels = self.label_matrix[grid]
+        confidence = self.confidence_matrix[grid]
+
+        views: Dict[Tuple[int, str], Product] = {}
+        for i, idx in enumerate(rows):
+            strings = {f: self.string(f, idx) for f in self.STRING_FIELDS}
+            for j, persona in enumerate(known):
+                views[(idx, persona)] = Product(
+                    product_id=idx,
+                    health_score=self.score_value(scores[i, j]),
+                    health_label=self.label_table[labels[i, j]],
+                    health_confidence=self.confidence_table[confidence[i, j]],
+                    **strings,
+                )
+            for persona in persona_list:
+                if persona not in self.persona_index:
+                    views[(idx, persona)] = self.product(idx, persona)
+        return views
+
+    def values(self, col: str) -> List[Any]:
+        """Every row's value for any source column (None where missing)"""
+        if self.source is not None:
+            if not self.source.has(col) or self.source.columns[col]["kind"] not in ("str", "float", "int"):
+                return [None] * self.size
+            if self.source.columns[col]["kind"] != "str":
+                return self.source.numbers(col).tolist()
+            table, codes = self.source.strings(col)
+            table = table.tolist()
+            return [table[c] if c != catalogue.MISSING else None for c in codes.tolist()]
+        if self.frame is None or col not in self.frame.columns:
+            return [None] * self.size
+        return [None if v != v else v for v in self.frame[col].tolist()]
+
+    def numbers(self, col: str) -> Optional[np.ndarray]:
+        """float64 column (NaN where missing), or None when the catalogue lacks it"""
+        if self.source is not None:
+            if not self.source.has(col) or self.source.columns[col]["kind"] not in ("float", "int"):
+                return None
+            return np.asarray(self.source.numbers(col), dtype=np.float64)
+        if self.frame is None or col not in self.frame.columns:
+            return None
+        import pandas as pd
+        return pd.to_numeric(self.frame[col], errors="coerce").to_numpy(dtype=np.float64)
+
+    def nutrients(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (values, present, nova) for custom scoring: (products x NUTRICOLS)
+        float64 with missing nutrients as 0, a 0/1 matrix of known ones,
+        and the NOVA groups precompute.py falls back to. Built once.
+        """
+        if self._nutrients is not None:
+            return self._nutrients
+        numbers = self.numbers
+        values = np.zeros((self.size, len(NUTRICOLS)))
+        present = np.ones((self.size, len(NUTRICOLS)))
+        for j, col in enumerate(NUTRICOLS):
+            column = numbers(col)
+            # A missing column reads as 0 (counted as present), as in precompute.nutrient_matrix
+            if column is not None:
+                known = ~np.isnan(column)
+                values[:, j] = np.where(known, column, 0.0)
+                present[:, j] = known
+        nova = numbers(NOVA_COL)
+        self._nutrients = (values, present, nova if nova is not None else np.ones(self.size))
+        return self._nutrients
+
+    def pack_sizes(self) -> np.ndarray:
+        """
+        Grams (or ml) per pack for every row, NaN where unknown. Read from
+        precompute.py's parsed column; older catalogues are parsed here once.
+        """
+        if self._pack_sizes is None:
+            sizes = self.numbers(QUANTITY_COL)
+            if sizes is None:
+                sizes, _ = quantity_columns(self.values("quantity"))
+            self._pack_sizes = sizes
+        return self._pack_sizes
+
+    def row(self, idx: int) -> Dict[str, Any]:
+        """Full source row, only when a caller really needs every column"""
+        if self.source is not None:
+            return self.source.row(int(idx))
+        if self.frame is None:
+            return {}
+        return self.frame.iloc[int(idx)].to_dict()
 
 
 # ============================================================================
-# FAST DATA LOADER (reads precomputed scores from CSV)
+# CUSTOM PERSONAS (request-supplied weights, scored over the whole catalogue)
+# ============================================================================
+
+
+class CustomPersonas:
+    """
+    Scores, labels and alternative rankings for arbitrary {nutrient: weight}
+    vectors, e.g. a diabetic who is also hypertensive. Each vector is scored
+    over the whole catalogue once (precompute.score_vector) and registered in
+    the store as persona "custom:<hash>", so every per-persona code path
+    works unchanged. The most recently used CUSTOM_PERSONA_CACHE_SIZE vectors
+    are kept.
+    """
+
+    PREFIX = "custom:"
+
+    def __init__(self, store: ProductStore, max_entries: int = CUSTOM_PERSONA_CACHE_SIZE):
+        self.store = store
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._matrices: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+        self._groups: Optional[Tuple[Dict[str, int], np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def is_custom(cls, persona: str) -> bool:
+        return isinstance(persona, str) and persona.startswith(cls.PREFIX)
+
+    @classmethod
+    def key_for(cls, w: np.ndarray) -> str:
+        # + 0.0 folds -0.0 into 0.0 so equal vectors share a key
+        return cls.PREFIX + hashlib.sha256((w + 0.0).tobytes()).hexdigest()[:16]
+
+    def prepare(self) -> None:
+        """Build the nutrient matrices now (before serve.py forks) instead of on first use"""
+        if self._matrices is None:
+            values, present, nova = self.store.nutrients()
+            # Nutrient completeness for confidence, as precompute.py
+            table = self.store.confidence_table
+            confidence = np.where(present.sum(axis=1) / len(NUTRICOLS) >= 0.5,
+                                  table.index("high"), table.index("low")).astype(np.int8)
+            self._matrices = (values, present, nova, confidence)
+
+    def register(self, custom_weights: Dict[str, float]) -> str:
+        """Persona key for a weight vector, scoring the catalogue on first use"""
+        w = weight_vector(custom_weights)
+        key = self.key_for(w)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return key
+
+        self.prepare()
+        values, present, nova, confidence = self._matrices
+        scores = score_vector(values, present, w, nova)
+        # precompute.health_labels, straight to label codes
+        code = self.store.label_code
+        labels = np.where(scores >= GREEN_MIN_SCORE, code("green"),
+                          np.where(scores >= AMBER_MIN_SCORE, code("amber"), code("red"))).astype(np.int8)
+        entry = {"weights": dict(zip(NUTRICOLS, w.tolist())), "ranked": {}}
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = entry
+                self.store.scores[key] = scores.astype(np.float32)
+                self.store.labels[key] = labels
+                self.store.confidence[key] = confidence
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                for table in (self.store.scores, self.store.labels, self.store.confidence):
+                    table.pop(evicted, None)
+        return key
+
+    def weights(self, key: str) -> Optional[Dict[str, float]]:
+        entry = self.entries.get(key)
+        return dict(entry["weights"]) if entry else None
+
+    def memo(self, key: str, name: str, build):
+        """Data derived from a vector, built once and dropped with it (None for unknown keys)"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if name not in entry:
+            entry[name] = build()
+        return entry[name]
+
+    def _subcategory_groups(self) -> Tuple[Dict[str, int], np.ndarray, np.ndarray]:
+        """subcategory -> code, and rows grouped by code CSR-style (offsets, rows)"""
+        if self._groups is None:
+            codes = self.store.codes["subcategory"]
+            table = self.store.strings["subcategory"]
+            table = table.tolist() if isinstance(table, StringTable) else list(table)
+            lookup = {name: i for i, name in enumerate(table)}
+            lookup[ProductStore.MISSING_STRING] = len(table)
+            shifted = np.where(codes == catalogue.MISSING, len(table), codes)
+            rows = np.argsort(shifted, kind="stable").astype(np.int32)
+            offsets = np.zeros(len(table) + 2, dtype=np.int64)
+            np.cumsum(np.bincount(shifted, minlength=len(table) + 1), out=offsets[1:])
+            self._groups = (lookup, offsets, rows)
+        return self._groups
+
+    def ranked(self, key: str, subcategory: str) -> List[int]:
+        """Best GREEN rows of a subcategory for a custom persona, as rank_alternatives"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return []
+        found = entry["ranked"].get(subcategory)
+        if found is not None:
+            return found
+
+        lookup, offsets, rows = self._subcategory_groups()
+        code = lookup.get(subcategory)
+        found = []
+        if code is not None:
+            rows = rows[offsets[code]:offsets[code + 1]]
+            rows = rows[self.store.labels_for(key)[rows] == self.store.label_code("green")]
+            scores = self.store.scores_for(key)[rows].astype(np.float64)
+            found = rows[np.lexsort((rows, -scores))][:ALTERNATIVES_TOP_N].tolist()
+        entry["ranked"][subcategory] = found
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self.entries), "max_entries": self.max_entries}
+
+
+# ============================================================================
+# FAST DATA LOADER (maps the binary catalogue, falls back to the CSV)
 # ============================================================================
 
 
@@ -257,43 +641,47 @@ class FastLoader:
         # Accept absolute paths or paths relative to this module
         if not os.path.isabs(csv_path):
             csv_path = os.path.join(BASE_DIR, csv_path)
+        self.csv_path = csv_path
+        self._df: Optional[pd.DataFrame] = None
+
+        # The catalogue must come from the same inputs as the CSV's manifest
+        manifest = read_manifest(csv_path) or {}
+        self.input_hash: str = manifest.get("input_hash") or ""
+        cat = Catalogue.open(catalogue_path_for(csv_path), manifest.get("input_hash"))
+        if cat is not None and manifest:
+            self.store = ProductStore.from_catalogue(cat)
+            print(f"[FastLoader] Mapped {cat.path} ({len(cat)} products)")
+            return
 
         print(f"[FastLoader] Loading {csv_path}...")
         if not Path(csv_path).exists():
-            raise FileNotFoundError(f"Precomputed CSV not found: {csv_path}")
-        self.df = pd.read_csv(csv_path)
-        print(f"Loaded {len(self.df)} products in <2 sec")
-
-    def get_products_for_persona(self, persona: Persona) -> List[Product]:
-        """Load products with precomputed scores for this persona"""
-        products: List[Product] = []
-
-        score_col = f"health_score_{persona}"
-        label_col = f"health_label_{persona}"
-        conf_col = f"health_confidence_{persona}"
-
-        for idx, row in self.df.iterrows():
-            products.append(
-                Product(
-                    product_id=idx,
-                    name=str(row.get("product_name_en", "")),
-                    brand=str(row.get("brands", "")),
-                    category=str(row.get("category", "Unknown")),
-                    subcategory=str(row.get("subcategory", "Unknown")),
-                    health_score=float(row.get(score_col, 0.0))
-                    if pd.notna(row.get(score_col))
-                    else 0.0,
-                    health_label=str(row.get(label_col, "amber")).lower()
-                    if pd.notna(row.get(label_col))
-                    else "amber",
-                    health_confidence=str(row.get(conf_col, "low")).lower()
-                    if pd.notna(row.get(conf_col))
-                    else "low",
-                    raw_row=row.to_dict(),
-                )
+            raise FileNotFoundError(
+                f"Precomputed CSV not found: {csv_path} (run `python precompute.py`)"
             )
+        print("[FastLoader] No current binary catalogue, parsing the CSV (run `python precompute.py`)")
+        import pandas as pd
+        self._df = pd.read_csv(csv_path)
+        self.store = ProductStore.from_frame(self._df)
+        print(f"Loaded {len(self._df)} products in <2 sec")
+
+    def data_version(self) -> str:
+        """Identifies this catalogue build: its input_hash, else the CSV's size and mtime"""
+        if self.input_hash:
+            return self.input_hash
+        st = os.stat(self.csv_path)
+        return f"csv:{st.st_size}:{st.st_mtime_ns}"
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """The full CSV as a DataFrame; only parsed if something asks for it"""
+        if self._df is None:
+            import pandas as pd
+            self._df = pd.read_csv(self.csv_path)
+        return self._df
 
-        return products
+    def get_products_for_persona(self, persona: Persona) -> List[Product]:
+        """Product views for every row (prefer the store for per-request work)"""
+        return [self.store.product(idx, persona) for idx in range(len(self.store))]
 
 
 # ============================================================================
@@ -302,26 +690,42 @@ class FastLoader:
 
 
 class FastMatcher:
-    def __init__(self, products: List[Product]):
-        self.products = products
-        self.name_index: Dict[str, Product] = {
-            p.name.lower().strip(): p for p in products
-        }
-
-    def find_product(self, name: str) -> Optional[Product]:
-        """Find product by name - fuzzy matching"""
+    def __init__(self, store: ProductStore, index_path: Optional[str] = None):
+        self.store = store
+        # Lower-cased name -> row; later duplicates win, as before
+        names = store.column("name")
+        brands = store.column("brand")
+        self.name_index: Dict[str, int] = {}
+        for idx, name in enumerate(names):
+            self.name_index[name.lower().strip()] = idx
+
+        # Token + trigram index for everything that isn't an exact hit
+        self.index = ProductSearchIndex.load_or_build(index_path, names, brands)
+
+    def find_candidates(self, name: str, persona: Persona = "standard",
+                        k: int = 5) -> List[Tuple[Product, float]]:
+        """Top-k products ranked by similarity (exact name match scores 1.0)"""
+        ranked = self.index.search(name, k=k)
+        exact = self.name_index.get(name.lower().strip())
+        if exact is not None:
+            ranked = [(exact, 1.0)] + [(i, s) for i, s in ranked if i != exact][:k - 1]
+        return [(self.store.product(idx, persona), score) for idx, score in ranked]
+
+    def find_index(self, name: str) -> Optional[int]:
+        """Find product row by name - exact match, else best fuzzy match"""
         name_lower = name.lower().strip()
 
         # Exact match
         if name_lower in self.name_index:
             return self.name_index[name_lower]
 
-        # Substring match
-        for prod_name, product in self.name_index.items():
-            if name_lower in prod_name or prod_name in name_lower:
-                return product
+        # Ranked fuzzy match
+        ranked = self.index.search(name, k=1)
+        return ranked[0][0] if ranked else None
 
-        return None
+    def find_product(self, name: str, persona: Persona = "standard") -> Optional[Product]:
+        idx = self.find_index(name)
+        return self.store.product(idx, persona) if idx is not None else None
 
 
 # ============================================================================
@@ -351,38 +755,97 @@ class FastScorer:
 # ============================================================================
 
 
-class FastAlternativeFinder:
-    def __init__(self, all_products: List[Product]):
-        self.products = all_products
-        # Index by subcategory
-        self.by_subcat: Dict[str, List[Product]] = {}
-        for p in all_products:
-            if p.subcategory not in self.by_subcat:
-                self.by_subcat[p.subcategory] = []
-            self.by_subcat[p.subcategory].append(p)
-
-    def find_alternative(self, scored: ScoredItem, persona: Persona) -> Optional[Alternative]:
-        """Find GREEN alternative in same subcategory"""
-        if scored.product.health_label == "green":
-            return None  # Already optimal
+def load_alternative_rankings(csv_path: str, store: ProductStore) -> Dict[str, Dict[str, List[int]]]:
+    """Rankings written by precompute.py, or computed from the store if stale/missing"""
+    manifest = read_manifest(csv_path) or {}
+    try:
+        with open(alternatives_path(csv_path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("input_hash") == manifest.get("input_hash") and data.get("rows") == len(store):
+            return data["rankings"]
+    except (OSError, ValueError):
+        pass
+
+    print("[FastAlternativeFinder] Ranking alternatives in memory...")
+    subcategories = store.column("subcategory")
+    green = store.label_code("green")
+    return rank_alternatives(
+        subcategories,
+        store.scores,
+        {p: labels == green for p, labels in store.labels.items()},
+    )
 
-        subcat = scored.product.subcategory
-        if subcat not in self.by_subcat:
-            return None
 
-        # Find GREEN alternatives in same subcategory
-        candidates = [
-            p
-            for p in self.by_subcat[subcat]
-            if p.health_label == "green" and p.product_id != scored.product.product_id
-        ]
+def build_neighbour_index(store: ProductStore) -> NeighbourIndex:
+    """Nutrient/allergen neighbour index over the whole store"""
+    start = time.perf_counter()
+    values, present, _ = store.nutrients()
+    allergens = allergen_mask([store.numbers(f"has_{a}") for a in product_filters.ALLERGENS], len(store))
+    index = NeighbourIndex.build(values, present, allergens,
+                                 store.codes["category"], store.codes["subcategory"])
+    print(f"[FastAlternativeFinder] Neighbour index: {len(index):,} products, {index.leaves:,} leaves "
+          f"({time.perf_counter() - start:.2f}s)")
+    return index
 
-        if not candidates:
-            return None
 
-        # Pick highest scoring GREEN
-        best = max(candidates, key=lambda x: x.health_score)
+class FastAlternativeFinder:
+    def __init__(self, store: ProductStore, rankings: Dict[str, Dict[str, List[int]]],
+                 neighbours: Optional[NeighbourIndex] = None):
+        self.store = store
+        # persona -> subcategory -> best GREEN rows, highest score first
+        self.rankings = rankings
+        # With a neighbour index, swaps are the nearest GREEN products instead
+        self.neighbours = neighbours
+        self.boxes: Dict[str, PersonaBoxes] = {}
+        if neighbours is not None:
+            for persona in store.persona_index:
+                self.boxes[persona] = self._green_boxes(persona)
+
+    def _green_boxes(self, persona: Persona) -> PersonaBoxes:
+        return self.neighbours.boxes(self.store.labels_for(persona) == self.store.label_code("green"))
+
+    def _boxes_for(self, persona: Persona) -> Optional[PersonaBoxes]:
+        if CustomPersonas.is_custom(persona):
+            return self.store.custom.memo(persona, "boxes", lambda: self._green_boxes(persona))
+        return self.boxes.get(persona)
+
+    def find_alternatives(self, scored: ScoredItem, persona: Persona, n: int = 1,
+                          exclude=()) -> List[Alternative]:
+        """
+        Up to n GREEN alternatives, best first: nearest by nutrient profile
+        within the subcategory, then the category (without adding an
+        allergen), or highest-scoring in the subcategory without an index
+        """
+        if scored.product.health_label == "green":
+            return []  # Already optimal
+
+        if self.neighbours is not None:
+            boxes = self._boxes_for(persona)
+            if boxes is None:
+                return []
+            # GREEN always outscores the AMBER/RED original (same thresholds)
+            ranked = self.neighbours.nearest(scored.product.product_id, boxes, n=n, exclude=exclude)
+        elif CustomPersonas.is_custom(persona):
+            ranked = self.store.custom.ranked(persona, scored.product.subcategory)
+        else:
+            ranked = self.rankings.get(persona, {}).get(scored.product.subcategory, [])
+        alternatives: List[Alternative] = []
+        for idx in ranked:
+            if idx == scored.product.product_id or idx in exclude:
+                continue
+            alternatives.append(self._alternative(scored, self.store.product(idx, persona), persona))
+            if len(alternatives) >= n:
+                break
+        return alternatives
+
+    def find_alternative(self, scored: ScoredItem, persona: Persona,
+                         exclude=()) -> Optional[Alternative]:
+        """Find the best GREEN alternative (see find_alternatives)"""
+        found = self.find_alternatives(scored, persona, n=1, exclude=exclude)
+        return found[0] if found else None
 
+    @staticmethod
+    def _alternative(scored: ScoredItem, best: Product, persona: Persona) -> Alternative:
         # Calculate improvement
         base = max(abs(scored.product.health_score), 0.1)
         improvement_pct = int(((best.health_score - scored.product.health_score) / base) * 100)
@@ -408,36 +871,86 @@ class LLMNarrative:
         self,
         api_key: str = THESYS_API_KEY,
         model: str = "claude-3-5-sonnet-20241022",
+        hedge_delay_s: Optional[float] = (
+            float(LLM_HEDGE_DELAY_S) if LLM_HEDGE_DELAY_S else None
+        ),
     ):
         """
-        LLM client with Thesys primary and fallback support
+        LLM client with Thesys primary and fallback support.
+
+        Both provider clients are created once (on the first call, or by
+        connect()) and reused, so every call goes through the client's pooled
+        HTTP connections and per-call timeout.
         """
         self.thesys_api_key = api_key
         self.thesys_model = model
         self.openrouter_api_key = OPENROUTER_API_KEY
+        self.openrouter_model = OPENROUTER_MODEL
+        self.hedge_delay_s = hedge_delay_s
         self.thesys_client = None
+        self.openrouter_client = None
         self.client_type = None
-        
+
+        # Identical report_data -> identical narrative; skip the LLM on repeats
+        self.cache = NarrativeCache()
+
+        # Runs provider calls in hedged mode
+        self.hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+        self._connected = False
+        self._connect_lock = threading.Lock()
+
+        # asyncio path: AsyncOpenAI clients and a concurrency bound, per event loop
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_clients: Dict[str, Any] = {}
+        self._async_slots: Optional[asyncio.Semaphore] = None
+
+    def connect(self) -> None:
+        """
+        Create the provider clients if not done yet. Importing the OpenAI SDK
+        is most of a cold start, so requests answered from the narrative
+        cache or deferred never pay for it.
+        """
+        if self._connected:
+            return
+        with self._connect_lock:
+            if not self._connected:
+                self._create_clients()
+                self._connected = True
+
+    def _create_clients(self) -> None:
+        from openai import OpenAI
+
         # Try Thesys first
         try:
             self.thesys_client = OpenAI(
-                base_url="https://api.thesys.dev",
-                api_key=api_key,
-                default_headers={
-                    "HTTP-Referer": "https://b4ubuy.app",
-                    "X-Title": "B4UBuy Nutrition Analyzer"
-                }
+                base_url=THESYS_BASE_URL,
+                api_key=self.thesys_api_key,
+                default_headers=LLM_HEADERS,
+                timeout=THESYS_TIMEOUT_S,
+                max_retries=0,
             )
             self.client_type = "thesys"
-            print(f"LLM ready (Thesys | model={model})")
+            print(f"LLM ready (Thesys | model={self.thesys_model})")
         except Exception as e:
             print(f"Thesys initialization: {e}")
             # Thesys failed, will use OpenRouter
             self.client_type = "fallback"
             print("Will use OpenRouter fallback for LLM")
 
-    def generate_narrative(self, report_data: Dict) -> str:
-        """Generate narrative, with fallback handling"""
+        try:
+            self.openrouter_client = OpenAI(
+                base_url=OPENROUTER_BASE_URL,
+                api_key=self.openrouter_api_key,
+                default_headers=LLM_HEADERS,
+                timeout=OPENROUTER_TIMEOUT_S,
+                max_retries=0,
+            )
+        except Exception as e:
+            print(f"OpenRouter initialization: {e}")
+
+    def build_messages(self, report_data: Dict) -> List[Dict[str, str]]:
+        """System + user messages for the narrative prompt"""
         persona = report_data.get("persona", "standard")
 
         system_msg = (
@@ -482,53 +995,233 @@ Requirements:
 - Use markdown bold (**text**) for emphasis
 """
 
+        return [
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": user_msg},
+        ]
+
+    def _call(self, provider: str, messages: List[Dict[str, str]]) -> str:
+        """One chat completion against a provider's long-lived client"""
+        if provider == "thesys":
+            client, model = self.thesys_client, self.thesys_model
+        else:
+            client, model = self.openrouter_client, self.openrouter_model
+        if client is None:
+            raise RuntimeError(f"{provider} client not initialized")
+
+        start = time.perf_counter()
         try:
-            # Try Thesys first
-            if self.thesys_client:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=800,
+                temperature=0.7,
+            )
+        except Exception:
+            telemetry.record_llm_call(provider, "error", start, time.perf_counter() - start)
+            raise
+        telemetry.record_llm_call(provider, "ok", start, time.perf_counter() - start)
+        return response.choices[0].message.content
+
+    def _complete_sequential(self, messages: List[Dict[str, str]]) -> Tuple[str, str]:
+        # Try Thesys first
+        if self.thesys_client:
+            try:
+                return self._call("thesys", messages), "thesys"
+            except Exception as thesys_error:
+                print(f"\n❌ Error calling Thesys API: {thesys_error}")
+                print("Trying OpenRouter fallback...\n")
+
+        # Fallback to OpenRouter
+        narrative = self._call("openrouter", messages)
+        print("✓ OpenRouter fallback successful\n")
+        return narrative, "openrouter"
+
+    def _submit_call(self, provider: str, messages: List[Dict[str, str]]):
+        # Run in a copy of this context so the call lands in the request's trace
+        return self.hedge_pool.submit(contextvars.copy_context().run, self._call, provider, messages)
+
+    def _complete_hedged(self, messages: List[Dict[str, str]]) -> Tuple[str, str]:
+        """Fire OpenRouter after hedge_delay_s (or on Thesys failure); first answer wins"""
+        pending = {}
+        if self.thesys_client:
+            pending[self._submit_call("thesys", messages)] = "thesys"
+            done, _ = wait(pending, timeout=self.hedge_delay_s)
+            for future in done:
                 try:
-                    response = self.thesys_client.chat.completions.create(
-                        model=self.thesys_model,
-                        messages=[
-                            {"role": "system", "content": system_msg},
-                            {"role": "user", "content": user_msg},
-                        ],
-                        max_tokens=800,
-                        temperature=0.7,
-                    )
-                    return response.choices[0].message.content
+                    return future.result(), "thesys"
                 except Exception as thesys_error:
                     print(f"\n❌ Error calling Thesys API: {thesys_error}")
-                    print("Trying OpenRouter fallback...\n")
+                    del pending[future]
 
-            # Fallback to OpenRouter
-            openrouter_client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=self.openrouter_api_key,
-                default_headers={
-                    "HTTP-Referer": "https://b4ubuy.app",
-                    "X-Title": "B4UBuy Nutrition Analyzer"
-                }
-            )
-            
-            response = openrouter_client.chat.completions.create(
-                model="anthropic/claude-3.5-sonnet",
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_msg},
-                ],
-                max_tokens=800,
-                temperature=0.7,
-            )
-            print("✓ OpenRouter fallback successful\n")
-            return response.choices[0].message.content
+        pending[self._submit_call("openrouter", messages)] = "openrouter"
 
-        except Exception as e:
-            print(f"\n❌ Error calling all LLM APIs: {e}")
-            print("Generating fallback narrative...\n")
-            return self._generate_fallback_narrative(report_data)
+        last_error: Optional[Exception] = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result(), provider
+                except Exception as e:
+                    print(f"\n❌ Error calling {provider}: {e}")
+                    last_error = e
+        raise last_error or RuntimeError("No LLM provider available")
+
+    def complete(self, messages: List[Dict[str, str]]) -> Tuple[str, str]:
+        """(narrative, provider that answered) - raises if every provider fails"""
+        self.connect()
+        if self.hedge_delay_s is not None:
+            return self._complete_hedged(messages)
+        return self._complete_sequential(messages)
+
+    def generate_narrative(self, report_data: Dict) -> str:
+        """Generate narrative, with fallback handling"""
+        with telemetry.span("narrative") as attrs:
+            key = cache_key(report_data, self.thesys_model, PROMPT_VERSION)
+            cached = self.cache.get(key)
+            if cached is not None:
+                attrs["source"] = "cache"
+                telemetry.record_narrative("cache")
+                return cached
+
+            try:
+                narrative, provider = self.complete(self.build_messages(report_data))
+                self.cache.put(key, narrative)
+                attrs["source"] = provider
+                telemetry.record_narrative(provider)
+                return narrative
+
+            except Exception as e:
+                print(f"\n❌ Error calling all LLM APIs: {e}")
+                print("Generating fallback narrative...\n")
+                attrs["source"] = "fallback"
+                telemetry.record_narrative("fallback")
+                return self._generate_fallback_narrative(report_data)
+
+    # ------------------------------------------------------------- asyncio path
+
+    def _async_state(self) -> Tuple[Dict[str, Any], asyncio.Semaphore]:
+        """Async clients bound to the running loop (made on first use in that loop)"""
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            from openai import AsyncOpenAI
+
+            clients: Dict[str, Any] = {}
+            for provider, base_url, api_key, timeout in (
+                ("thesys", THESYS_BASE_URL, self.thesys_api_key, THESYS_TIMEOUT_S),
+                ("openrouter", OPENROUTER_BASE_URL, self.openrouter_api_key, OPENROUTER_TIMEOUT_S),
+            ):
+                try:
+                    clients[provider] = AsyncOpenAI(
+                        base_url=base_url,
+                        api_key=api_key,
+                        default_headers=LLM_HEADERS,
+                        timeout=timeout,
+                        max_retries=0,
+                    )
+                except Exception as e:
+                    print(f"{provider} async initialization: {e}")
+            self._async_clients = clients
+            self._async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+            self._async_loop = loop
+        return self._async_clients, self._async_slots
+
+    async def _acall(self, provider: str, messages: List[Dict[str, str]]) -> str:
+        """_call on the shared async client; waits for a slot past LLM_MAX_CONCURRENCY"""
+        clients, slots = self._async_state()
+        client = clients.get(provider)
+        if client is None:
+            raise RuntimeError(f"{provider} client not initialized")
+        model = self.thesys_model if provider == "thesys" else self.openrouter_model
+
+        async with slots:
+            start = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=800,
+                    temperature=0.7,
+                )
+            except Exception:
+                telemetry.record_llm_call(provider, "error", start, time.perf_counter() - start)
+                raise
+            telemetry.record_llm_call(provider, "ok", start, time.perf_counter() - start)
+        return response.choices[0].message.content
+
+    async def acomplete(self, messages: List[Dict[str, str]]) -> Tuple[str, str]:
+        """complete() without holding a thread: sequential fallback, or hedged after hedge_delay_s"""
+        clients, _ = self._async_state()
+        if "thesys" in clients:
+            thesys = asyncio.ensure_future(self._acall("thesys", messages))
+            try:
+                # shield: a hedge timeout must not cancel the Thesys call
+                return await asyncio.wait_for(asyncio.shield(thesys), self.hedge_delay_s), "thesys"
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                thesys.cancel()
+                raise
+            except Exception as thesys_error:
+                print(f"\n❌ Error calling Thesys API: {thesys_error}")
+                thesys = None
+        else:
+            thesys = None
+
+        # Thesys failed, or (hedged) is slow: race OpenRouter against it
+        pending = {asyncio.ensure_future(self._acall("openrouter", messages)): "openrouter"}
+        if thesys is not None:
+            pending[thesys] = "thesys"
+        last_error: Optional[Exception] = None
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = pending.pop(task)
+                try:
+                    result = task.result(), provider
+                except Exception as e:
+                    print(f"\n❌ Error calling {provider}: {e}")
+                    last_error = e
+                    continue
+                for other in pending:
+                    other.cancel()
+                return result
+        raise last_error or RuntimeError("No LLM provider available")
+
+    async def agenerate_narrative(self, report_data: Dict) -> str:
+        """generate_narrative for an event loop (same cache, telemetry and fallback)"""
+        with telemetry.span("narrative") as attrs:
+            key = cache_key(report_data, self.thesys_model, PROMPT_VERSION)
+            cached = self.cache.get(key)
+            if cached is not None:
+                attrs["source"] = "cache"
+                telemetry.record_narrative("cache")
+                return cached
+
+            try:
+                narrative, provider = await self.acomplete(self.build_messages(report_data))
+                self.cache.put(key, narrative)
+                attrs["source"] = provider
+                telemetry.record_narrative(provider)
+                return narrative
+
+            except Exception as e:
+                print(f"\n❌ Error calling all LLM APIs: {e}")
+                print("Generating fallback narrative...\n")
+                attrs["source"] = "fallback"
+                telemetry.record_narrative("fallback")
+                return self._generate_fallback_narrative(report_data)
 
     def _generate_fallback_narrative(self, report_data: Dict) -> str:
         """Generate a bullet-point formatted report if API fails"""
+        if "members" in report_data:
+            # Batch payload from analyze_carts: one section per cart
+            return "\n\n".join(
+                self._generate_fallback_narrative(member)
+                for member in report_data["members"]
+            )
+
         persona = report_data.get("persona", "standard")
         items = report_data.get("items", [])
         alternatives = report_data.get("alternatives", [])
@@ -560,6 +1253,261 @@ Requirements:
 
 
 
+# ============================================================================
+# API RESPONSE SHAPE (shared by backend_api.py and the api/ serverless handlers)
+# ============================================================================
+
+
+def report_to_json(report: CartReport) -> Dict[str, Any]:
+    """CartReport -> API response dict"""
+    response = {
+        'items': [
+            {
+                'name': scored_item.product.name,
+                'label': scored_item.product.health_label,
+                'explanation': scored_item.explanation,
+                'score': scored_item.product.health_score,
+                'quantity': scored_item.quantity
+            }
+            for scored_item in report.items
+        ],
+        'alternatives': [
+            {
+                'original_name': alt.original.product.name,
+                'replacement_name': alt.replacement.name,
+                'advantage': alt.advantage,
+                'improvement': alt.improvement
+            }
+            for alt in report.alternatives
+        ],
+        'swapped_cart': [
+            {
+                'name': product.name,
+                'label': product.health_label
+            }
+            for product in (report.swapped_cart or [])
+        ],
+        'improvement_pct': report.improvement_pct or 0,
+        'cart_totals': report.totals,
+        'narrative': report.final_narrative or ''
+    }
+    if report.narrative_job_id:
+        response['narrative_job_id'] = report.narrative_job_id
+    return response
+
+
+def cart_lines(items: Sequence[CartItem]) -> Tuple[List[str], List[float]]:
+    """
+    (names, quantities) for a request's cart items. Raises ValueError on an
+    item that is neither a name nor {"name": str, "quantity": number > 0}.
+    """
+    names: List[str] = []
+    quantities: List[float] = []
+    for i, item in enumerate(items):
+        quantity: Any = 1
+        if isinstance(item, dict):
+            name, quantity = item.get("name"), item.get("quantity", 1)
+        else:
+            name = item
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError(f"Item {i} needs a product name")
+        if isinstance(quantity, bool) or not isinstance(quantity, (int, float)) \
+                or not 0 < quantity < float("inf"):
+            raise ValueError(f"Item {i} quantity must be a positive number")
+        names.append(name)
+        quantities.append(float(quantity))
+    return names, quantities
+
+
+def swap_prompt_text(scored_items: List[ScoredItem], swapped_cart: List[Product],
+                     improvement_pct: Optional[int], persona: Persona) -> str:
+    """The PROPOSED SWAPPED CART box printed by the CLI"""
+    green_count_before = sum(
+        1 for s in scored_items if s.product.health_label == "green"
+    )
+    green_count_after = sum(
+        1 for p in swapped_cart if p.health_label == "green"
+    )
+
+    swap_prompt = f"""
+╔══════════════════════════════════════════════════════════════════╗
+║ 🔄 PROPOSED SWAPPED CART                                         ║
+╠══════════════════════════════════════════════════════════════════╣
+"""
+    for i, product in enumerate(swapped_cart, 1):
+        emoji = (
+            "🟢"
+            if product.health_label == "green"
+            else "🟠"
+            if product.health_label == "amber"
+            else "🔴"
+        )
+        swap_prompt += f"║ {i}. {emoji} {product.name[:50]:<50} ║\n"
+
+    swap_prompt += f"""╠══════════════════════════════════════════════════════════════════╣
+║ 📊 IMPROVEMENT ANALYSIS                                         ║
+╠══════════════════════════════════════════════════════════════════╣
+║ • Cart will improve by {improvement_pct}% if you swap           ║
+║ • GREEN items: {green_count_before} → {green_count_after}                     ║
+║ • Your cart will be {improvement_pct}% healthier for {persona}  ║
+╠══════════════════════════════════════════════════════════════════╣
+║ ❓ Would you like to apply these swaps? (y/n)                    ║
+╚══════════════════════════════════════════════════════════════════╝
+"""
+    return swap_prompt
+
+
+def report_to_cache(report: CartReport, report_data: Dict[str, Any], lines: List[list]) -> str:
+    """
+    A report (without its narrative) and its LLM payload, as ReportCache text.
+    lines: the normalised [name, quantity] line of each report item.
+    """
+    body = asdict(report)
+    body["final_narrative"], body["narrative_job_id"] = "", None
+    return json.dumps({"report": body, "data": report_data, "lines": lines},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+def reorder_report(report: CartReport, report_data: Dict[str, Any], order: List[int]) -> None:
+    """Puts a report's items (and everything listed per item) in the given order, in place"""
+    if len(order) != len(report.items) or order == sorted(order):
+        return
+    # Alternatives follow item order; each belongs to the next item with its product
+    owners: List[int] = []
+    pos = 0
+    for alt in report.alternatives:
+        while report.items[pos].product.product_id != alt.original.product.product_id:
+            pos += 1
+        owners.append(pos)
+        pos += 1
+    rank = {old: new for new, old in enumerate(order)}
+    alt_order = sorted(range(len(owners)), key=lambda i: rank[owners[i]])
+
+    report.items = [report.items[i] for i in order]
+    report.alternatives = [report.alternatives[i] for i in alt_order]
+    report_data["items"] = [report_data["items"][i] for i in order]
+    report_data["alternatives"] = [report_data["alternatives"][i] for i in alt_order]
+    if report.swapped_cart is not None:
+        report.swapped_cart = [report.swapped_cart[i] for i in order]
+        report.swap_prompt = swap_prompt_text(report.items, report.swapped_cart,
+                                              report.improvement_pct, report.persona)
+
+
+def report_from_cache(text: str, lines: Optional[List[list]] = None) -> Tuple[CartReport, Dict[str, Any]]:
+    """
+    Inverse of report_to_cache; every call returns fresh objects. With lines
+    (the asking cart's normalise_lines), items come back in that cart's order.
+    """
+    payload = json.loads(text)
+    body = payload["report"]
+
+    def scored(d: Dict[str, Any]) -> ScoredItem:
+        return ScoredItem(product=Product(**d["product"]), persona=d["persona"],
+                          explanation=d["explanation"], quantity=d["quantity"])
+
+    report = CartReport(
+        persona=body["persona"],
+        items=[scored(d) for d in body["items"]],
+        alternatives=[
+            Alternative(original=scored(d["original"]), replacement=Product(**d["replacement"]),
+                        advantage=d["advantage"], improvement=d["improvement"])
+            for d in body["alternatives"]
+        ],
+        swapped_cart=None if body["swapped_cart"] is None else [Product(**d) for d in body["swapped_cart"]],
+        improvement_pct=body["improvement_pct"],
+        swap_prompt=body["swap_prompt"],
+        final_narrative="",
+        totals=body["totals"],
+    )
+    if lines is not None:
+        reorder_report(report, payload["data"], line_order(payload["lines"], lines))
+    return report, payload["data"]
+
+
+# Catalogue fields the shopping / cart pages read from a product
+PRODUCT_FIELDS = ['product_name_en', 'brands', 'quantity', 'category', 'subcategory',
+                  'labels', 'off:nutriscore_grade']
+
+
+def product_to_json(engine: "FastEngine", product: Product) -> Dict[str, Any]:
+    """Product -> the row shape the frontend's product list uses, plus its persona score"""
+    row = engine.store.row(product.product_id)
+    response = {}
+    for name in PRODUCT_FIELDS:
+        value = row.get(name, '')
+        # Missing CSV cells are NaN, which JSON can't carry
+        response[name] = '' if value != value or value is None else value
+    response['health_score'] = product.health_score
+    response['health_label'] = product.health_label
+    return response
+
+
+def products_response(engine: "FastEngine", args: Dict[str, List[str]]) -> Dict[str, Any]:
+    """
+    /api/products for query args as {name: [values]} (repeated names are
+    multi-valued filters). Raises ValueError on bad input.
+    """
+    def first(name: str, default: Optional[str] = None) -> Optional[str]:
+        values = args.get(name) or []
+        return values[0] if values else default
+
+    try:
+        limit = int(first('limit', str(product_filters.DEFAULT_PAGE_SIZE)))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    page = engine.query_products(
+        category=first('category') or None,
+        subcategory=first('subcategory') or None,
+        diets=list(args.get('diet') or []),
+        allergens=list(args.get('allergen') or []),
+        grades=[g.strip().lower() for g in args.get('grade') or []],
+        text=first('q') or None,
+        sort=first('sort', 'catalogue'),
+        persona=first('persona', 'standard'),
+        limit=max(1, min(limit, product_filters.MAX_PAGE_SIZE)),
+        cursor=first('cursor') or None,
+    )
+    return {
+        'products': [product_to_json(engine, product) for product in page.products],
+        'total': page.total,
+        'next_cursor': page.next_cursor,
+    }
+
+
+def ingredients_response(engine: "FastEngine", data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    /api/recipes/ingredients for a request body
+    ({"ingredients": [...], "persona": ..., "k": ...}). Raises ValueError on bad input.
+    """
+    if not data:
+        raise ValueError('No JSON data provided')
+    names = data.get('ingredients', [])
+    if not isinstance(names, list) or not names:
+        raise ValueError('No ingredients provided')
+    persona = data.get('persona', 'standard')
+    try:
+        k = max(1, min(int(data.get('k', MATCH_TOP_K)), recipe_search.MAX_TOP_K))
+    except (TypeError, ValueError):
+        raise ValueError('k must be an integer')
+
+    matches = engine.match_ingredients([str(n) for n in names], persona=persona, k=k)
+    return {
+        'persona': persona,
+        'ingredients': [
+            {
+                'name': m.name,
+                'key': m.key,
+                'found': bool(m.candidates),
+                'products': [
+                    dict(product_to_json(engine, product), match_score=score)
+                    for product, score in m.candidates
+                ],
+            }
+            for m in matches
+        ],
+    }
+
+
 # ============================================================================
 # MAIN ENGINE (ULTRA FAST)
 # ============================================================================
@@ -570,75 +1518,161 @@ class FastEngine:
         print("\n" + "=" * 80)
         print("B4UBuy ULTRA-FAST ENGINE")
         print("=" * 80)
-        self.loader = FastLoader(csv_path)
+        with telemetry.span("load"):
+            self.loader = FastLoader(csv_path)
+            self.store = self.loader.store
+
+        # Built once, shared by every request
+        self.matcher = FastMatcher(self.store, index_path_for(self.loader.csv_path))
+        self.alt_finder = FastAlternativeFinder(
+            self.store, load_alternative_rankings(self.loader.csv_path, self.store),
+            build_neighbour_index(self.store) if ALTERNATIVES_BY == "nearest" else None,
+        )
+        self.ingredients = IngredientMatcher.load_or_build(
+            ingredient_map_path_for(self.loader.csv_path),
+            self.matcher.index,
+            self.store.column("category"),
+        )
+        self.filters = FilterIndex.load_or_build(
+            filters_path_for(self.loader.csv_path),
+            self.store.values,
+            len(self.store),
+            self.loader.input_hash,
+        )
+
+        self._init_llm()
 
+        print("System ready - analysis will take ~5-10 seconds")
+        print("=" * 80 + "\n")
+
+    def _init_llm(self) -> None:
         # Initialize with Thesys C1 or OpenRouter
         self.llm = LLMNarrative(api_key=THESYS_API_KEY)
 
+        # Background pool for deferred narratives (analyze_cart(defer_narrative=True))
+        self.narratives = NarrativeJobs(self.llm)
 
-        print("System ready - analysis will take ~5-10 seconds")
-        print("=" * 80 + "\n")
+        # Batch matching for the asyncio path, so a big batch doesn't stall the loop
+        self.cpu_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="engine-cpu")
 
+        # Finished reports (minus narrative); per process like the narrative cache,
+        # since a SQLite connection can't cross a fork
+        self.reports = ReportCache(f"{self.loader.data_version()}:{ALTERNATIVES_BY}")
 
-    def analyze_cart(self, item_names: List[str], persona: Persona = "diabetic") -> CartReport:
-        print(f"\n🛒 Analyzing cart for {persona} persona...")
-        print(f"Items: {', '.join(item_names)}\n")
+    def reinit_after_fork(self) -> None:
+        """
+        Give a forked worker its own HTTP clients, cache connection and thread
+        pools. The catalogue, index and rankings stay shared with the parent.
+        """
+        self._init_llm()
+
+    def warm_up(self) -> None:
+        """Run the per-request path once (no LLM call) so the first request isn't the slow one"""
+        if not len(self.store):
+            return
+        name = self.store.string("name", 0)
+        self.matcher.find_index(name[: max(len(name) // 2, 3)])
+        idx = self.matcher.find_index(name)
+        self._build_report([self.store.product(idx, "standard")], "standard")
+        # An ingredient outside the map builds the matcher's word index now, before any fork
+        self.match_ingredients([name])
+        # Nutrient matrices for custom personas and cart totals, shared with forked workers
+        self.store.custom.prepare()
+        self.store.pack_sizes()
+        # Import the OpenAI SDK here too; forked workers then only build their clients
+        self.llm.connect()
+
+    def custom_persona(self, custom_weights: Dict[str, float]) -> str:
+        """
+        Persona key for a {nutrient column: weight} vector, usable anywhere a
+        persona name is. Raises ValueError on unknown nutrients / bad weights.
+        """
+        return self.store.custom.register(custom_weights)
 
-        # STEP 1: Load products with precomputed scores (FAST - no LLM)
-        print("STEP 1: Loading precomputed scores from CSV...")
-        all_products = self.loader.get_products_for_persona(persona)
 
-        matcher = FastMatcher(all_products)
+    def _pack_weights(self, rows: np.ndarray, quantities: np.ndarray) -> Tuple[np.ndarray, int]:
+        """
+        Grams (or ml) bought per cart line, and how many lines had no known
+        pack size (those count as the cart's median pack, else DEFAULT_PACK_GRAMS)
+        """
+        sizes = self.store.pack_sizes()[rows]
+        known = sizes > 0  # NaN (unknown) compares False
+        typical = float(np.median(sizes[known])) if known.any() else DEFAULT_PACK_GRAMS
+        return quantities * np.where(known, sizes, typical), int((~known).sum())
 
-        # STEP 2: Match items (FAST - simple string matching)
-        print("STEP 2: Matching products...")
-        matched: List[Product] = []
-        for name in item_names:
-            product = matcher.find_product(name)
-            if product:
-                matched.append(product)
-                emoji = (
-                    "🟢"
-                    if product.health_label == "green"
-                    else "🟠"
-                    if product.health_label == "amber"
-                    else "🔴"
-                )
-                print(f" {emoji} {product.name} - {product.health_label.upper()}")
+    def _cart_totals(self, rows: np.ndarray, swapped_rows: np.ndarray, grams: np.ndarray,
+                     unsized: int) -> Dict[str, Any]:
+        """
+        Nutrients in the whole cart as bought and after the swaps (same grams
+        of each replacement). Catalogue values are per 100 g; unknown ones add 0.
+        """
+        values = self.store.nutrients()[0]
+        # Summed in a fixed order, so the same lines in any order give the same totals
+        order = np.lexsort((grams, swapped_rows, rows))
+        rows, swapped_rows, grams = rows[order], swapped_rows[order], grams[order]
+        per_100g = grams / 100.0
+        before = per_100g @ values[rows]
+        after = per_100g @ values[swapped_rows]
+        return {
+            "grams": round(float(grams.sum()), 1),
+            "unsized_items": unsized,
+            "nutrients": {col: round(float(v), 2) for col, v in zip(NUTRICOLS, before)},
+            "nutrients_after_swaps": {col: round(float(v), 2) for col, v in zip(NUTRICOLS, after)},
+        }
 
+    def _build_report(self, matched: List[Product], persona: Persona,
+                      quantities: Optional[List[float]] = None) -> Tuple[CartReport, Dict[str, Any]]:
+        """Steps 3-5 for one cart; returns the report (no narrative yet) and the LLM payload"""
         # STEP 3: Score items (FAST - just read from CSV + add explanation)
         print("STEP 3: Adding explanations...")
+        start = time.perf_counter()
         scorer = FastScorer()
         scored_items: List[ScoredItem] = [
             scorer.score_item(p, persona) for p in matched
         ]
+        counts = np.ones(len(matched)) if quantities is None else np.asarray(quantities, dtype=np.float64)
+        for scored, count in zip(scored_items, counts.tolist()):
+            scored.quantity = count
+
+        start = telemetry.end_stage("score", start)
 
         # STEP 4: Find alternatives (FAST - code logic only)
         print("STEP 4: Finding alternatives...")
-        alt_finder = FastAlternativeFinder(all_products)
+        alt_finder = self.alt_finder
         alternatives: List[Alternative] = []
+        # Never suggest swapping to something already in the cart
+        in_cart = {s.product.product_id for s in scored_items}
 
         for scored in scored_items:
             if scored.product.health_label in ["red", "amber"]:
-                alt = alt_finder.find_alternative(scored, persona)
+                alt = alt_finder.find_alternative(scored, persona, exclude=in_cart)
                 if alt:
                     alternatives.append(alt)
                     print(
                         f" -> {alt.original.product.name} -> {alt.replacement.name} ({alt.improvement})"
                     )
 
+        start = telemetry.end_stage("alternatives", start, found=len(alternatives))
+
         # STEP 5: Calculate swapped cart and improvement
         print("STEP 5: Calculating improvement...")
         swapped_cart: Optional[List[Product]] = None
         improvement_pct: Optional[int] = None
         swap_prompt: Optional[str] = None
 
+        # Everything per cart line as arrays: rows, grams bought, scores
+        alt_map = {
+            alt.original.product.product_id: alt.replacement
+            for alt in alternatives
+        }
+        rows = np.array([s.product.product_id for s in scored_items], dtype=np.int64)
+        grams, unsized = self._pack_weights(rows, counts)
+        swapped_rows = np.array([alt_map[r].product_id if r in alt_map else r for r in rows.tolist()],
+                                dtype=np.int64)
+        totals = self._cart_totals(rows, swapped_rows, grams, unsized) if len(rows) else None
+
         if alternatives:
             # Build swapped cart
-            alt_map = {
-                alt.original.product.product_id: alt.replacement
-                for alt in alternatives
-            }
             swapped_cart = []
             for scored in scored_items:
                 if scored.product.product_id in alt_map:
@@ -646,49 +1680,19 @@ class FastEngine:
                 else:
                     swapped_cart.append(scored.product)
 
-            # Calculate improvement %
-            avg_before = np.mean([s.product.health_score for s in scored_items])
-            avg_after = np.mean([p.health_score for p in swapped_cart])
+            # Calculate improvement %: scores weighted by the grams bought, the
+            # replacement taking the same share of the cart as the original
+            score_before = np.array([s.product.health_score for s in scored_items])
+            score_after = np.array([p.health_score for p in swapped_cart])
+            avg_before = np.average(score_before, weights=grams)
+            avg_after = np.average(score_after, weights=grams)
             base = max(abs(avg_before), 0.1)
             improvement_pct = int(((avg_after - avg_before) / base) * 100)
             improvement_pct = max(0, min(100, improvement_pct))
 
             # Generate swap prompt (kept for CLI-style display if needed)
-            green_count_before = sum(
-                1 for s in scored_items if s.product.health_label == "green"
-            )
-            green_count_after = sum(
-                1 for p in swapped_cart if p.health_label == "green"
-            )
-
-            swap_prompt = f"""
-╔══════════════════════════════════════════════════════════════════╗
-║ 🔄 PROPOSED SWAPPED CART                                         ║
-╠══════════════════════════════════════════════════════════════════╣
-"""
-            for i, product in enumerate(swapped_cart, 1):
-                emoji = (
-                    "🟢"
-                    if product.health_label == "green"
-                    else "🟠"
-                    if product.health_label == "amber"
-                    else "🔴"
-                )
-                swap_prompt += f"║ {i}. {emoji} {product.name[:50]:<50} ║\n"
-
-            swap_prompt += f"""╠══════════════════════════════════════════════════════════════════╣
-║ 📊 IMPROVEMENT ANALYSIS                                         ║
-╠══════════════════════════════════════════════════════════════════╣
-║ • Cart will improve by {improvement_pct}% if you swap           ║
-║ • GREEN items: {green_count_before} → {green_count_after}                     ║
-║ • Your cart will be {improvement_pct}% healthier for {persona}  ║
-╠══════════════════════════════════════════════════════════════════╣
-║ ❓ Would you like to apply these swaps? (y/n)                    ║
-╚══════════════════════════════════════════════════════════════════╝
-"""
-
-        # STEP 6: LLM generates final integrated narrative (ONLY LLM CALL)
-        print("STEP 6: Generating integrated narrative with LLM...")
+            swap_prompt = swap_prompt_text(scored_items, swapped_cart, improvement_pct, persona)
+        telemetry.end_stage("improvement", start)
 
         report_data: Dict[str, Any] = {
             "persona": persona,
@@ -699,6 +1703,7 @@ class FastEngine:
                     "category": s.product.subcategory,
                     "explanation": s.explanation,
                     "score": s.product.health_score,
+                    "quantity": s.quantity,
                 }
                 for s in scored_items
             ],
@@ -721,22 +1726,304 @@ class FastEngine:
             "red_count": sum(
                 1 for s in scored_items if s.product.health_label == "red"
             ),
+            "cart_totals": totals,
         }
+        if CustomPersonas.is_custom(persona):
+            # The key means nothing to the LLM; the weights say what the user cares about
+            report_data["persona_weights"] = self.store.custom.weights(persona)
 
-        narrative = self.llm.generate_narrative(report_data)
-
-        print("Analysis complete!\n")
-
-        return CartReport(
+        report = CartReport(
             persona=persona,
             items=scored_items,
             alternatives=alternatives,
             swapped_cart=swapped_cart,
             improvement_pct=improvement_pct,
             swap_prompt=swap_prompt,
-            final_narrative=narrative,
+            final_narrative="",
+            totals=totals,
+        )
+        return report, report_data
+
+    def _cart_report(self, items: Sequence[CartItem], persona: Persona) -> Tuple[CartReport, Dict[str, Any]]:
+        """Steps 1-5 of analyze_cart: everything but the narrative (cached per cart)"""
+        item_names, quantities = cart_lines(items)
+        lines = normalise_lines(item_names, quantities)
+        key = self.reports.key(item_names, persona, quantities)
+        cached = self._cached_report(key, lines)
+        if cached is not None:
+            print(f"\n🛒 Cart for {persona} persona served from the report cache")
+            return cached
+
+        report, report_data, kept = self._match_and_build(item_names, quantities, persona)
+        self._store_report(key, report, report_data, [lines[i] for i in kept])
+        return report, report_data
+
+    def _cached_report(self, key: str, lines: List[list]) -> Optional[Tuple[CartReport, Dict[str, Any]]]:
+        if not self.reports.enabled:
+            return None
+        with telemetry.span("report_cache") as attrs:
+            cached = self.reports.get(key)
+            attrs["hit"] = cached is not None
+        telemetry.annotate(report_cache="hit" if cached is not None else "miss")
+        return report_from_cache(cached, lines) if cached is not None else None
+
+    def _store_report(self, key: str, report: CartReport, report_data: Dict[str, Any],
+                      lines: List[list]) -> None:
+        """lines: the normalised line of each report item (the cart's matched lines)"""
+        if self.reports.enabled:
+            self.reports.put(key, report_to_cache(report, report_data, lines))
+
+    def _match_and_build(self, item_names: List[str], quantities: List[float],
+                         persona: Persona) -> Tuple[CartReport, Dict[str, Any], List[int]]:
+        """Steps 1-5 from the cart lines; also returns the positions of the lines that matched"""
+        print(f"\n🛒 Analyzing cart for {persona} persona...")
+        print(f"Items: {', '.join(item_names)}\n")
+
+        # STEP 1: Precomputed persona columns are already in the store (FAST - no LLM)
+        print("STEP 1: Using precomputed persona scores...")
+        matcher = self.matcher
+
+        # STEP 2: Match items (FAST - simple string matching)
+        print("STEP 2: Matching products...")
+        start = time.perf_counter()
+        matched: List[Product] = []
+        matched_quantities: List[float] = []
+        kept: List[int] = []
+        for i, (name, quantity) in enumerate(zip(item_names, quantities)):
+            product = matcher.find_product(name, persona)
+            if product:
+                matched.append(product)
+                matched_quantities.append(quantity)
+                kept.append(i)
+                emoji = (
+                    "🟢"
+                    if product.health_label == "green"
+                    else "🟠"
+                    if product.health_label == "amber"
+                    else "🔴"
+                )
+                print(f" {emoji} {product.name} - {product.health_label.upper()}")
+        telemetry.end_stage("match", start, items=len(item_names), matched=len(matched))
+
+        return (*self._build_report(matched, persona, matched_quantities), kept)
+
+    def analyze_cart(self, items: Sequence[CartItem], persona: Persona = "diabetic",
+                     defer_narrative: bool = False, skip_narrative: bool = False) -> CartReport:
+        """
+        items: product names, or {"name", "quantity"} dicts (see cart_lines).
+        skip_narrative: no LLM call at all, for callers that only show the
+        structured report (final_narrative stays "")
+        """
+        report, report_data = self._cart_report(items, persona)
+        if skip_narrative:
+            print("Analysis complete (no narrative)!\n")
+            return report
+
+        # STEP 6: LLM generates final integrated narrative (ONLY LLM CALL)
+        print("STEP 6: Generating integrated narrative with LLM...")
+
+        narrative_job_id: Optional[str] = None
+        if defer_narrative:
+            # Structured results go back now; narrative is fetched by job id
+            narrative = ""
+            narrative_job_id = self.narratives.submit(report_data)
+        else:
+            narrative = self.llm.generate_narrative(report_data)
+
+        print("Analysis complete!\n")
+
+        report.final_narrative = narrative
+        report.narrative_job_id = narrative_job_id
+        return report
+
+    async def analyze_cart_async(self, items: Sequence[CartItem], persona: Persona = "diabetic",
+                                 defer_narrative: bool = False, skip_narrative: bool = False) -> CartReport:
+        """
+        analyze_cart for an event loop. Matching and scoring take well under a
+        millisecond per item and run inline; the narrative is awaited on the
+        shared async LLM clients, so no thread waits on the provider.
+        """
+        report, report_data = self._cart_report(items, persona)
+        if skip_narrative:
+            print("Analysis complete (no narrative)!\n")
+            return report
+
+        print("STEP 6: Generating integrated narrative with LLM...")
+        if defer_narrative:
+            report.narrative_job_id = self.narratives.submit(report_data)
+        else:
+            report.final_narrative = await self.llm.agenerate_narrative(report_data)
+
+        print("Analysis complete!\n")
+        return report
+
+    def match_ingredients(self, names: List[str], persona: Persona = "standard",
+                          k: int = MATCH_TOP_K) -> List[IngredientMatch]:
+        """
+        Catalogue products for a whole recipe's ingredient list in one call:
+        a map lookup per ingredient, ranked by the persona's health score.
+        """
+        matched = self.ingredients.match_batch(names, self.store.scores_for(persona), k=k)
+        rows = sorted({idx for _, found in matched for idx, _ in found})
+        views = self.store.products_for(rows, [persona])
+        return [
+            IngredientMatch(
+                name=name,
+                key=key,
+                candidates=[(views[(idx, persona)], score) for idx, score in found],
+            )
+            for name, (key, found) in zip(names, matched)
+        ]
+
+    def query_products(self, category: Optional[str] = None, subcategory: Optional[str] = None,
+                       diets: Sequence[str] = (), allergens: Sequence[str] = (),
+                       grades: Sequence[str] = (), text: Optional[str] = None,
+                       sort: str = "catalogue", persona: Persona = "standard",
+                       limit: int = product_filters.DEFAULT_PAGE_SIZE,
+                       cursor: Optional[str] = None) -> ProductPage:
+        """
+        One page of the catalogue under the shopping screen's filters.
+        Raises ValueError on an unknown allergen / grade / sort / persona or a bad cursor.
+        """
+        if sort not in product_filters.SORTS:
+            raise ValueError(f"sort must be one of {', '.join(product_filters.SORTS)}")
+        if persona not in self.store.persona_index and persona not in self.store.custom.entries:
+            raise ValueError(f"unknown persona {persona!r} (one of {', '.join(self.store.persona_index)} "
+                             f"or a registered custom persona)")
+        # Only the score order depends on the persona
+        order_key = persona if sort == "score" else ""
+        start = product_filters.decode_cursor(cursor, self.filters.digest, sort, order_key) if cursor else 0
+
+        within = None
+        if text:
+            hits = self.matcher.index.rows_containing(text)
+            # The index spells a missing brand "nan"; that is no match
+            no_brand = self.store.codes["brand"][hits] == catalogue.MISSING
+            needle = text.lower()
+            hits = [idx for idx, missing in zip(hits.tolist(), no_brand.tolist())
+                    if not missing or needle in self.store.string("name", idx).lower()]
+            mask = np.zeros(len(self.store), dtype=bool)
+            mask[hits] = True
+            within = product_filters.pack(mask)
+        bits = self.filters.select(category, subcategory, diets, allergens, grades, within)
+        scores = self.store.scores_for(persona)
+        if sort == "score" and CustomPersonas.is_custom(persona):
+            # Kept with the vector, so it is dropped when CustomPersonas evicts it
+            order = self.store.custom.memo(persona, "score_order", lambda: product_filters.score_order(scores))
+            if order is None:  # evicted since the check above
+                order = product_filters.score_order(scores)
+        else:
+            order = self.filters.order(sort, scores, order_key)
+        rows, next_pos = self.filters.page(bits, order, start, limit)
+
+        views = self.store.products_for(rows, [persona])
+        return ProductPage(
+            products=[views[(idx, persona)] for idx in rows],
+            total=product_filters.count(bits),
+            next_cursor=(product_filters.encode_cursor(self.filters.digest, sort, order_key, next_pos)
+                         if next_pos is not None else None),
         )
 
+    def _batch_reports(self, carts: List[Tuple[Sequence[CartItem], Persona]]) -> Tuple[List[CartReport], Dict[str, Any]]:
+        """Every cart's report plus the combined narrative payload"""
+        print(f"\n🛒 Analyzing {len(carts)} carts...")
+
+        lines = [cart_lines(items) for items, _ in carts]
+        normalised = [normalise_lines(names, quantities) for names, quantities in lines]
+        keys = [self.reports.key(names, persona, quantities)
+                for (names, quantities), (_, persona) in zip(lines, carts)]
+        found = [self._cached_report(key, cart) for key, cart in zip(keys, normalised)]
+        todo = [i for i, entry in enumerate(found) if entry is None]
+
+        # One matching pass over the distinct names in the uncached carts
+        start = time.perf_counter()
+        names = list(dict.fromkeys(name for i in todo for name in lines[i][0]))
+        rows_by_name = {name: self.matcher.find_index(name) for name in names}
+        rows = sorted({r for r in rows_by_name.values() if r is not None})
+        batch_personas = list(dict.fromkeys(persona for _, persona in carts))
+        views = self.store.products_for(rows, list(dict.fromkeys(carts[i][1] for i in todo))) if rows else {}
+        telemetry.end_stage("match", start, items=len(names), matched=len(rows))
+
+        for i in todo:
+            persona = carts[i][1]
+            item_names, quantities = lines[i]
+            kept = [j for j, name in enumerate(item_names) if rows_by_name[name] is not None]
+            matched = [views[(rows_by_name[item_names[j]], persona)] for j in kept]
+            found[i] = self._build_report(matched, persona, [quantities[j] for j in kept])
+            self._store_report(keys[i], *found[i], [normalised[i][j] for j in kept])
+
+        reports = [report for report, _ in found]
+        members = [report_data for _, report_data in found]
+
+        combined: Dict[str, Any] = {
+            "persona": ", ".join(batch_personas),
+            "members": members,
+        }
+        return reports, combined
+
+    def analyze_carts(self, carts: List[Tuple[Sequence[CartItem], Persona]],
+                      defer_narrative: bool = False) -> BatchReport:
+        """
+        Analyze many (items, persona) carts in one call.
+
+        Every distinct item name is matched once for the whole batch and each
+        matched product is read for all requested personas in one lookup.
+        A single combined narrative covers every cart.
+        """
+        reports, combined = self._batch_reports(carts)
+
+        narrative_job_id: Optional[str] = None
+        if defer_narrative:
+            narrative = ""
+            narrative_job_id = self.narratives.submit(combined)
+        else:
+            narrative = self.llm.generate_narrative(combined)
+
+        print("Batch analysis complete!\n")
+        return BatchReport(reports=reports, final_narrative=narrative,
+                           narrative_job_id=narrative_job_id)
+
+    async def analyze_carts_async(self, carts: List[Tuple[Sequence[CartItem], Persona]],
+                                  defer_narrative: bool = False) -> BatchReport:
+        """analyze_carts for an event loop; a whole batch is matched off the loop"""
+        loop = asyncio.get_running_loop()
+        reports, combined = await loop.run_in_executor(
+            self.cpu_pool, contextvars.copy_context().run, self._batch_reports, carts
+        )
+
+        narrative, narrative_job_id = "", None
+        if defer_narrative:
+            narrative_job_id = self.narratives.submit(combined)
+        else:
+            narrative = await self.llm.agenerate_narrative(combined)
+
+        print("Batch analysis complete!\n")
+        return BatchReport(reports=reports, final_narrative=narrative,
+                           narrative_job_id=narrative_job_id)
+
+
+# ============================================================================
+# SHARED ENGINE (serverless handlers)
+# ============================================================================
+
+_shared_engine: Optional[FastEngine] = None
+_shared_engine_lock = threading.Lock()
+
+
+def shared_engine() -> Tuple[FastEngine, bool]:
+    """
+    One engine per process for the api/ serverless handlers, built on first
+    use and kept for warm invocations: (engine, True if this call built it)
+    """
+    global _shared_engine
+    if _shared_engine is not None:
+        return _shared_engine, False
+    with _shared_engine_lock:
+        if _shared_engine is not None:
+            return _shared_engine, False
+        _shared_engine = FastEngine()
+        return _shared_engine, True
+
 
 # ============================================================================
 # MAIN
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped binary catalogue.
+
+precompute.py writes the scored catalogue as the CSV and also as a directory
+of raw .npy arrays with a JSON manifest:
+
+  manifest.json                  rows, personas, label tables, column layout
+  scores.npy                     float32 (rows x personas), Fortran order
+  labels.npy, confidence.npy     int8 codes (rows x personas), Fortran order
+  col<i>.npy                     numeric column i (float64 / smallest int)
+  col<i>.codes.npy               int32 codes into column i's string table (-1 = missing)
+  col<i>.offsets.npy             int64 byte offsets of each table entry (n + 1)
+  col<i>.data.npy                uint8 UTF-8 bytes of every table entry
+
+Every array is opened with np.load(mmap_mode='r'). Opening one is a few
+syscalls, and every worker that maps the same files shares a single copy in
+the page cache. Nothing here imports pandas, so serverless handlers can load
+the catalogue without it.
+"""
+
+import json
+import os
+import shutil
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Bump when the on-disk layout changes
+CATALOGUE_VERSION = 1
+
+LABELS: List[str] = ["green", "amber", "red"]
+CONFIDENCES: List[str] = ["high", "low"]
+
+# String code for a missing (NaN/None) value
+MISSING = -1
+
+
+def catalogue_path_for(csv_path: str) -> str:
+    """Where the binary catalogue for a precomputed CSV lives"""
+    return os.path.splitext(csv_path)[0] + ".catalogue"
+
+
+def manifest_path(path: str) -> str:
+    return os.path.join(path, "manifest.json")
+
+
+def _is_missing(v) -> bool:
+    return v is None or (isinstance(v, float) and v != v)
+
+
+# ============================================================================
+# ENCODING (shared with ProductStore.from_frame)
+# ============================================================================
+
+
+def encode_strings(values: Sequence[Any]) -> Tuple[List[str], np.ndarray]:
+    """Intern values into (table, int32 codes); missing values get MISSING"""
+    table: List[str] = []
+    lookup: Dict[str, int] = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, v in enumerate(values):
+        if _is_missing(v):
+            codes[i] = MISSING
+            continue
+        v = str(v)
+        code = lookup.get(v)
+        if code is None:
+            code = lookup[v] = len(table)
+            table.append(v)
+        codes[i] = code
+    return table, codes
+
+
+def encode_categorical(values: Sequence[Any], default: str, table: List[str]) -> np.ndarray:
+    """int8 codes of lower-cased values; missing -> default, new values extend `table`"""
+    lookup = {v: i for i, v in enumerate(table)}
+    codes = np.empty(len(values), dtype=np.int8)
+    for i, v in enumerate(values):
+        v = default if _is_missing(v) else str(v).lower()
+        code = lookup.get(v)
+        if code is None:
+            code = lookup[v] = len(table)
+            table.append(v)
+        codes[i] = code
+    return codes
+
+
+def persona_matrices(df, persona_names: Sequence[str]):
+    """
+    (present personas, scores, labels, confidence, label_table, confidence_table)
+    for the personas that have precomputed columns in `df`. Matrices are
+    products x personas, Fortran order, float32 / int8.
+    """
+    present = [p for p in persona_names if f"health_score_{p}" in df.columns]
+    n = len(df)
+    label_table, confidence_table = list(LABELS), list(CONFIDENCES)
+    scores = np.zeros((n, len(present)), dtype=np.float32, order="F")
+    labels = np.zeros((n, len(present)), dtype=np.int8, order="F")
+    confidence = np.zeros((n, len(present)), dtype=np.int8, order="F")
+
+    for j, persona in enumerate(present):
+        scores[:, j] = _float_column(df[f"health_score_{persona}"].tolist())
+        for out, col, default, table in (
+            (labels, f"health_label_{persona}", "amber", label_table),
+            (confidence, f"health_confidence_{persona}", "low", confidence_table),
+        ):
+            values = df[col].tolist() if col in df.columns else [None] * n
+            out[:, j] = encode_categorical(values, default, table)
+    return present, scores, labels, confidence, label_table, confidence_table
+
+
+def _float_column(values: Sequence[Any]) -> np.ndarray:
+    """Floats with unparseable/missing values as 0.0 (to_numeric(coerce).fillna(0))"""
+    try:
+        arr = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        arr = np.array([_to_float(v) for v in values], dtype=np.float64)
+    return np.where(np.isnan(arr), 0.0, arr)
+
+
+def _to_float(v) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+# ============================================================================
+# STRING TABLE
+# ============================================================================
+
+
+class StringTable:
+    """Offset-indexed UTF-8 string table; entries are decoded on access"""
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    @staticmethod
+    def pack(table: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [s.encode("utf-8") for s in table]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def tolist(self) -> List[str]:
+        blob = self.data.tobytes()
+        bounds = self.offsets.tolist()
+        return [blob[a:b].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+
+
+# ============================================================================
+# WRITE
+# ============================================================================
+
+
+def write_catalogue(df, path: str, input_hash: str, persona_names: Sequence[str]) -> None:
+    """Write `df` as a binary catalogue directory, replacing any previous one"""
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    def save(name: str, arr: np.ndarray) -> None:
+        np.save(os.path.join(tmp, name), arr, allow_pickle=False)
+
+    present, scores, labels, confidence, label_table, confidence_table = persona_matrices(df, persona_names)
+    save("scores.npy", scores)
+    save("labels.npy", labels)
+    save("confidence.npy", confidence)
+
+    persona_cols = {f"health_{kind}_{p}": (kind, p)
+                    for p in present for kind in ("score", "label", "confidence")}
+    columns = []
+    for i, col in enumerate(df.columns):
+        if col in persona_cols:
+            kind, persona = persona_cols[col]
+            columns.append({"name": col, "kind": kind, "persona": persona})
+            continue
+
+        series = df[col]
+        if series.dtype.kind == "f":
+            save(f"col{i}.npy", series.to_numpy(dtype=np.float64))
+            columns.append({"name": col, "kind": "float", "file": f"col{i}"})
+        elif series.dtype.kind in "iub":
+            values = series.to_numpy()
+            dtype = np.result_type(np.min_scalar_type(values.min()), np.min_scalar_type(values.max())) \
+                if len(values) else np.int8
+            save(f"col{i}.npy", values.astype(dtype))
+            columns.append({"name": col, "kind": "int", "file": f"col{i}"})
+        else:
+            table, codes = encode_strings(series.tolist())
+            offsets, data = StringTable.pack(table)
+            save(f"col{i}.codes.npy", codes)
+            save(f"col{i}.offsets.npy", offsets)
+            save(f"col{i}.data.npy", data)
+            columns.append({"name": col, "kind": "str", "file": f"col{i}"})
+
+    # Manifest last: a directory without one is never opened
+    with open(manifest_path(tmp), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": CATALOGUE_VERSION,
+            "input_hash": input_hash,
+            "rows": len(df),
+            "personas": present,
+            "label_table": label_table,
+            "confidence_table": confidence_table,
+            "columns": columns,
+        }, f, indent=2)
+
+    # Swap directories; workers still mapping the old files keep their inodes
+    old = path + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+# ============================================================================
+# READ
+# ============================================================================
+
+
+class Catalogue:
+    def __init__(self, path: str, manifest: Dict[str, Any]):
+        self.path = path
+        self.manifest = manifest
+        self.rows: int = manifest["rows"]
+        self.input_hash: str = manifest["input_hash"]
+        self.personas: List[str] = manifest["personas"]
+        self.label_table: List[str] = manifest["label_table"]
+        self.confidence_table: List[str] = manifest["confidence_table"]
+        self.columns: Dict[str, Dict[str, Any]] = {c["name"]: c for c in manifest["columns"]}
+
+        self.scores = self._load("scores.npy")
+        self.labels = self._load("labels.npy")
+        self.confidence = self._load("confidence.npy")
+        self._strings: Dict[str, Tuple[StringTable, np.ndarray]] = {}
+        self._numbers: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def open(cls, path: str, input_hash: Optional[str] = None) -> Optional["Catalogue"]:
+        """Map a catalogue; None if missing, from another layout or other inputs"""
+        try:
+            with open(manifest_path(path), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != CATALOGUE_VERSION:
+                return None
+            if input_hash is not None and manifest.get("input_hash") != input_hash:
+                return None
+            return cls(path, manifest)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, name), mmap_mode="r", allow_pickle=False)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def has(self, name: str) -> bool:
+        return name in self.columns
+
+    def strings(self, name: str) -> Tuple[StringTable, np.ndarray]:
+        """(table, codes) for a text column"""
+        if name not in self._strings:
+            f = self.columns[name]["file"]
+            table = StringTable(self._load(f"{f}.offsets.npy"), self._load(f"{f}.data.npy"))
+            self._strings[name] = (table, self._load(f"{f}.codes.npy"))
+        return self._strings[name]
+
+    def numbers(self, name: str) -> np.ndarray:
+        """Array for a numeric column"""
+        if name not in self._numbers:
+            self._numbers[name] = self._load(f"{self.columns[name]['file']}.npy")
+        return self._numbers[name]
+
+    def row(self, idx: int) -> Dict[str, Any]:
+        """Every column of one row, as the CSV loader would have returned it"""
+        persona_index = {p: j for j, p in enumerate(self.personas)}
+        out: Dict[str, Any] = {}
+        for name, col in self.columns.items():
+            kind = col["kind"]
+            if kind == "str":
+                table, codes = self.strings(name)
+                code = int(codes[idx])
+                out[name] = table[code] if code != MISSING else float("nan")
+            elif kind in ("float", "int"):
+                out[name] = self.numbers(name)[idx].item()
+            else:
+                j = persona_index[col["persona"]]
+                if kind == "score":
+                    out[name] = float(str(self.scores[idx, j]))
+                elif kind == "label":
+                    out[name] = self.label_table[self.labels[idx, j]]
+                else:
+                    out[name] = self.confidence_table[self.confidence[idx, j]]
+        return out
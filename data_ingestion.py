@@ -1,14 +1,18 @@
+import argparse
+import os
+import sys
+import time
+
 import pandas as pd
 
 # ---- CONFIG ----
-input_path = "/Users/aitijhya/Desktop/Encode/openfoodfacts_export.tsv"   # your input file (Excel or CSV)
-output_path = "/Users/aitijhya/Desktop/Encode/openfoodfacts_extracted.csv" # desired output CSV
-
-# If your file is actually an Excel (.xlsx), use:
-# df = pd.read_excel(input_path)
+# Resolve file paths relative to this module so relative CWDs won't break runs
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+input_path = os.path.join(BASE_DIR, "openfoodfacts_export.tsv")     # OpenFoodFacts TSV export
+output_path = os.path.join(BASE_DIR, "openfoodfacts_extracted.csv")  # desired output CSV
 
-# For the provided OpenFoodFacts export CSV:
-df = pd.read_csv(input_path, sep="\t", low_memory=False)
+# Rows parsed per chunk; peak memory depends on this, not on the dump size
+CHUNK_ROWS = 100_000
 
 # Columns to keep
 cols_to_keep = [
@@ -42,17 +46,91 @@ cols_to_keep = [
     "off:nutriscore_grade",
 ]
 
-# Keep only the intersection of requested columns and existing columns
-existing_cols = [c for c in cols_to_keep if c in df.columns]
+# Numeric columns (everything else is read as text)
+numeric_cols = [c for c in cols_to_keep if c.endswith("_value")] + ["off:nova_groups"]
+
+
+def select_columns(path):
+    """Read only the header and return the requested columns that exist"""
+    header = pd.read_csv(path, sep="\t", nrows=0).columns
+    existing_cols = [c for c in cols_to_keep if c in header]
+
+    # Optionally, warn about missing columns
+    missing_cols = [c for c in cols_to_keep if c not in header]
+    if missing_cols:
+        print("Warning: these columns were not found in the input and will be omitted:")
+        for c in missing_cols:
+            print(" -", c)
+    return existing_cols
+
+
+def iter_chunks(path, columns, chunk_rows=CHUNK_ROWS, drop_unnamed=True):
+    """
+    Yield cleaned DataFrame chunks. Only `columns` are parsed, all as text
+    (no per-chunk dtype inference); numeric columns are converted explicitly.
+    """
+    reader = pd.read_csv(
+        path,
+        sep="\t",
+        usecols=columns,
+        dtype=str,
+        keep_default_na=True,
+        chunksize=chunk_rows,
+    )
+    for chunk in reader:
+        rows_read = len(chunk)
+        if drop_unnamed and "product_name_en" in chunk.columns:
+            names = chunk["product_name_en"]
+            chunk = chunk[names.notna() & (names.str.strip() != "")]
+        for col in numeric_cols:
+            if col in chunk.columns:
+                chunk[col] = pd.to_numeric(chunk[col], errors="coerce")
+        # Keep the configured column order, not the file's
+        yield rows_read, chunk[columns]
+
+
+def run(input_path=input_path, output_path=output_path, chunk_rows=CHUNK_ROWS,
+        drop_unnamed=True):
+    columns = select_columns(input_path)
+    total_bytes = os.path.getsize(input_path)
+    start = time.perf_counter()
+    rows_in = rows_out = 0
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+        for i, (rows_read, chunk) in enumerate(
+            iter_chunks(input_path, columns, chunk_rows, drop_unnamed)
+        ):
+            chunk.to_csv(out, index=False, header=(i == 0))
+            rows_in += rows_read
+            rows_out += len(chunk)
+
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            print(
+                f"  chunk {i + 1}: {rows_in:,} rows read, {rows_out:,} kept "
+                f"({rows_in / elapsed:,.0f} rows/s)",
+                file=sys.stderr,
+            )
+    os.replace(tmp_path, output_path)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Saved {rows_out} rows with {len(columns)} columns to {output_path} "
+        f"({rows_in} rows read, {total_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s, {elapsed:.1f}s)"
+    )
+    return rows_in, rows_out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream the OpenFoodFacts TSV export into a slim CSV")
+    parser.add_argument("--input", default=input_path, help="OpenFoodFacts TSV export")
+    parser.add_argument("--output", default=output_path, help="CSV to write")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--keep-unnamed", action="store_true",
+                        help="keep rows without product_name_en")
+    args = parser.parse_args(argv)
+    run(args.input, args.output, args.chunk_rows, drop_unnamed=not args.keep_unnamed)
 
-# Optionally, warn about missing columns
-missing_cols = [c for c in cols_to_keep if c not in df.columns]
-if missing_cols:
-    print("Warning: these columns were not found in the input and will be omitted:")
-    for c in missing_cols:
-        print(" -", c)
 
-# Subset and write to CSV
-df_out = df[existing_cols]
-df_out.to_csv(output_path, index=False)
-print(f"Saved {len(df_out)} rows with {len(existing_cols)} columns to {output_path}")
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,19 @@
-import pandas as pd
+import argparse
+import os
+from collections import deque
+
 import numpy as np
+import pandas as pd
 
 
 # ---------- CONFIG ----------
-INPUT_PATH = "openfoodfacts_final.csv"       # your current transformed file
-OUTPUT_PATH = "openfoodfacts_categorized.csv"
-
-
-# ---------- LOAD ----------
-df = pd.read_csv(INPUT_PATH, low_memory=False)
-
-
-# ---------- PREP: preserve original index ----------
-df = df.reset_index().rename(columns={"index": "orig_idx"})
-
-
-# ---------- STEP 1: normalise + explode categories ----------
-def split_categories(cat_str: str):
-    if pd.isna(cat_str):
-        return []
-    return [p.strip() for p in str(cat_str).split(",") if p.strip() != ""]
-
-
-df["categories_norm"] = df["categories"].fillna("").astype(str).apply(split_categories)
-df_exploded = df.explode("categories_norm").copy()
-df_exploded["categories_norm"] = (
-    df_exploded["categories_norm"].astype(str).str.strip()
-)
-df_exploded = df_exploded[df_exploded["categories_norm"] != ""]
-
-
-# ---------- STEP 2: pick leaf category ----------
-leaf_series = df_exploded["categories_norm"]
+# Resolve file paths relative to this module so relative CWDs won't break runs
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUT_PATH = os.path.join(BASE_DIR, "openfoodfacts_final.csv")       # your current transformed file
+OUTPUT_PATH = os.path.join(BASE_DIR, "openfoodfacts_categorized.csv")
 
 
-# ---------- STEP 3: primary mapping rules ----------
+# ---------- STEP 1: primary mapping rules (exact leaf category) ----------
 MAPPING = {
     "Chips and fries": ("Snacks", "Chips, Wafers & Crisps"),
     "Fries": ("Snacks", "Chips, Wafers & Crisps"),
@@ -85,202 +64,274 @@ MAPPING = {
 }
 
 
-def map_leaf_to_tuple(leaf: str) -> str:
-    leaf = leaf.strip()
-    if not leaf:
-        return np.nan
-    if leaf in MAPPING:
-        cat, subcat = MAPPING[leaf]
-        return f"{cat}, {subcat}"
-    low = leaf.lower()
-    if "biscuit" in low or "cookie" in low:
-        return "Sweets & Confectionery, Biscuits & Cookies"
-    if "chips" in low or "wafers" in low or "crisps" in low:
-        return "Snacks, Chips, Wafers & Crisps"
-    if "cereal" in low or "muesli" in low or "corn flakes" in low:
-        return "Staples & Grains, Breakfast Cereals & Muesli"
-    if "milkshake" in low or "milk shake" in low:
-        return "Beverages, Milk-Based Beverages"
-    if "juice" in low or "nectar" in low:
-        return "Beverages, Fruit-Based Beverages"
-    if "pickle" in low or "chutney" in low:
-        return "Condiments, Chutneys & Pickles"
-    if "masala" in low or "spice mix" in low:
-        return "Spices & Herbs, Masalas & Blends"
-    if "dal" in low or "lentil" in low:
-        return "Pulses & Legumes, Lentils & Dals"
-    return np.nan
-
-
-df_exploded["cat_subcat"] = leaf_series.apply(map_leaf_to_tuple)
-
-
-# ---------- STEP 4: collapse back ----------
-df_mapped = (
-    df_exploded
-    .dropna(subset=["cat_subcat"])
-    .groupby("orig_idx")["cat_subcat"]
-    .first()
-)
-
-df = df.set_index("orig_idx")
-df["category_subcategory"] = df_mapped
-
-
-# ---------- STEP 5: fallback mapping on full category list ----------
-cat_lists = (
-    df_exploded
-    .groupby("orig_idx")["categories_norm"]
-    .apply(list)
-)
-df["categories_norm"] = cat_lists
-
-
-def fallback_map(cat_list):
-    if not isinstance(cat_list, list) or not cat_list:
-        return np.nan
-
-    text = " | ".join(cat_list).lower()
-    leaf = cat_list[-1].lower()
-
-    if "instant noodles" in text:
-        return "Staples & Grains, Noodles & Vermicelli"
-    if "instant noodle soups" in text or "dehydrated asian-style soup with noodles" in text:
-        return "Ready Foods, Rehydratable & Dried Meals"
-
-    if "almonds" in text:
-        return "Nuts & Seeds, Raw Nuts"
-    if "cashew nuts" in text:
-        return "Nuts & Seeds, Raw Nuts"
-    if "unsalted cashews" in text or "roasted salted almonds and cashew" in text:
-        return "Nuts & Seeds, Roasted & Salted Nuts"
-    if "sunflower seeds" in text or "flax seeds" in text or "basil seeds" in text:
-        return "Nuts & Seeds, Seeds & Seed Mixes"
-    if "fox nuts" in text or "makhana" in text:
-        return "Nuts & Seeds, Seeds & Seed Mixes"
-
-    if "dried fruits" in text or "dried plant-based foods" in text:
-        return "Fruits, Dried Fruits"
-    if "raisins" in text or "dried apricots" in text or "dates" in text:
-        return "Fruits, Dried Fruits"
-    if "berries" in text or "blueberries" in text:
-        return "Fruits, Dried Fruits"
-
-    if "sunflower oils" in text or "ricebran oil" in text or "rice bran oil" in text:
-        return "Oils & Fats, Vegetable Oils"
-    if "mustard oils" in text:
-        return "Oils & Fats, Seed & Nut Oils"
-    if "palm oils" in text or "palm oil refined" in text:
-        return "Oils & Fats, Vegetable Oils"
-    if "ghee" in text or "clarified butter" in text or "butter fat" in text:
-        return "Oils & Fats, Ghee & Butter"
-
-    if "wheat vermicelli" in text or "vermicelli" in text:
-        return "Staples & Grains, Noodles & Vermicelli"
-    if "pastas" in text:
-        return "Staples & Grains, Pasta & Macaroni"
-    if "granulated wheat" in text or "semolina" in text or "suji" in text:
-        return "Staples & Grains, Semolina & Rava"
-    if "puffed rice blend" in text or "wheat puffs" in text:
-        return "Staples & Grains, Rice & Rice Products"
-
-    if "sweeteners" in text or "sugars" in text or "jaggery" in text:
-        return "Ingredients, Sugars & Sweeteners"
-    if "syrups" in text or "date syrups" in text:
-        return "Ingredients, Sugars & Sweeteners"
-
-    if "coriander powder" in text:
-        return "Spices & Herbs, Ground Spices"
-    if "spice mix" in text:
-        return "Spices & Herbs, Masalas & Blends"
-
-    if "curd" in text or "dahi" in text:
-        return "Dairy, Yogurt & Fermented Dairy"
-    if "mozzarella" in text or "cheese cubes" in text or "cheese balls" in text:
-        return "Dairy, Cheese & Paneer"
-    if "ice creams" in text or "icecream" in text or "ice cream bars" in text \
-       or "ice cream cones" in text or "ice cream sandwiches" in text:
-        return "Dairy, Dairy Desserts"
-
-    if "ready-to-eat savouries" in text or "fried snacks" in text or "namkeen" in text:
-        return "Snacks, Fried Snacks & Namkeen"
-    if "popcorn" in text:
-        return "Snacks, Popcorn & Fryums"
-
-    if "ready to cook batter" in text or "batters" in text or "dosa batter" in text or "idly batter" in text:
-        return "Ready Foods, Ready Batters – Idli/Dosa"
-    if "soups" in text or "soup mixes" in text:
-        return "Ready Foods, Rehydratable & Dried Meals"
-
-    if "cocoa and chocolate powders" in text:
-        return "Sweets & Confectionery, Chocolates"
-
-    if "bières ipa" in text or "pale ales" in text or "ipa" in text:
-        return "Alcoholic Beverages, Beer & Ales"
-
-    if leaf.endswith("almonds"):
-        return "Nuts & Seeds, Raw Nuts"
-    if "seeds" in leaf:
-        return "Nuts & Seeds, Seeds & Seed Mixes"
-    if leaf in ("raisins", "dates", "apricots", "kiwis", "dried kiwis"):
-        return "Fruits, Dried Fruits"
-    if "noodles" in leaf:
-        return "Staples & Grains, Noodles & Vermicelli"
-    if "ghee" in leaf:
-        return "Oils & Fats, Ghee & Butter"
-    return np.nan
-
-
-mask_unmapped = df["category_subcategory"].isna()
-df.loc[mask_unmapped, "category_subcategory"] = df.loc[mask_unmapped, "categories_norm"].apply(fallback_map)
-
-
-# ---------- STEP 6: final categories split + clean up ----------
-
-# use mapped value
-df["categories"] = df["category_subcategory"]
-
-# drop helper column
-df = df.drop(columns=["categories_norm", "category_subcategory"], errors="ignore")
-
-# drop off:food_groups_tags if present
-df = df.drop(columns=["off:food_groups_tags"], errors="ignore")
-
-# drop rows where categories is still missing/empty
-df["categories"] = df["categories"].astype(str)
-df = df[df["categories"].notna() & (df["categories"].str.strip() != "nan") & (df["categories"].str.strip() != "")]
-
-# split "Category, Subcategory" into two columns
-def split_cat_subcat(s):
-    parts = [p.strip() for p in str(s).split(",", 1)]
-    if len(parts) == 2:
-        return pd.Series({"category": parts[0], "subcategory": parts[1]})
-    # if malformed, treat entire as category, subcategory empty
-    return pd.Series({"category": parts[0], "subcategory": ""})
-
-cat_sub_df = df["categories"].apply(split_cat_subcat)
-df["category"] = cat_sub_df["category"]
-df["subcategory"] = cat_sub_df["subcategory"]
-
-# you can keep or drop the combined categories column; here we drop it
-df = df.drop(columns=["categories"], errors="ignore")
-
-# reset index
-df = df.reset_index(drop=True)
-
-# ---------- REORDER COLUMNS: put category & subcategory after quantity ----------
-cols = list(df.columns)
-
-if "quantity" in cols and "category" in cols and "subcategory" in cols:
-    cols.remove("category")
-    cols.remove("subcategory")
-    q_idx = cols.index("quantity") + 1
-    cols[q_idx:q_idx] = ["category", "subcategory"]
-    df = df[cols]
-
-df['product_name_en'] = df['product_name_en'].str.title()
-df['brands'] = df['brands'].str.title()
-
-# ---------- SAVE ----------
-df.to_csv(OUTPUT_PATH, index=False)
-print(f"Saved categorized file to {OUTPUT_PATH}")
+# ---------- STEP 2: keyword rules, in priority order (first match wins) ----------
+# Tested on a single lower-cased leaf category when it has no exact MAPPING.
+LEAF_KEYWORD_RULES = [
+    (("biscuit", "cookie"), "Sweets & Confectionery, Biscuits & Cookies"),
+    (("chips", "wafers", "crisps"), "Snacks, Chips, Wafers & Crisps"),
+    (("cereal", "muesli", "corn flakes"), "Staples & Grains, Breakfast Cereals & Muesli"),
+    (("milkshake", "milk shake"), "Beverages, Milk-Based Beverages"),
+    (("juice", "nectar"), "Beverages, Fruit-Based Beverages"),
+    (("pickle", "chutney"), "Condiments, Chutneys & Pickles"),
+    (("masala", "spice mix"), "Spices & Herbs, Masalas & Blends"),
+    (("dal", "lentil"), "Pulses & Legumes, Lentils & Dals"),
+]
+
+# Fallback for products where no leaf mapped: tested on the whole
+# " | "-joined, lower-cased category list.
+FALLBACK_TEXT_RULES = [
+    (("instant noodles",), "Staples & Grains, Noodles & Vermicelli"),
+    (("instant noodle soups", "dehydrated asian-style soup with noodles"), "Ready Foods, Rehydratable & Dried Meals"),
+
+    (("almonds",), "Nuts & Seeds, Raw Nuts"),
+    (("cashew nuts",), "Nuts & Seeds, Raw Nuts"),
+    (("unsalted cashews", "roasted salted almonds and cashew"), "Nuts & Seeds, Roasted & Salted Nuts"),
+    (("sunflower seeds", "flax seeds", "basil seeds"), "Nuts & Seeds, Seeds & Seed Mixes"),
+    (("fox nuts", "makhana"), "Nuts & Seeds, Seeds & Seed Mixes"),
+
+    (("dried fruits", "dried plant-based foods"), "Fruits, Dried Fruits"),
+    (("raisins", "dried apricots", "dates"), "Fruits, Dried Fruits"),
+    (("berries", "blueberries"), "Fruits, Dried Fruits"),
+
+    (("sunflower oils", "ricebran oil", "rice bran oil"), "Oils & Fats, Vegetable Oils"),
+    (("mustard oils",), "Oils & Fats, Seed & Nut Oils"),
+    (("palm oils", "palm oil refined"), "Oils & Fats, Vegetable Oils"),
+    (("ghee", "clarified butter", "butter fat"), "Oils & Fats, Ghee & Butter"),
+
+    (("wheat vermicelli", "vermicelli"), "Staples & Grains, Noodles & Vermicelli"),
+    (("pastas",), "Staples & Grains, Pasta & Macaroni"),
+    (("granulated wheat", "semolina", "suji"), "Staples & Grains, Semolina & Rava"),
+    (("puffed rice blend", "wheat puffs"), "Staples & Grains, Rice & Rice Products"),
+
+    (("sweeteners", "sugars", "jaggery"), "Ingredients, Sugars & Sweeteners"),
+    (("syrups", "date syrups"), "Ingredients, Sugars & Sweeteners"),
+
+    (("coriander powder",), "Spices & Herbs, Ground Spices"),
+    (("spice mix",), "Spices & Herbs, Masalas & Blends"),
+
+    (("curd", "dahi"), "Dairy, Yogurt & Fermented Dairy"),
+    (("mozzarella", "cheese cubes", "cheese balls"), "Dairy, Cheese & Paneer"),
+    (("ice creams", "icecream", "ice cream bars", "ice cream cones", "ice cream sandwiches"), "Dairy, Dairy Desserts"),
+
+    (("ready-to-eat savouries", "fried snacks", "namkeen"), "Snacks, Fried Snacks & Namkeen"),
+    (("popcorn",), "Snacks, Popcorn & Fryums"),
+
+    (("ready to cook batter", "batters", "dosa batter", "idly batter"), "Ready Foods, Ready Batters – Idli/Dosa"),
+    (("soups", "soup mixes"), "Ready Foods, Rehydratable & Dried Meals"),
+
+    (("cocoa and chocolate powders",), "Sweets & Confectionery, Chocolates"),
+
+    (("bières ipa", "pale ales", "ipa"), "Alcoholic Beverages, Beer & Ales"),
+]
+
+# Last resort, tested on the lower-cased last category of the list:
+# (kind, patterns, result) with kind in "endswith" / "contains" / "equals".
+FALLBACK_LEAF_RULES = [
+    ("endswith", ("almonds",), "Nuts & Seeds, Raw Nuts"),
+    ("contains", ("seeds",), "Nuts & Seeds, Seeds & Seed Mixes"),
+    ("equals", ("raisins", "dates", "apricots", "kiwis", "dried kiwis"), "Fruits, Dried Fruits"),
+    ("contains", ("noodles",), "Staples & Grains, Noodles & Vermicelli"),
+    ("contains", ("ghee",), "Oils & Fats, Ghee & Butter"),
+]
+
+
+# ---------- RULE ENGINE ----------
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over every keyword of a rule list. One pass over
+    a string finds all keywords it contains; the rule with the lowest
+    priority (earliest in the list) among them wins, which is exactly what
+    the old if/elif cascade of `in` tests returned.
+    """
+
+    def __init__(self, rules):
+        self.results = [result for _, result in rules]
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [None]   # lowest rule priority ending at (or via fail links) each state
+
+        for priority, (patterns, _) in enumerate(rules):
+            for pattern in patterns:
+                state = 0
+                for ch in pattern:
+                    nxt = self.goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(self.goto)
+                        self.goto[state][ch] = nxt
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.best.append(None)
+                    state = nxt
+                if self.best[state] is None or priority < self.best[state]:
+                    self.best[state] = priority
+
+        # Breadth-first fail links; fold each fail target's best priority in
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                inherited = self.best[self.fail[nxt]]
+                if inherited is not None and (self.best[nxt] is None or inherited < self.best[nxt]):
+                    self.best[nxt] = inherited
+
+    def priority(self, text):
+        """Lowest matching rule priority in text, or None"""
+        best = None
+        state = 0
+        for ch in text:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            p = self.best[state]
+            if p is not None and (best is None or p < best):
+                best = p
+                if best == 0:
+                    break
+        return best
+
+    def match(self, text):
+        p = self.priority(text)
+        return np.nan if p is None else self.results[p]
+
+
+class CategoryRuleEngine:
+    """Compiled MAPPING + keyword rules with per-leaf and per-list memoisation"""
+
+    def __init__(self):
+        self.leaf_rules = KeywordAutomaton(LEAF_KEYWORD_RULES)
+        self.text_rules = KeywordAutomaton(FALLBACK_TEXT_RULES)
+        self.last_leaf_rules = KeywordAutomaton(
+            [(pats, res) for kind, pats, res in FALLBACK_LEAF_RULES if kind == "contains"]
+        )
+        # Priority of each "contains" rule within FALLBACK_LEAF_RULES
+        self.contains_priority = [
+            i for i, (kind, _, _) in enumerate(FALLBACK_LEAF_RULES) if kind == "contains"
+        ]
+        self.leaf_cache = {}
+
+    def map_leaf(self, leaf):
+        """Exact MAPPING, else first keyword rule; NaN if nothing applies"""
+        leaf = leaf.strip()
+        if not leaf:
+            return np.nan
+        cached = self.leaf_cache.get(leaf)
+        if cached is None:
+            if leaf in MAPPING:
+                cat, subcat = MAPPING[leaf]
+                cached = f"{cat}, {subcat}"
+            else:
+                cached = self.leaf_rules.match(leaf.lower())
+            self.leaf_cache[leaf] = cached
+        return cached
+
+    def fallback(self, cat_list):
+        if not cat_list:
+            return np.nan
+
+        text = " | ".join(cat_list).lower()
+        result = self.text_rules.match(text)
+        if isinstance(result, str):
+            return result
+
+        leaf = cat_list[-1].lower()
+        candidates = []
+        p = self.last_leaf_rules.priority(leaf)
+        if p is not None:
+            candidates.append(self.contains_priority[p])
+        for i, (kind, patterns, _) in enumerate(FALLBACK_LEAF_RULES):
+            if kind == "endswith" and any(leaf.endswith(pat) for pat in patterns):
+                candidates.append(i)
+            elif kind == "equals" and leaf in patterns:
+                candidates.append(i)
+        if not candidates:
+            return np.nan
+        return FALLBACK_LEAF_RULES[min(candidates)][2]
+
+    def categorize(self, categories):
+        """'Category, Subcategory' for one raw comma-separated category string"""
+        cat_list = [p.strip() for p in categories.split(",") if p.strip() != ""]
+        # First leaf (in list order) with a mapping wins
+        for leaf in cat_list:
+            mapped = self.map_leaf(leaf)
+            if isinstance(mapped, str):
+                return mapped
+        return self.fallback(cat_list)
+
+
+def categorize_column(categories, engine=None):
+    """Vectorised over unique category strings: each distinct list is mapped once"""
+    engine = engine or CategoryRuleEngine()
+    codes, uniques = pd.factorize(categories.fillna("").astype(str))
+    mapped = np.array([engine.categorize(u) for u in uniques] + [np.nan], dtype=object)
+    # factorize gives -1 for missing; index -1 lands on the trailing NaN
+    return pd.Series(mapped[codes], index=categories.index)
+
+
+# ---------- STRUCTURE ----------
+def structure(df, engine=None):
+    # STEP 3: map every product's category list to "Category, Subcategory"
+    df = df.copy()
+    df["categories"] = categorize_column(df["categories"], engine)
+
+    # drop off:food_groups_tags if present
+    df = df.drop(columns=["off:food_groups_tags"], errors="ignore")
+
+    # drop rows where categories is still missing/empty
+    df = df[df["categories"].notna() & (df["categories"].astype(str).str.strip() != "")]
+
+    # STEP 4: split "Category, Subcategory" into two columns
+    # (if malformed, treat entire as category, subcategory empty)
+    parts = df["categories"].astype(str).str.split(",", n=1, expand=True)
+    if parts.shape[1] == 1:
+        parts[1] = np.nan
+    df["category"] = parts[0].str.strip()
+    df["subcategory"] = parts[1].fillna("").str.strip()
+
+    # you can keep or drop the combined categories column; here we drop it
+    df = df.drop(columns=["categories"], errors="ignore")
+
+    # reset index
+    df = df.reset_index(drop=True)
+
+    # ---------- REORDER COLUMNS: put category & subcategory after quantity ----------
+    cols = list(df.columns)
+
+    if "quantity" in cols and "category" in cols and "subcategory" in cols:
+        cols.remove("category")
+        cols.remove("subcategory")
+        q_idx = cols.index("quantity") + 1
+        cols[q_idx:q_idx] = ["category", "subcategory"]
+        df = df[cols]
+
+    df['product_name_en'] = df['product_name_en'].str.title()
+    df['brands'] = df['brands'].str.title()
+    return df
+
+
+def run(input_path=INPUT_PATH, output_path=OUTPUT_PATH):
+    # ---------- LOAD ----------
+    df = pd.read_csv(input_path, low_memory=False)
+    df = structure(df)
+
+    # ---------- SAVE ----------
+    df.to_csv(output_path, index=False)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Map OpenFoodFacts categories to B4UBuy categories")
+    parser.add_argument("--input", default=INPUT_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    args = parser.parse_args(argv)
+
+    df = run(args.input, args.output)
+    print(f"Saved categorized file to {args.output} ({len(df)} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,138 @@
+import argparse
+import os
+
+import numpy as np
 import pandas as pd
 
-input_path = "/Users/aitijhya/Desktop/Encode/openfoodfacts_extracted.csv"   # output from previous step
-output_path = "/Users/aitijhya/Desktop/Encode/openfoodfacts_final.csv"
-
-df = pd.read_csv(input_path, low_memory=False)
-
-# 1. Drop rows where product_name_en is empty / NaN
-df = df.dropna(subset=["product_name_en"])
-df = df[df["product_name_en"].astype(str).str.strip() != ""]
-
-# 2. Create allergen flags from allergens_tags and traces_tags
-#    We will treat presence in either column as "has_* = 1", else 0
-allergen_cols = ["allergens_tags", "traces_tags"]
-for col in allergen_cols:
-    if col not in df.columns:
-        df[col] = ""
-
-def has_tag(row, tag):
-    """Check if given allergen tag appears in allergens or traces."""
-    val = (str(row["allergens_tags"]) + " " + str(row["traces_tags"])).lower()
-    return int(tag in val)
-
-df["has_gluten"] = df.apply(lambda r: has_tag(r, "en:gluten"), axis=1)
-df["has_milk"] = df.apply(lambda r: has_tag(r, "en:milk"), axis=1)
-df["has_soybeans"] = df.apply(lambda r: has_tag(r, "en:soybeans"), axis=1)
-df["has_nuts"] = df.apply(lambda r: has_tag(r, "en:nuts"), axis=1)
-df["has_mustards"] = df.apply(lambda r: has_tag(r, "en:mustard"), axis=1)
-# peanuts / groundnuts
-df["has_peanuts"] = df.apply(
-    lambda r: 1 if ("en:peanuts" in (str(r["allergens_tags"]) + " " + str(r["traces_tags"])).lower()
-                    or "en:groundnuts" in (str(r["allergens_tags"]) + " " + str(r["traces_tags"])).lower())
-    else 0,
-    axis=1,
-)
-df["has_sulphur-dioxide-and-sulphites"] = df.apply(
-    lambda r: has_tag(r, "en:sulphur-dioxide-and-sulphites"), axis=1
-)
-df["has_sesame-seeds"] = df.apply(lambda r: has_tag(r, "en:sesame-seeds"), axis=1)
-
-# Drop original allergens/traces tag columns
-df = df.drop(columns=["allergens_tags", "traces_tags"], errors="ignore")
-df = df.drop(columns=["salt_value", "salt_unit"], errors="ignore")
-
-# 3. Normalize salt, sodium, cholesterol to mg and drop unit columns
-#    - If unit is 'g', multiply value by 1000
-#    - If already in 'mg', keep as is
-#    After this, units are assumed to be mg and unit columns are removed.
-
-def to_mg(value, unit):
-    try:
-        v = float(value)
-    except (TypeError, ValueError):
-        return value  # leave as is if not numeric
-    if isinstance(unit, str):
-        u = unit.strip().lower()
-    else:
-        u = ""
-    if u == "g":
-        return v * 1000.0
-    # if u is 'mg' or empty/other, leave unchanged
-    return v
-
-for nutrient, unit_col in [
+# Resolve file paths relative to this module so relative CWDs won't break runs
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+input_path = os.path.join(BASE_DIR, "openfoodfacts_extracted.csv")   # output from previous step
+output_path = os.path.join(BASE_DIR, "openfoodfacts_final.csv")
+
+# Rows per chunk; peak memory is bounded by this, not by the input size
+CHUNK_ROWS = 200_000
+
+# Flag column -> allergen tags that set it (present in allergens or traces)
+ALLERGEN_FLAGS = {
+    "has_gluten": ("en:gluten",),
+    "has_milk": ("en:milk",),
+    "has_soybeans": ("en:soybeans",),
+    "has_nuts": ("en:nuts",),
+    "has_mustards": ("en:mustard",),
+    # peanuts / groundnuts
+    "has_peanuts": ("en:peanuts", "en:groundnuts"),
+    "has_sulphur-dioxide-and-sulphites": ("en:sulphur-dioxide-and-sulphites",),
+    "has_sesame-seeds": ("en:sesame-seeds",),
+}
+
+# Value column -> unit column, normalised to mg
+MG_COLUMNS = [
     ("sodium_value", "sodium_unit"),
     ("cholesterol_value", "cholesterol_unit"),
-]:
-    if nutrient in df.columns:
-        if unit_col in df.columns:
-            df[nutrient] = df.apply(
-                lambda r: to_mg(r[nutrient], r[unit_col]), axis=1
-            )
+]
+
+
+def allergen_matrix(df):
+    """
+    Boolean (rows x ALLERGEN_FLAGS) matrix from allergens_tags + traces_tags.
+
+    The tag lists are tokenised once; each distinct tag is tested against
+    the allergen patterns once, and the hits are scattered back to rows.
+    A pattern matches when it is a substring of a tag, exactly as the old
+    `tag in (allergens + " " + traces).lower()` check did.
+    """
+    combined = (
+        df["allergens_tags"].fillna("").astype(str)
+        + " "
+        + df["traces_tags"].fillna("").astype(str)
+    ).str.lower()
+
+    tokens = combined.str.split(r"[,\s]+", regex=True).explode()
+    rows = np.arange(len(df)).repeat(combined.str.count(r"[,\s]+").to_numpy(dtype=int) + 1)
+    codes, uniques = pd.factorize(tokens.to_numpy())
+
+    patterns = list(ALLERGEN_FLAGS.values())
+    tag_hits = np.array(
+        [[any(p in tag for p in pats) for pats in patterns] for tag in uniques],
+        dtype=bool,
+    ).reshape(len(uniques), len(patterns))
+
+    matrix = np.zeros((len(df), len(patterns)), dtype=bool)
+    token_hits = tag_hits[codes]
+    for j in range(len(patterns)):
+        matrix[rows[token_hits[:, j]], j] = True
+    return matrix
+
+
+def to_mg(values, units):
+    """Vectorised unit conversion: 'g' -> x1000, 'mg'/empty/other unchanged"""
+    numeric = pd.to_numeric(values, errors="coerce")
+    unit = units.where(units.notna(), "").astype(str).str.strip().str.lower()
+    # Non-numeric values are left as they are
+    out = values.where(numeric.isna(), numeric)
+    grams = numeric.notna() & (unit == "g")
+    return out.where(~grams, numeric * 1000.0)
+
+
+def transform(df):
+    # 1. Drop rows where product_name_en is empty / NaN
+    df = df.dropna(subset=["product_name_en"])
+    df = df[df["product_name_en"].astype(str).str.strip() != ""]
+
+    # 2. Create allergen flags from allergens_tags and traces_tags
+    #    We will treat presence in either column as "has_* = 1", else 0
+    df = df.copy()
+    for col in ["allergens_tags", "traces_tags"]:
+        if col not in df.columns:
+            df[col] = ""
+
+    flags = allergen_matrix(df).astype(int)
+    for j, flag in enumerate(ALLERGEN_FLAGS):
+        df[flag] = flags[:, j]
+
+    # Drop original allergens/traces tag columns
+    df = df.drop(columns=["allergens_tags", "traces_tags"], errors="ignore")
+    df = df.drop(columns=["salt_value", "salt_unit"], errors="ignore")
+
+    # 3. Normalize sodium, cholesterol to mg and drop unit columns
+    #    - If unit is 'g', multiply value by 1000
+    #    - If already in 'mg', keep as is
+    #    After this, units are assumed to be mg and unit columns are removed.
+    for nutrient, unit_col in MG_COLUMNS:
+        if nutrient in df.columns and unit_col in df.columns:
+            df[nutrient] = to_mg(df[nutrient], df[unit_col])
         # After conversion, treat values as mg; drop the unit column
         if unit_col in df.columns:
             df = df.drop(columns=[unit_col])
 
-# Save final structured CSV
-df.to_csv(output_path, index=False)
-print(f"Saved final structured file to {output_path}")
+    return df
+
+
+def run(input_path=input_path, output_path=output_path, chunk_rows=CHUNK_ROWS):
+    """Stream the input in chunks so memory stays flat for full dumps"""
+    rows_in = rows_out = 0
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+        for i, chunk in enumerate(pd.read_csv(input_path, low_memory=False, chunksize=chunk_rows)):
+            rows_in += len(chunk)
+            chunk = transform(chunk)
+            chunk.to_csv(out, index=False, header=(i == 0))
+            rows_out += len(chunk)
+    os.replace(tmp_path, output_path)
+    return rows_in, rows_out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Allergen flags + unit normalisation")
+    parser.add_argument("--input", default=input_path)
+    parser.add_argument("--output", default=output_path)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
 
+    rows_in, rows_out = run(args.input, args.output, args.chunk_rows)
+    # Save final structured CSV
+    print(f"Saved final structured file to {args.output} ({rows_out} of {rows_in} rows kept)")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""Recipe ingredient -> catalogue product matching.
+
+Food_Recipe.csv names ingredients the way a cook does ("Turmeric powder
+(Haldi)", "Coriander (Dhania) Leaves", "Curd (Dahi / Yogurt)"). Products
+are sold as "Tata Salt" or "Organic Tattva Haldi Powder". Matching them
+happens in two steps:
+
+  1. normalise: lower-case, split out bracketed alternate names, drop
+     preparation words ("chopped", "fresh"), unify spellings and plurals,
+     and translate regional names through ALIASES. This gives a canonical
+     key plus a few search phrases.
+  2. candidates: products whose normalised name contains every word of a
+     phrase, from a word index over the catalogue names. Only whole words
+     count, so "salt" never matches "Salted Peanuts". Candidates are scored
+     on search similarity and on how much of the product name the phrase
+     covers ("Besan" beats "Besan Ladoo"); snacks, drinks and other
+     prepared foods are marked down.
+
+The candidates for every ingredient in Food_Recipe.csv are computed ahead
+of time (precompute.py writes openfoodfacts_precomputed.ingredients.json).
+At request time a whole recipe is a dictionary lookup per ingredient plus
+one vectorised per-persona ranking. Ingredients not in the file are matched
+on first use and memoised.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from recipe_search import RECIPES_CSV
+from search_index import ProductSearchIndex, tokens
+
+# Bump when normalisation, ALIASES or the on-disk layout change
+INGREDIENT_MAP_VERSION = 1
+
+# Candidate products kept per ingredient, and the weakest match score accepted
+CANDIDATES_PER_INGREDIENT = 12
+MATCH_MIN_SCORE = 0.5
+
+# Below the best candidate's match score by more than this, a product is not
+# offered however healthy it is for the persona
+MATCH_BAND = 0.15
+
+# Products returned per ingredient by default
+MATCH_TOP_K = 3
+
+# Categories that hold finished foods rather than ingredients
+PREPARED_CATEGORIES = {"Snacks", "Beverages", "Sweets & Confectionery", "Ready Foods",
+                       "Bakery", "Alcoholic Beverages"}
+PREPARED_PENALTY = 0.75
+
+# Regional / alternate names -> the words products are sold under
+ALIASES = {
+    "haldi": "turmeric",
+    "jeera": "cumin",
+    "dhania": "coriander",
+    "dahi": "curd",
+    "yoghurt": "yogurt",
+    "besan": "gram flour",
+    "maida": "all purpose flour",
+    "atta": "wheat flour",
+    "sooji": "semolina",
+    "suji": "semolina",
+    "rava": "semolina",
+    "rai": "mustard",
+    "kadugu": "mustard",
+    "hing": "asafoetida",
+    "gajjar": "carrot",
+    "aloo": "potato",
+    "matar": "peas",
+    "pudina": "mint",
+    "laung": "clove",
+    "elaichi": "cardamom",
+    "dalchini": "cinnamon",
+    "tej patta": "bay leaf",
+    "saunf": "fennel",
+    "methi": "fenugreek",
+    "ajwain": "carom",
+    "kasuri methi": "dried fenugreek leaf",
+    "gud": "jaggery",
+    "chana": "chickpea",
+    "chole": "chickpea",
+    "rajma": "kidney bean",
+    "gingelly": "sesame",
+    "til": "sesame",
+    "capsicum": "bell pepper",
+}
+
+# Spelling variants and irregular plurals, applied word by word (regular
+# plurals are handled by _singular)
+SPELLINGS = {
+    "chillies": "chilli",
+    "chilies": "chilli",
+    "chili": "chilli",
+    "chilly": "chilli",
+    "leaves": "leaf",
+    "berries": "berry",
+    "cherries": "cherry",
+    "dhaniya": "dhania",
+}
+
+# Preparation / quantity words that never appear in a product name
+DESCRIPTORS = {
+    "fresh", "freshly", "chopped", "finely", "roughly", "sliced", "minced",
+    "grated", "boiled", "cooked", "soaked", "homemade", "optional", "to",
+    "taste", "as", "required", "needed", "few", "a", "of", "and", "or",
+}
+
+# Ingredients nobody buys
+NOT_PRODUCTS = {"water", "hot water", "warm water", "cold water", "ice", "ice cubes", "toothpicks"}
+
+_BRACKETS = re.compile(r"\(([^)]*)\)")
+
+
+def ingredient_map_path_for(csv_path: str) -> str:
+    """Where the ingredient map for a precomputed CSV lives"""
+    return os.path.splitext(csv_path)[0] + ".ingredients.json"
+
+
+# ============================================================================
+# NORMALISATION
+# ============================================================================
+
+
+def _singular(word: str) -> str:
+    word = SPELLINGS.get(word, word)
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+_ALIAS_PATTERN = re.compile(r"\b(" + "|".join(sorted(map(re.escape, ALIASES), key=len, reverse=True)) + r")\b")
+
+
+def _words(text: str) -> List[str]:
+    phrase = " ".join(_singular(w) for w in tokens(text) if w not in DESCRIPTORS)
+    phrase = _ALIAS_PATTERN.sub(lambda m: ALIASES[m.group(1)], phrase)
+    return phrase.split()
+
+
+def normalise_ingredient(name: str) -> Tuple[str, List[str]]:
+    """
+    (canonical key, search phrases) for a recipe ingredient name.
+    The key is "" for things that are not products (water, ice...).
+    """
+    text = str(name or "").lower().strip()
+    alternates = [part for inner in _BRACKETS.findall(text) for part in re.split(r"[/,]", inner)]
+    main = " ".join(_words(_BRACKETS.sub(" ", text)))
+    if not main or main in NOT_PRODUCTS:
+        return "", []
+
+    phrases = [main]
+    # "cumin seed" also sells as "cumin": try without the trailing
+    # form word, then the bracketed names
+    words = main.split()
+    if len(words) > 1 and words[-1] in ("seed", "powder", "pod", "stick"):
+        phrases.append(" ".join(words[:-1]))
+    for alt in alternates:
+        alt = " ".join(_words(alt))
+        if alt and alt not in phrases:
+            phrases.append(alt)
+    # Leading modifiers ("red chilli powder" -> "chilli powder"), never down to one word
+    while len(words) > 2:
+        words = words[1:]
+        phrase = " ".join(words)
+        if phrase not in phrases:
+            phrases.append(phrase)
+    return main, phrases
+
+
+# ============================================================================
+# MATCHING
+# ============================================================================
+
+
+class IngredientMatcher:
+    def __init__(self, index: ProductSearchIndex, categories: Sequence[str],
+                 candidates: Optional[Dict[str, List[Tuple[int, float]]]] = None,
+                 digest: str = ""):
+        self.index = index
+        self.categories = categories
+        # canonical key -> [(row, match score)], best first
+        self.candidates: Dict[str, List[Tuple[int, float]]] = candidates or {}
+        self.digest = digest
+        self._name_words: Optional[List[set]] = None
+        self._postings: Dict[str, List[int]] = {}
+        self._match_key = lru_cache(maxsize=4096)(self._match_key_uncached)
+
+    # ------------------------------------------------------------------ build
+
+    def _ensure_word_index(self) -> None:
+        """Normalised product name words and their postings, built on first miss"""
+        if self._name_words is not None:
+            return
+        self._name_words = [set(_words(name)) for name in self.index.names]
+        for idx, words in enumerate(self._name_words):
+            for word in words:
+                self._postings.setdefault(word, []).append(idx)
+
+    def match_score(self, phrase: str, idx: int) -> float:
+        """Similarity and name coverage, marked down for prepared foods"""
+        coverage = len(phrase.split()) / max(len(self._name_words[idx]), 1)
+        score = 0.5 * self.index.similarity(phrase, idx) + 0.5 * min(coverage, 1.0)
+        if self.categories[idx] in PREPARED_CATEGORIES:
+            score *= PREPARED_PENALTY
+        return score
+
+    def match_phrases(self, phrases: Sequence[str]) -> List[Tuple[int, float]]:
+        """Products whose name holds every word of the first phrase that has any, best first"""
+        self._ensure_word_index()
+        for phrase in phrases:
+            words = phrase.split()
+            rows = set(self._postings.get(words[0], ()))
+            for word in words[1:]:
+                rows.intersection_update(self._postings.get(word, ()))
+            scored = [(idx, self.match_score(phrase, idx)) for idx in rows]
+            scored = [(idx, round(score, 4)) for idx, score in scored if score >= MATCH_MIN_SCORE]
+            # Earlier phrases are more specific; stop at the first that matched
+            if scored:
+                scored.sort(key=lambda x: (-x[1], x[0]))
+                return scored[:CANDIDATES_PER_INGREDIENT]
+        return []
+
+    @classmethod
+    def build(cls, index: ProductSearchIndex, categories: Sequence[str],
+              ingredient_names: Sequence[str], digest: str = "") -> "IngredientMatcher":
+        matcher = cls(index, categories, digest=digest)
+        for name in ingredient_names:
+            key, phrases = normalise_ingredient(name)
+            if key and key not in matcher.candidates:
+                matcher.candidates[key] = matcher.match_phrases(phrases)
+        return matcher
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": INGREDIENT_MAP_VERSION,
+                "digest": self.digest,
+                "candidates": {k: [[i, s] for i, s in v] for k, v in self.candidates.items()},
+            }, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, index: ProductSearchIndex, categories: Sequence[str],
+             digest: str) -> Optional["IngredientMatcher"]:
+        """Load a saved map; None if missing or built from different data"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INGREDIENT_MAP_VERSION or data.get("digest") != digest:
+                return None
+            candidates = {k: [(int(i), float(s)) for i, s in v] for k, v in data["candidates"].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return cls(index, categories, candidates, digest)
+
+    @classmethod
+    def load_or_build(cls, path: Optional[str], index: ProductSearchIndex,
+                      categories: Sequence[str], recipes_csv: str = RECIPES_CSV) -> "IngredientMatcher":
+        names = recipe_ingredient_names(recipes_csv)
+        digest = map_fingerprint(index, categories, names)
+        if path:
+            matcher = cls.load(path, index, categories, digest)
+            if matcher is not None:
+                print(f"[IngredientMatcher] Loaded {path}")
+                return matcher
+
+        matcher = cls.build(index, categories, names, digest)
+        if path:
+            try:
+                matcher.save(path)
+                print(f"[IngredientMatcher] Saved {path} ({len(matcher.candidates)} ingredients)")
+            except OSError as e:
+                # Read-only deployments just keep the in-memory map
+                print(f"[IngredientMatcher] Could not save {path}: {e}")
+        return matcher
+
+    # ----------------------------------------------------------------- lookup
+
+    def _match_key_uncached(self, name: str) -> Tuple[str, Tuple[Tuple[int, float], ...]]:
+        key, phrases = normalise_ingredient(name)
+        if not key:
+            return "", ()
+        found = self.candidates.get(key)
+        if found is None:
+            found = self.match_phrases(phrases)
+        return key, tuple(found)
+
+    def lookup(self, name: str) -> Tuple[str, List[Tuple[int, float]]]:
+        """(canonical key, [(row, match score)]) for one ingredient name"""
+        key, found = self._match_key(name)
+        return key, list(found)
+
+    def match_batch(self, names: Sequence[str], scores: np.ndarray,
+                    k: int = MATCH_TOP_K) -> List[Tuple[str, List[Tuple[int, float]]]]:
+        """
+        For each ingredient: (key, up to k (row, match score)). Candidates
+        within MATCH_BAND of the closest match are ranked by the persona's
+        health score (`scores`, the store's column), then match score, then
+        catalogue order.
+        """
+        looked_up = [self.lookup(name) for name in names]
+        rows = np.array([idx for _, found in looked_up for idx, _ in found], dtype=np.int64)
+        row_scores = scores[rows]
+
+        results: List[Tuple[str, List[Tuple[int, float]]]] = []
+        start = 0
+        for key, found in looked_up:
+            health = row_scores[start:start + len(found)]
+            start += len(found)
+            if not found:
+                results.append((key, []))
+                continue
+            idx = np.array([i for i, _ in found])
+            match = np.array([s for _, s in found])
+            in_band = match >= match[0] - MATCH_BAND
+            order = np.lexsort((idx, -match, -health, ~in_band))[:k]
+            results.append((key, [found[o] for o in order.tolist()]))
+        return results
+
+
+# ============================================================================
+# RECIPE INGREDIENTS / FINGERPRINT
+# ============================================================================
+
+
+def recipe_ingredient_names(path: str = RECIPES_CSV) -> List[str]:
+    """Distinct ingredient names across Food_Recipe.csv, in file order"""
+    names: Dict[str, None] = {}
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                for name in (row.get("ingredients_name") or "").split(","):
+                    name = name.strip()
+                    if name:
+                        names.setdefault(name, None)
+    except OSError:
+        return []
+    return list(names)
+
+
+def map_fingerprint(index: ProductSearchIndex, categories: Sequence[str],
+                    ingredient_names: Sequence[str]) -> str:
+    h = hashlib.sha256(f"v{INGREDIENT_MAP_VERSION}".encode("utf-8"))
+    h.update(index.digest.encode("utf-8"))
+    h.update(json.dumps([ALIASES, SPELLINGS, sorted(DESCRIPTORS), sorted(NOT_PRODUCTS),
+                         sorted(PREPARED_CATEGORIES), PREPARED_PENALTY,
+                         CANDIDATES_PER_INGREDIENT, MATCH_MIN_SCORE], sort_keys=True).encode("utf-8"))
+    for category in categories:
+        h.update(category.encode("utf-8"))
+        h.update(b"\x00")
+    for name in ingredient_names:
+        h.update(name.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
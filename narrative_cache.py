@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed cache for LLM narratives.
+
+The narrative prompt treats `report_data` as ground truth, so the same data,
+model and prompt version should give the same narrative. Entries are keyed
+on a canonical hash of exactly those three things.
+
+Two tiers:
+  - in-process LRU (always on)
+  - optional SQLite file shared by every worker on the box
+Both have a TTL and a size bound. Hit/miss counters are exposed via stats().
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+NARRATIVE_CACHE_SIZE = int(os.environ.get("NARRATIVE_CACHE_SIZE", "1024"))
+NARRATIVE_CACHE_TTL_S = float(os.environ.get("NARRATIVE_CACHE_TTL_S", "86400"))
+NARRATIVE_CACHE_DB = os.environ.get("NARRATIVE_CACHE_DB")  # unset = memory only
+NARRATIVE_CACHE_DB_MAX_ENTRIES = int(os.environ.get("NARRATIVE_CACHE_DB_MAX_ENTRIES", "100000"))
+
+
+def cache_key(report_data: Dict[str, Any], model: str, prompt_version: int) -> str:
+    """Canonical hash: key order and whitespace never change the key"""
+    payload = json.dumps(
+        {"data": report_data, "model": model, "prompt_version": prompt_version},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUTier:
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.bytes = 0  # sys.getsizeof of every held value
+        self.lock = threading.Lock()
+
+    def _drop(self, key: str) -> None:
+        value, _ = self.entries.pop(key)
+        self.bytes -= sys.getsizeof(value)
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if time.time() >= expires:
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (value, time.time() + self.ttl_s)
+            self.bytes += sys.getsizeof(value)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SQLiteTier:
+    def __init__(self, path: str, max_entries: int, ttl_s: float, table: str = "narratives"):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now >= row[1]:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            self.conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl_s, now),
+            )
+            # Expired rows first, then least recently used beyond the size bound
+            self.conn.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (now,))
+            self.conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class NarrativeCache:
+    TABLE = "narratives"  # SQLite table, so other caches can share the file
+    LABEL = "Narrative cache"
+
+    def __init__(self, max_entries: int = NARRATIVE_CACHE_SIZE,
+                 ttl_s: float = NARRATIVE_CACHE_TTL_S,
+                 db_path: Optional[str] = NARRATIVE_CACHE_DB,
+                 db_max_entries: int = NARRATIVE_CACHE_DB_MAX_ENTRIES):
+        self.memory = LRUTier(max_entries, ttl_s)
+        self.disk: Optional[SQLiteTier] = None
+        if db_path:
+            try:
+                self.disk = SQLiteTier(db_path, db_max_entries, ttl_s, self.TABLE)
+            except sqlite3.Error as e:
+                print(f"{self.LABEL}: SQLite tier disabled ({e})")
+
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        self.counter_lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self.counter_lock:
+            self.counters[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                print(f"{self.LABEL} read failed: {e}")
+                value = None
+            if value is not None:
+                self._count("disk_hits")
+                self.memory.put(key, value)
+                return value
+
+        self._count("misses")
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        self._count("stores")
+        self.memory.put(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, value)
+            except sqlite3.Error as e:
+                print(f"{self.LABEL} write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.counter_lock:
+            stats: Dict[str, Any] = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        stats["memory_bytes"] = self.memory.bytes
+        stats["disk_entries"] = len(self.disk) if self.disk is not None else None
+        return stats
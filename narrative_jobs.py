@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Background LLM narrative jobs.
+
+`FastEngine.analyze_cart(..., defer_narrative=True)` returns the structured
+report straight away and hands the narrative to this worker pool. Clients
+poll `/api/narrative/<job_id>` or stream it over SSE. A job that is not done
+by its deadline resolves to the rule-based fallback narrative instead.
+A job's first final answer ("done" or "fallback") is kept, so every later
+poll sees the same narrative even if the LLM answers after the deadline.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+NARRATIVE_WORKERS = int(os.environ.get("NARRATIVE_WORKERS", "4"))
+NARRATIVE_DEADLINE_S = float(os.environ.get("NARRATIVE_DEADLINE_S", "8"))
+NARRATIVE_JOB_TTL_S = float(os.environ.get("NARRATIVE_JOB_TTL_S", "300"))
+
+# Seconds between SSE keep-alive comments while a job is pending
+SSE_KEEPALIVE_S = 1.0
+
+
+@dataclass
+class NarrativeJob:
+    job_id: str
+    report_data: Dict[str, Any]
+    future: Future
+    created: float
+    deadline: float
+    outcome: Optional[Dict[str, Any]] = None  # first final status, never changes
+
+
+class NarrativeJobs:
+    def __init__(self, llm, workers: int = NARRATIVE_WORKERS,
+                 deadline_s: float = NARRATIVE_DEADLINE_S,
+                 ttl_s: float = NARRATIVE_JOB_TTL_S):
+        self.llm = llm
+        self.deadline_s = deadline_s
+        self.ttl_s = ttl_s
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="narrative")
+        self.jobs: Dict[str, NarrativeJob] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, report_data: Dict[str, Any]) -> str:
+        """Queue a narrative and return its job id"""
+        self._expire()
+        now = time.monotonic()
+        job = NarrativeJob(
+            job_id=uuid.uuid4().hex,
+            report_data=report_data,
+            future=self.pool.submit(self.llm.generate_narrative, report_data),
+            created=now,
+            deadline=now + self.deadline_s,
+        )
+        with self.lock:
+            self.jobs[job.job_id] = job
+        return job.job_id
+
+    def get(self, job_id: str, wait: float = 0.0) -> Optional[Dict[str, Any]]:
+        """
+        Job status, waiting up to `wait` seconds (never past the deadline).
+        Returns None for unknown/expired ids.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        timeout = min(max(wait, 0.0), max(job.deadline - time.monotonic(), 0.0))
+        if timeout > 0:
+            try:
+                job.future.result(timeout=timeout)
+            except Exception:
+                pass
+        return self._status(job)
+
+    def _status(self, job: NarrativeJob) -> Dict[str, Any]:
+        if job.outcome is not None:
+            return job.outcome
+        status = self._resolve(job)
+        if status["status"] == "pending":
+            return status
+        with self.lock:
+            if job.outcome is None:
+                job.outcome = status
+            return job.outcome
+
+    def _resolve(self, job: NarrativeJob) -> Dict[str, Any]:
+        if job.future.done():
+            try:
+                return {"status": "done", "narrative": job.future.result()}
+            except Exception as e:
+                print(f"❌ Narrative job {job.job_id} failed: {e}")
+                return {
+                    "status": "fallback",
+                    "narrative": self.llm._generate_fallback_narrative(job.report_data),
+                }
+
+        if time.monotonic() >= job.deadline:
+            # Too slow - answer with the rule-based narrative, let the call finish
+            return {
+                "status": "fallback",
+                "narrative": self.llm._generate_fallback_narrative(job.report_data),
+            }
+
+        return {"status": "pending", "narrative": None}
+
+    def stream(self, job_id: str) -> Iterator[str]:
+        """Server-sent events: keep-alives while pending, then one narrative event"""
+        while True:
+            status = self.get(job_id, wait=SSE_KEEPALIVE_S)
+            if status is None:
+                yield "event: error\ndata: {\"error\": \"Unknown narrative job\"}\n\n"
+                return
+            if status["status"] != "pending":
+                yield f"event: narrative\ndata: {json.dumps(status)}\n\n"
+                return
+            yield ": pending\n\n"
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl_s
+        with self.lock:
+            stale = [jid for jid, job in self.jobs.items() if job.created < cutoff]
+            for jid in stale:
+                del self.jobs[jid]
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""Nearest healthier products by nutrient profile.
+
+Each product is a point: its NUTRICOLS values, each centred on the
+catalogue median and divided by the interquartile range (missing values
+take the median), plus its allergen flags as a bitmask.
+
+The points are grouped by (category, subcategory). Inside each group they
+are split kd-tree style (halve at the median of the widest dimension) into
+leaves of at most LEAF_SIZE. Leaves are stored contiguously, so a
+subcategory and a whole category are both just a range of leaves.
+
+Which products may be suggested depends on the persona (green rows only).
+Each persona therefore gets its own copy of its eligible rows, leaf by
+leaf, and a bounding box per leaf covering only those (PersonaBoxes).
+The copy is split into allergen-free rows and the rest, each with its
+own boxes, so an allergen-free query never reads rows it could not take.
+Boxes of the second part also keep the AND and OR of their rows'
+allergens, which tighten the bound for a query with allergens.
+A query ranks the boxes in range by their lower-bound distance and scans
+the nearest PROBE_LEAVES, then up to twice as many each step, as long as
+a box can still beat the n-th best candidate found. Each step reads its
+leaves as a few contiguous slices and measures them in one NumPy pass.
+The copies cost dims x 4 bytes per eligible row and persona (about
+18 MB per persona per million products).
+
+Candidates must not add an allergen the original is free of. Allergens
+the original has and the candidate lacks add ALLERGEN_DISTANCE each to
+the distance.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Points per leaf. Smaller leaves prune tighter, but a query then spends
+# more time bounding and gathering leaves than measuring distances.
+LEAF_SIZE = 256
+
+# Leaves scanned before the first candidate is known (each later step
+# scans up to twice as many as the last)
+PROBE_LEAVES = 16
+
+# Rows sampled for the normalising percentiles and for picking split dimensions
+NORMALISE_SAMPLE = 200_000
+SPLIT_SAMPLE = 256
+
+# Normalised values are clipped so one extreme nutrient can't dominate
+CLIP = 8.0
+
+# Distance added per allergen the candidate drops (in normalised units)
+ALLERGEN_DISTANCE = 0.5
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.float32)
+
+
+def _allergen_costs() -> np.ndarray:
+    """[query mask, candidate mask] -> distance added; inf where the candidate adds an allergen"""
+    masks = np.arange(256)
+    costs = ALLERGEN_DISTANCE * _POPCOUNT[masks[:, None] ^ masks[None, :]]
+    costs[(masks[None, :] & ~masks[:, None]) != 0] = np.inf
+    return costs
+
+
+_ALLERGEN_COSTS = _allergen_costs()
+
+
+def normalise(values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """(products x nutrients) float32: robust z-scores, missing -> 0 (the median)"""
+    points = np.zeros(values.shape, dtype=np.float32)
+    for j in range(values.shape[1]):
+        known_rows = present[:, j] > 0
+        known = values[known_rows, j]
+        if not len(known):
+            continue
+        sample = known[:: max(1, len(known) // NORMALISE_SAMPLE)]
+        q1, median, q3 = np.percentile(sample, [25, 50, 75])
+        spread = (q3 - q1) or sample.std() or 1.0
+        column = points[:, j]
+        column[known_rows] = np.clip((known - median) / spread, -CLIP, CLIP)
+    return points
+
+
+def allergen_mask(flags: Sequence[Optional[np.ndarray]], size: int) -> np.ndarray:
+    """uint8 per product, bit i set when flags[i] is 1 (at most 8 allergens)"""
+    mask = np.zeros(size, dtype=np.uint8)
+    for i, column in enumerate(flags[:8]):
+        if column is not None:
+            mask |= (np.asarray(column) == 1).astype(np.uint8) << i
+    return mask
+
+
+def _runs(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """[start, end) ranges in order, with empty ones dropped and touching ones merged"""
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    apart = starts[1:] != ends[:-1]
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = apart
+    last = np.ones(len(starts), dtype=bool)
+    last[:-1] = apart
+    return starts[first], ends[last]
+
+
+def _read_runs(boxes: "PersonaBoxes", starts: np.ndarray,
+               ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Coordinates (dims x n) and allergens of the entries in [start, end) runs, in order"""
+    if len(starts) == 1:
+        run = slice(int(starts[0]), int(ends[0]))
+        return boxes.columns[:, run], boxes.allergens[run]
+    runs = [slice(a, b) for a, b in zip(starts.tolist(), ends.tolist())]
+    return (np.concatenate([boxes.columns[:, r] for r in runs], axis=1),
+            np.concatenate([boxes.allergens[r] for r in runs]))
+
+
+# ============================================================================
+# INDEX
+# ============================================================================
+
+
+class PersonaBoxes:
+    """
+    One persona's eligible rows per leaf, and their bounding boxes. The
+    rows' coordinates and allergens are copied out in two parts, each leaf
+    by leaf: first the allergen-free rows, then the rest. A query reads
+    runs of (part, leaf) ranges as slices instead of gathering single
+    points. A query free of allergens (most are) can only swap to
+    allergen-free rows, so it bounds and reads just the first part.
+    """
+
+    def __init__(self, slots: np.ndarray, offsets: np.ndarray, columns: np.ndarray,
+                 allergens: np.ndarray, lo: np.ndarray, hi: np.ndarray, shared: np.ndarray,
+                 union: np.ndarray):
+        self.slots = slots          # eligible slots: allergen-free ones leaf by leaf, then the rest
+        self.offsets = offsets      # (2 x leaves + 1); part k of leaf i = entries offsets[k, i]:offsets[k, i + 1]
+        self.columns = columns      # (dims x entries) float32: NeighbourIndex.points of those slots, transposed
+        self.allergens = allergens  # uint8 per entry
+        self.lo = lo                # (2 x leaves x dims) box of each part; +inf where a part is empty
+        self.hi = hi
+        self.shared = shared        # uint8 per leaf: allergens every row of its second part has
+        self.union = union          # uint8 per leaf: allergens any row of its second part has
+
+    def entries(self, slots: np.ndarray) -> np.ndarray:
+        """Entries of those of `slots` that are eligible"""
+        found = []
+        for start, end in zip(self.offsets[:, 0].tolist(), self.offsets[:, -1].tolist()):
+            part = self.slots[start:end]
+            if len(part):
+                at = np.minimum(np.searchsorted(part, slots), len(part) - 1)
+                found.append(start + at[part[at] == slots])
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+
+class NeighbourIndex:
+    def __init__(self, points: np.ndarray, allergens: np.ndarray, rows: np.ndarray,
+                 leaf_offsets: np.ndarray, groups: Dict[Tuple[int, int], Tuple[int, int]],
+                 categories: Dict[int, Tuple[int, int]], group_codes: np.ndarray):
+        self.points = points              # (slots x dims) float32, leaf order
+        self.allergens = allergens        # uint8 per slot
+        self.rows = rows                  # slot -> catalogue row
+        self.slots = np.empty(len(rows), dtype=np.int32)
+        self.slots[rows] = np.arange(len(rows), dtype=np.int32)
+        self.leaf_offsets = leaf_offsets  # leaf i = slots leaf_offsets[i]:leaf_offsets[i + 1]
+        self.groups = groups              # (category, subcategory) code -> leaf range
+        self.categories = categories      # category code -> leaf range
+        self.group_codes = group_codes    # catalogue row -> (category, subcategory) codes
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def leaves(self) -> int:
+        return len(self.leaf_offsets) - 1
+
+    @classmethod
+    def build(cls, values: np.ndarray, present: np.ndarray, allergens: np.ndarray,
+              category_codes: np.ndarray, subcategory_codes: np.ndarray,
+              leaf_size: int = LEAF_SIZE) -> "NeighbourIndex":
+        """
+        values / present: (products x nutrients) as ProductStore.nutrients();
+        codes: interned category / subcategory per row (any ints, e.g. -1 = missing)
+        """
+        points = normalise(values, present)
+        cat = np.asarray(category_codes, dtype=np.int64)
+        sub = np.asarray(subcategory_codes, dtype=np.int64)
+        order = np.lexsort((sub, cat)).astype(np.int32)
+
+        starts = np.flatnonzero(np.r_[True, (np.diff(cat[order]) != 0) | (np.diff(sub[order]) != 0)])
+        ends = np.r_[starts[1:], len(order)]
+
+        rows: List[np.ndarray] = []
+        leaf_sizes: List[int] = []
+        groups: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        categories: Dict[int, Tuple[int, int]] = {}
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            first_leaf = len(leaf_sizes)
+            # Depth-first split; the stack pops the lower half first, so leaves come out in order
+            stack = [order[start:end]]
+            while stack:
+                seg = stack.pop()
+                if len(seg) <= leaf_size:
+                    rows.append(seg)
+                    leaf_sizes.append(len(seg))
+                    continue
+                sample = points[seg[:: max(1, len(seg) // SPLIT_SAMPLE)]]
+                dim = int(np.argmax(sample.max(axis=0) - sample.min(axis=0)))
+                mid = len(seg) // 2
+                seg = seg[np.argpartition(points[seg, dim], mid)]
+                stack.append(seg[mid:])
+                stack.append(seg[:mid])
+
+            key = (int(cat[order[start]]), int(sub[order[start]]))
+            groups[key] = (first_leaf, len(leaf_sizes))
+            lo, _ = categories.get(key[0], (first_leaf, 0))
+            categories[key[0]] = (lo, len(leaf_sizes))
+
+        rows_arr = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+        leaf_offsets = np.zeros(len(leaf_sizes) + 1, dtype=np.int64)
+        np.cumsum(leaf_sizes, out=leaf_offsets[1:])
+        return cls(np.ascontiguousarray(points[rows_arr]), allergens[rows_arr], rows_arr,
+                   leaf_offsets, groups, categories, np.stack([cat, sub], axis=1))
+
+    def _leaf_boxes(self, chosen: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-leaf bounding boxes of the (sorted) slots `chosen`; +inf / -inf for empty leaves"""
+        dims = self.points.shape[1]
+        lo = np.full((self.leaves, dims), np.inf, dtype=np.float32)
+        hi = np.full((self.leaves, dims), -np.inf, dtype=np.float32)
+        if len(chosen):
+            leaf = np.searchsorted(self.leaf_offsets, chosen, side="right") - 1
+            firsts = np.flatnonzero(np.r_[True, leaf[1:] != leaf[:-1]])
+            coords = self.points[chosen]
+            lo[leaf[firsts]] = np.minimum.reduceat(coords, firsts, axis=0)
+            hi[leaf[firsts]] = np.maximum.reduceat(coords, firsts, axis=0)
+        return lo, hi
+
+    def boxes(self, eligible: np.ndarray) -> PersonaBoxes:
+        """Leaf boxes over the rows where `eligible` (bool per catalogue row) is set"""
+        chosen = np.flatnonzero(np.asarray(eligible, dtype=bool)[self.rows]).astype(np.int32)
+        free = self.allergens[chosen] == 0
+        free_slots, other_slots = chosen[free], chosen[~free]
+        slots = np.concatenate([free_slots, other_slots])
+        offsets = np.stack([np.searchsorted(free_slots, self.leaf_offsets),
+                            len(free_slots) + np.searchsorted(other_slots, self.leaf_offsets)]).astype(np.int64)
+        free_lo, free_hi = self._leaf_boxes(free_slots)
+        other_lo, other_hi = self._leaf_boxes(other_slots)
+
+        shared = np.zeros(self.leaves, dtype=np.uint8)
+        union = np.zeros(self.leaves, dtype=np.uint8)
+        if len(other_slots):
+            leaf = np.searchsorted(self.leaf_offsets, other_slots, side="right") - 1
+            firsts = np.flatnonzero(np.r_[True, leaf[1:] != leaf[:-1]])
+            shared[leaf[firsts]] = np.bitwise_and.reduceat(self.allergens[other_slots], firsts)
+            union[leaf[firsts]] = np.bitwise_or.reduceat(self.allergens[other_slots], firsts)
+        return PersonaBoxes(slots, offsets, np.ascontiguousarray(self.points[slots].T),
+                            self.allergens[slots], np.stack([free_lo, other_lo]),
+                            np.stack([free_hi, other_hi]), shared, union)
+
+    def nearest(self, row: int, boxes: PersonaBoxes, n: int = 1, exclude=()) -> List[int]:
+        """
+        Up to n eligible catalogue rows closest to `row`, nearest first.
+        The row's own subcategory is searched first; the rest of its category
+        only when that yields fewer than n.
+        """
+        cat, sub = self.group_codes[row].tolist()
+        found: List[int] = []
+        for scope in (self.groups.get((cat, sub)), self.categories.get(cat)):
+            if scope is None:
+                continue
+            skip = set(found) | set(exclude) | {int(row)}
+            found += self._search(row, boxes, scope, n - len(found), skip)
+            if len(found) >= n:
+                break
+        return found
+
+    def _search(self, row: int, boxes: PersonaBoxes, scope: Tuple[int, int], n: int,
+                skip) -> List[int]:
+        first, last = scope
+        if n <= 0 or first >= last:
+            return []
+        slot = self.slots[row]
+        query = self.points[slot]
+        query_allergens = self.allergens[slot]
+        # Distance added per candidate allergen mask; inf where the candidate adds one
+        costs = _ALLERGEN_COSTS[query_allergens]
+        skip_at = boxes.entries(self.slots[np.fromiter(skip, dtype=np.int64, count=len(skip))])
+
+        # Search units are (part, leaf); allergen-free queries only look at the first part
+        leaves = last - first
+        parts = 2 if query_allergens else 1
+        lo = boxes.lo[:parts, first:last].reshape(parts * leaves, -1)
+        hi = boxes.hi[:parts, first:last].reshape(parts * leaves, -1)
+        # Squared distance from the query to each box (inf for empty parts)
+        gap = np.maximum(np.maximum(lo - query, query - hi), 0.0)
+        bound = np.einsum("ij,ij->i", gap, gap)
+        if parts == 2:
+            # Allergen-free rows drop every allergen of the query. A row of a
+            # second part drops at least the query's allergens that no row of
+            # it has, and the part has nothing to offer if every row adds one
+            bound[:leaves] += costs[0]
+            bound[leaves:] += costs[boxes.union[first:last] & query_allergens]
+            bound[leaves:][(boxes.shared[first:last] & ~query_allergens) != 0] = np.inf
+        order = np.argsort(bound, kind="stable")
+        bound = bound[order]
+        reachable = int(np.searchsorted(bound, np.inf))
+
+        best_at = np.zeros(0, dtype=np.int64)
+        best_dist = np.zeros(0, dtype=np.float32)
+        limit = np.inf
+        scanned, step = 0, PROBE_LEAVES
+        while scanned < reachable:
+            # The next nearest units, twice as many as last time, while their box can beat the n-th best
+            upto, step = scanned + step, step * 2
+            if limit < np.inf:
+                upto = min(upto, int(np.searchsorted(bound, limit, side="right")))
+            upto = min(upto, reachable)
+            if upto <= scanned:
+                break
+            batch = order[scanned:upto]
+            scanned = upto
+
+            found_at, dist = self._scan(boxes, batch, first, leaves, query, costs, skip_at, n)
+            if len(found_at):
+                found_at = np.concatenate([best_at, found_at])
+                dist = np.concatenate([best_dist, dist])
+                # Ties go to the lower row so results don't depend on scan order
+                top = np.lexsort((self.rows[boxes.slots[found_at]], dist))[:n]
+                best_at, best_dist = found_at[top], dist[top]
+                if len(best_at) >= n:
+                    limit = float(best_dist[n - 1])
+        return self.rows[boxes.slots[best_at]].tolist()
+
+    @staticmethod
+    def _scan(boxes: PersonaBoxes, units: np.ndarray, first: int, leaves: int, query: np.ndarray,
+              costs: np.ndarray, skip_at: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Entries of (part, leaf) units that tie for the n nearest, and their distances"""
+        # In (part, leaf) order, which is entry order, so neighbouring units merge into runs
+        part, leaf = np.divmod(np.sort(units), leaves)
+        leaf += first
+        starts, ends = _runs(boxes.offsets[part, leaf], boxes.offsets[part, leaf + 1])
+        if not len(starts):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        columns, allergens = _read_runs(boxes, starts, ends)
+        diff = columns - query[:, None]
+        # Allergen costs are inf for candidates that add an allergen
+        dist = np.einsum("ij,ij->j", diff, diff) + np.take(costs, allergens)
+        lengths = ends - starts
+        offsets = np.cumsum(lengths) - lengths
+        if len(skip_at):
+            run = np.searchsorted(starts, skip_at, side="right") - 1
+            hit = (run >= 0) & (skip_at < ends[run])
+            dist[offsets[run[hit]] + skip_at[hit] - starts[run[hit]]] = np.inf
+
+        near = np.flatnonzero(dist < np.inf)
+        if len(near) > n:
+            near = near[dist[near] <= np.partition(dist[near], n - 1)[n - 1]]
+        run = np.searchsorted(offsets, near, side="right") - 1
+        return starts[run] + near - offsets[run], dist[near]
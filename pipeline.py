@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""Data preparation pipeline, in one entry point.
+
+    ingest -> transform -> structure -> precompute
+
+Each stage calls the functions from its own script and passes data through
+Parquet intermediates that have explicit Arrow schemas. Nothing is re-parsed
+from CSV between stages, and no dtypes are re-inferred. A stage is skipped
+when the fingerprint of its inputs and of its own code matches the last run,
+which is recorded in <work-dir>/state.json. A refresh therefore redoes only
+what changed. If a stage reruns and produces the same bytes, the stages after
+it are skipped as well.
+
+Each stage runs in a forked child process, so the runner can report that
+stage's own peak RSS next to its wall time and row counts.
+
+The CSVs the rest of the app reads are still written:
+  - openfoodfacts_categorized.csv, read by the frontend
+  - openfoodfacts_precomputed.csv + sidecars, read by FastEngine
+
+Usage:
+    python3 pipeline.py                      # run / refresh everything
+    python3 pipeline.py --force transform    # redo one stage (and what changes after it)
+    python3 pipeline.py --until structure    # stop early
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import sys
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed by this runner
+    pa = None
+    pq = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import catalogue
+import data_ingestion
+import data_structuring
+import data_transformation
+import ingredient_match
+import precompute
+import product_filters
+import search_index
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_TSV = os.path.join(BASE_DIR, "openfoodfacts_export.tsv")
+WORK_DIR = os.path.join(BASE_DIR, ".pipeline")
+
+# Bump when the schemas below or the intermediate layout change
+SCHEMA_VERSION = 1
+
+# Rows per Parquet row group / per streamed batch
+BATCH_ROWS = 100_000
+
+
+# ============================================================================
+# SCHEMAS
+# ============================================================================
+
+
+def column_type(name: str):
+    """Arrow type for a pipeline column. Everything that is not numeric is text."""
+    if name in data_ingestion.numeric_cols or name.startswith("health_score_"):
+        return pa.float64()
+    if name in data_transformation.ALLERGEN_FLAGS:
+        return pa.int8()
+    return pa.string()
+
+
+def schema_for(columns) -> "pa.Schema":
+    return pa.schema([pa.field(c, column_type(c)) for c in columns])
+
+
+def to_table(df: pd.DataFrame) -> "pa.Table":
+    return pa.Table.from_pandas(df, schema=schema_for(df.columns), preserve_index=False)
+
+
+class ParquetSink:
+    """Row-group-at-a-time Parquet writer; the file only appears once complete"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df: pd.DataFrame) -> None:
+        table = to_table(df)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.tmp_path, table.schema)
+        self.writer.write_table(table, row_group_size=BATCH_ROWS)
+        self.rows += len(df)
+
+    def close(self, empty: Optional[pd.DataFrame] = None) -> None:
+        if self.writer is None:
+            # No rows at all: still write the schema so the next stage can run
+            self.write(empty if empty is not None else pd.DataFrame())
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def read_batches(path: str, batch_rows: int = BATCH_ROWS):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        yield batch.to_pandas()
+
+
+def read_frame(path: str) -> pd.DataFrame:
+    return pq.read_table(path).to_pandas()
+
+
+# ============================================================================
+# STAGES
+# ============================================================================
+# Each stage takes its input paths and output paths and returns
+# (rows_in, rows_out). Row filtering happens inside the stage modules.
+
+
+def ingest(inputs: List[str], outputs: List[str]) -> Tuple[int, int]:
+    (tsv,), (extracted,) = inputs, outputs
+    columns = data_ingestion.select_columns(tsv)
+    sink = ParquetSink(extracted)
+    rows_in = 0
+    for rows_read, chunk in data_ingestion.iter_chunks(tsv, columns, BATCH_ROWS):
+        rows_in += rows_read
+        sink.write(chunk)
+    sink.close(empty=schema_for(columns).empty_table().to_pandas())
+    return rows_in, sink.rows
+
+
+def transform(inputs: List[str], outputs: List[str]) -> Tuple[int, int]:
+    (extracted,), (final,) = inputs, outputs
+    sink = ParquetSink(final)
+    rows_in = 0
+    for chunk in read_batches(extracted):
+        rows_in += len(chunk)
+        sink.write(data_transformation.transform(chunk))
+    if sink.writer is None:
+        empty = pq.read_schema(extracted).empty_table().to_pandas()
+        sink.close(empty=data_transformation.transform(empty))
+    else:
+        sink.close()
+    return rows_in, sink.rows
+
+
+def structure(inputs: List[str], outputs: List[str]) -> Tuple[int, int]:
+    (final,), (categorized, categorized_csv) = inputs, outputs
+    df = read_frame(final)
+    rows_in = len(df)
+    df = data_structuring.structure(df)
+
+    sink = ParquetSink(categorized)
+    sink.write(df)
+    sink.close()
+    # The frontend still loads the categorized catalogue as CSV
+    tmp = categorized_csv + ".tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, categorized_csv)
+    return rows_in, len(df)
+
+
+def score(inputs: List[str], outputs: List[str]) -> Tuple[int, int]:
+    (categorized, categorized_csv), precomputed = inputs[:2], outputs[0]
+    df = read_frame(categorized)
+    rows_in = len(df)
+    df = precompute.add_quantity_columns(precompute.compute_persona_scores(df))
+    # Same fingerprint `python3 precompute.py` uses, so the two entry points agree
+    fingerprint = precompute.input_fingerprint(categorized_csv)
+    precompute.write_outputs(df, precomputed, fingerprint, os.path.basename(categorized_csv))
+    return rows_in, len(df)
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[List[str], List[str]], Tuple[int, int]]
+    inputs: List[str]
+    outputs: List[str]
+    modules: tuple
+
+
+def build_stages(raw_tsv: str = RAW_TSV, work_dir: str = WORK_DIR,
+                 categorized_csv: str = precompute.CATEGORIZED_CSV,
+                 precomputed_csv: str = precompute.PRECOMPUTED_CSV) -> List[Stage]:
+    extracted = os.path.join(work_dir, "extracted.parquet")
+    final = os.path.join(work_dir, "final.parquet")
+    categorized = os.path.join(work_dir, "categorized.parquet")
+    return [
+        Stage("ingest", ingest, [raw_tsv], [extracted], (data_ingestion,)),
+        Stage("transform", transform, [extracted], [final], (data_transformation,)),
+        Stage("structure", structure, [final], [categorized, categorized_csv], (data_structuring,)),
+        # Food_Recipe.csv only feeds the ingredient map
+        Stage("precompute", score, [categorized, categorized_csv, ingredient_match.RECIPES_CSV],
+              [precomputed_csv, precompute.manifest_path(precomputed_csv),
+               precompute.alternatives_path(precomputed_csv),
+               catalogue.manifest_path(catalogue.catalogue_path_for(precomputed_csv)),
+               search_index.index_path_for(precomputed_csv),
+               ingredient_match.ingredient_map_path_for(precomputed_csv),
+               product_filters.filters_path_for(precomputed_csv)],
+              (precompute, catalogue, search_index, ingredient_match, product_filters)),
+    ]
+
+
+# ============================================================================
+# FINGERPRINTS / STATE
+# ============================================================================
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stat_digest(path: str) -> str:
+    """Cheap stand-in for file_digest: size + mtime"""
+    st = os.stat(path)
+    return f"stat:{st.st_size}:{st.st_mtime_ns}"
+
+
+def code_version(stage: Stage) -> str:
+    """Hash of the stage function, the modules it calls and the schema version"""
+    h = hashlib.sha256(f"schema-v{SCHEMA_VERSION}".encode("utf-8"))
+    h.update(inspect.getsource(stage.func).encode("utf-8"))
+    for module in stage.modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def stage_key(input_digests: List[str], code: str) -> str:
+    payload = json.dumps({"inputs": input_digests, "code": code}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def output_stamp(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def read_state(work_dir: str) -> Dict:
+    try:
+        with open(os.path.join(work_dir, "state.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(work_dir: str, state: Dict) -> None:
+    path = os.path.join(work_dir, "state.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def outputs_intact(entry: Dict) -> bool:
+    """Every recorded output still exists and was not touched since"""
+    for path, stamp in entry.get("outputs", {}).items():
+        try:
+            if output_stamp(path) != stamp:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+# ============================================================================
+# EXECUTION
+# ============================================================================
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def _stage_child(stage: Stage, conn) -> None:
+    try:
+        rows_in, rows_out = stage.func(stage.inputs, stage.outputs)
+        conn.send({"ok": True, "rows_in": rows_in, "rows_out": rows_out,
+                   "peak_mb": peak_rss_mb()})
+    except BaseException:
+        conn.send({"ok": False, "error": traceback.format_exc()})
+    finally:
+        conn.close()
+
+
+def execute(stage: Stage) -> Dict:
+    """Run one stage, in a forked child when possible so its peak RSS is its own"""
+    import multiprocessing as mp
+
+    if "fork" not in mp.get_all_start_methods():
+        rows_in, rows_out = stage.func(stage.inputs, stage.outputs)
+        return {"rows_in": rows_in, "rows_out": rows_out, "peak_mb": peak_rss_mb()}
+
+    ctx = mp.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_child, args=(stage, child_conn), name=f"pipeline-{stage.name}")
+    proc.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {"ok": False, "error": "stage process died without a result"}
+    proc.join()
+    if not result.pop("ok"):
+        raise RuntimeError(f"Stage '{stage.name}' failed (exit code {proc.exitcode}):\n{result['error']}")
+    return result
+
+
+def run(raw_tsv: str = RAW_TSV, work_dir: str = WORK_DIR, force=(), until: Optional[str] = None,
+        trust_mtime: bool = False) -> List[Dict]:
+    """Run every stage whose inputs or code changed. Returns one report row per stage."""
+    if pa is None:
+        raise RuntimeError("pipeline.py needs pyarrow for its Parquet intermediates: pip install pyarrow")
+    os.makedirs(work_dir, exist_ok=True)
+
+    stages = build_stages(raw_tsv, work_dir)
+    names = [s.name for s in stages]
+    if until is not None and until not in names:
+        raise ValueError(f"Unknown stage '{until}', expected one of {names}")
+    force = set(names) if "all" in force else set(force)
+
+    state = read_state(work_dir)
+    # Digests of files produced by earlier stages, so they are hashed only once
+    produced: Dict[str, str] = {}
+    report = []
+
+    for stage in stages:
+        input_digests = []
+        for path in stage.inputs:
+            if path in produced:
+                input_digests.append(produced[path])
+            elif path == raw_tsv and trust_mtime:
+                input_digests.append(stat_digest(path))
+            else:
+                input_digests.append(file_digest(path))
+        key = stage_key(input_digests, code_version(stage))
+
+        entry = state.get(stage.name, {})
+        if stage.name not in force and entry.get("key") == key and outputs_intact(entry):
+            produced.update(entry["digests"])
+            report.append({"stage": stage.name, "status": "skipped",
+                           "rows_in": entry.get("rows_in"), "rows_out": entry.get("rows_out")})
+        else:
+            print(f"[{stage.name}] running...")
+            start = time.perf_counter()
+            result = execute(stage)
+            wall_s = time.perf_counter() - start
+
+            digests = {path: file_digest(path) for path in stage.outputs}
+            produced.update(digests)
+            state[stage.name] = {
+                "key": key,
+                "digests": digests,
+                "outputs": {path: output_stamp(path) for path in stage.outputs},
+                "rows_in": result["rows_in"],
+                "rows_out": result["rows_out"],
+            }
+            write_state(work_dir, state)
+            report.append({"stage": stage.name, "status": "ran", "wall_s": wall_s, **result})
+
+        if stage.name == until:
+            break
+
+    return report
+
+
+def print_report(report: List[Dict]) -> None:
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    print(f"{'stage':<12}{'status':<9}{'wall s':>9}{'rows in':>12}{'rows out':>12}{'peak MB':>10}")
+    for row in report:
+        print(f"{row['stage']:<12}{row['status']:<9}{fmt(row.get('wall_s'), '.2f'):>9}"
+              f"{fmt(row.get('rows_in'), ','):>12}{fmt(row.get('rows_out'), ','):>12}"
+              f"{fmt(row.get('peak_mb'), '.0f'):>10}")
+
+
+def main(argv=None):
+    stage_names = [s.name for s in build_stages()]
+    parser = argparse.ArgumentParser(description="Run the OpenFoodFacts data pipeline")
+    parser.add_argument("--input", default=RAW_TSV, help="OpenFoodFacts TSV export")
+    parser.add_argument("--work-dir", default=WORK_DIR, help="where intermediates and state live")
+    parser.add_argument("--force", nargs="+", default=[], choices=stage_names + ["all"],
+                        help="rerun these stages even if nothing changed")
+    parser.add_argument("--until", choices=stage_names, help="stop after this stage")
+    parser.add_argument("--trust-mtime", action="store_true",
+                        help="fingerprint the raw export by size+mtime instead of hashing it")
+    parser.add_argument("--json", action="store_true", help="print the stage report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args.input, args.work_dir, args.force, args.until, args.trust_mtime)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
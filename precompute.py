@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""Persona health-score precompute for B4UBuy.
+
+Reads openfoodfacts_categorized.csv, scores every product for all personas
+and writes openfoodfacts_precomputed.csv. All personas are scored at once as
+NumPy matrix operations against the `weights` table. A small manifest next to
+the output stores the content hash of the inputs, so re-running is a no-op
+until the catalogue or the weights change.
+
+The same table is also written as a memory-mapped binary catalogue
+(openfoodfacts_precomputed.catalogue/, see catalogue.py). FastEngine maps it
+instead of parsing the CSV.
+
+Run from the command line:
+    python precompute.py [--input ...] [--output ...] [--force]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from catalogue import Catalogue, catalogue_path_for, write_catalogue
+from ingredient_match import IngredientMatcher, ingredient_map_path_for
+from product_filters import FilterIndex, filters_path_for
+from search_index import ProductSearchIndex, index_path_for
+
+# The engine imports this module for the weight tables and scoring; pandas is
+# only needed to read and write CSVs, so it is imported where that happens
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Resolve file paths relative to this module so relative CWDs won't break imports
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATEGORIZED_CSV = os.path.join(BASE_DIR, 'openfoodfacts_categorized.csv')
+PRECOMPUTED_CSV = os.path.join(BASE_DIR, 'openfoodfacts_precomputed.csv')
+
+# Bump when the scoring rules or added columns below change so stale outputs are rebuilt
+PRECOMPUTE_VERSION = 2
+
+# Your exact nutrient columns
+NUTRICOLS = ['energy-kcal_value', 'fat_value', 'saturated-fat_value', 'carbohydrates_value',
+             'sugars_value', 'fiber_value', 'proteins_value', 'sodium_value']
+
+# Your exact personas
+personas = ["standard", "diabetic", "hypertension", "bodybuilder", "vegan", "vegetarian",
+            "eggetarian", "jain", "pregnancy", "lactating", "elderly"]
+
+# Your exact persona weights
+weights = {
+    "standard": {'proteins_value': 0.6, 'fiber_value': 0.4, 'sugars_value': -0.6, 'sodium_value': -0.4},
+    "diabetic": {'sugars_value': -1.0, 'fiber_value': 0.6, 'proteins_value': 0.3},
+    "hypertension": {'sodium_value': -1.0, 'fiber_value': 0.4, 'proteins_value': 0.3, 'saturated-fat_value': -0.3},
+    "bodybuilder": {'proteins_value': 1.0, 'fiber_value': 0.5, 'sodium_value': -0.5, 'sugars_value': -0.3},
+    "vegan": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
+    "vegetarian": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
+    "eggetarian": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
+    "jain": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.4},
+    "pregnancy": {'proteins_value': 0.8, 'fiber_value': 0.5, 'sodium_value': -0.7, 'sugars_value': -0.6},
+    "lactating": {'proteins_value': 0.7, 'fiber_value': 0.5, 'sugars_value': -0.5, 'sodium_value': -0.4},
+    "elderly": {'proteins_value': 0.5, 'fiber_value': 0.4, 'sodium_value': -0.8, 'sugars_value': -0.5}
+}
+
+# Lowest scores that still get a green / amber label
+GREEN_MIN_SCORE = 0.25
+AMBER_MIN_SCORE = -0.25
+
+# Ranked green alternatives kept per (subcategory, persona)
+ALTERNATIVES_TOP_N = 10
+
+# Column read for the NOVA fallback when a product has no usable nutrients
+NOVA_COL = 'off_nova_groups'
+
+# Pack size parsed from the free-text `quantity` column: grams for solids, ml
+# for liquids (QUANTITY_UNIT_COL says which), NaN when it can't be read
+QUANTITY_COL = 'quantity_value'
+QUANTITY_UNIT_COL = 'quantity_unit'
+
+# unit as written -> (base unit, factor)
+QUANTITY_UNITS = {
+    'g': ('g', 1.0), 'gm': ('g', 1.0), 'gms': ('g', 1.0), 'gr': ('g', 1.0),
+    'gram': ('g', 1.0), 'grams': ('g', 1.0), 'gramm': ('g', 1.0),
+    'kg': ('g', 1000.0), 'kgs': ('g', 1000.0), 'kilo': ('g', 1000.0), 'kilogram': ('g', 1000.0),
+    'kilograms': ('g', 1000.0), 'mg': ('g', 0.001),
+    'oz': ('g', 28.3495), 'lb': ('g', 453.592), 'lbs': ('g', 453.592),
+    'ml': ('ml', 1.0), 'cl': ('ml', 10.0), 'dl': ('ml', 100.0),
+    'l': ('ml', 1000.0), 'lt': ('ml', 1000.0), 'ltr': ('ml', 1000.0), 'ltrs': ('ml', 1000.0),
+    'litre': ('ml', 1000.0), 'litres': ('ml', 1000.0), 'liter': ('ml', 1000.0), 'liters': ('ml', 1000.0),
+}
+# First "<number> <unit>" in the text, e.g. "500g", "1 L", "1l (910g)" -> 1000 ml, "35,5 cl"
+_QUANTITY_RE = re.compile(
+    r'(\d+(?:[.,]\d+)?)\s*(' + '|'.join(sorted(map(re.escape, QUANTITY_UNITS), key=len, reverse=True))
+    + r')(?![a-z])',
+    re.IGNORECASE,
+)
+
+
+# ============================================================================
+# SCORING
+# ============================================================================
+
+
+def weight_terms(persona_names=None):
+    """
+    Persona weights as padded (personas x terms) arrays of NUTRICOLS indices
+    and weights, kept in the `weights` table order so sums match the old loop.
+    """
+    persona_names = persona_names or personas
+    n_terms = max(len(weights[p]) for p in persona_names)
+    cols = np.zeros((len(persona_names), n_terms), dtype=int)
+    W = np.zeros((len(persona_names), n_terms))
+    for i, persona in enumerate(persona_names):
+        for k, (col, weight) in enumerate(weights[persona].items()):
+            cols[i, k] = NUTRICOLS.index(col)
+            W[i, k] = weight
+    return cols, W
+
+
+def nutrient_matrix(df: pd.DataFrame) -> np.ndarray:
+    """(products x NUTRICOLS) float matrix, NaN where a value is missing"""
+    import pandas as pd
+    cols = []
+    for col in NUTRICOLS:
+        if col in df.columns:
+            cols.append(pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float))
+        else:
+            # A missing column reads as 0 (counted as present), as before
+            cols.append(np.zeros(len(df)))
+    return np.column_stack(cols)
+
+
+def score_matrix(values: np.ndarray, cols: np.ndarray, W: np.ndarray,
+                 nova: np.ndarray) -> np.ndarray:
+    """
+    Score every product for every persona in one pass.
+
+    values: (products x NUTRICOLS) with NaN for missing nutrients
+    cols/W: (personas x terms) weight table from `weight_terms`
+    nova:   (products,) NOVA group used when no weighted nutrient is present
+
+    Returns a (products x personas) matrix of normalised scores in [-1, 1].
+    """
+    n = values.shape[0]
+    score = np.zeros((n, W.shape[0]))
+    weight_sum = np.zeros((n, W.shape[0]))
+
+    for k in range(W.shape[1]):
+        term = values[:, cols[:, k]]              # (products x personas)
+        present = ~np.isnan(term) & (W[:, k] != 0)
+        # Penalty weights contribute `weight * -val`, bonuses `weight * val`
+        contrib = np.where(W[:, k] < 0, W[:, k] * -term, W[:, k] * term)
+        score += np.where(present, contrib, 0.0)
+        weight_sum += np.where(present, np.abs(W[:, k]), 0.0)
+
+    # NOVA fallback for products with no weighted nutrient at all
+    fallback = weight_sum < 1e-3
+    nova_score = np.where(np.isnan(nova), 0.0, 0.2 - (nova - 1) * 0.3)
+    score = np.where(fallback, nova_score[:, None], score)
+    weight_sum = np.where(fallback, 1.0, weight_sum)
+
+    return np.clip(score / np.maximum(weight_sum, 10.0), -1.0, 1.0)
+
+
+def weight_vector(custom: Dict[str, float]) -> np.ndarray:
+    """
+    A custom persona's {nutrient column: weight} as a NUTRICOLS-length vector.
+    Raises ValueError on an unknown column, a non-numeric weight or all zeros.
+    """
+    w = np.zeros(len(NUTRICOLS))
+    for col, weight in custom.items():
+        if col not in NUTRICOLS:
+            raise ValueError(f"unknown nutrient {col!r} (one of {', '.join(NUTRICOLS)})")
+        try:
+            w[NUTRICOLS.index(col)] = float(weight)
+        except (TypeError, ValueError):
+            raise ValueError(f"weight for {col!r} must be a number")
+    if not np.isfinite(w).all() or not w.any():
+        raise ValueError("weights must be finite and not all zero")
+    return w
+
+
+def score_vector(values: np.ndarray, present: np.ndarray, w: np.ndarray,
+                 nova: np.ndarray) -> np.ndarray:
+    """
+    score_matrix for a single weight vector, as two matrix-vector products.
+
+    values:  (products x NUTRICOLS) with missing nutrients as 0
+    present: (products x NUTRICOLS) 1.0 where the nutrient is known
+    w:       (NUTRICOLS,) weights from `weight_vector`
+    """
+    # Penalty weights contribute `weight * -val`, bonuses `weight * val`
+    magnitude = np.where(w < 0, -w, w)
+    score = values @ magnitude
+    weight_sum = present @ magnitude
+
+    fallback = weight_sum < 1e-3
+    nova_score = np.where(np.isnan(nova), 0.0, 0.2 - (nova - 1) * 0.3)
+    score = np.where(fallback, nova_score, score)
+    weight_sum = np.where(fallback, 1.0, weight_sum)
+
+    return np.clip(score / np.maximum(weight_sum, 10.0), -1.0, 1.0)
+
+
+def health_labels(scores: np.ndarray) -> np.ndarray:
+    return np.where(scores >= GREEN_MIN_SCORE, 'green', np.where(scores >= AMBER_MIN_SCORE, 'amber', 'red'))
+
+
+def nova_groups(df: pd.DataFrame) -> np.ndarray:
+    import pandas as pd
+    if NOVA_COL in df.columns:
+        return pd.to_numeric(df[NOVA_COL], errors='coerce').to_numpy(dtype=float)
+    return np.ones(len(df))
+
+
+def compute_persona_scores(df: pd.DataFrame) -> pd.DataFrame:
+    """Add health_score_X, health_label_X, health_confidence_X for all personas"""
+    values = nutrient_matrix(df)
+    scores = score_matrix(values, *weight_terms(), nova_groups(df))
+    labels = health_labels(scores)
+
+    # Nutrient completeness for confidence (same for every persona)
+    completeness = (~np.isnan(values)).sum(axis=1) / len(NUTRICOLS)
+    confidence = np.where(completeness >= 0.5, 'high', 'low')
+
+    for i, persona in enumerate(personas):
+        df[f'health_score_{persona}'] = scores[:, i]
+        df[f'health_label_{persona}'] = labels[:, i]
+        df[f'health_confidence_{persona}'] = confidence
+    return df
+
+
+# ============================================================================
+# QUANTITY
+# ============================================================================
+
+
+def parse_quantity(text) -> tuple:
+    """(amount, 'g' | 'ml') from free text like "200 g" or "1 L"; (nan, '') if unreadable"""
+    if not isinstance(text, str):
+        return float('nan'), ''
+    match = _QUANTITY_RE.search(text)
+    if match is None:
+        return float('nan'), ''
+    unit, factor = QUANTITY_UNITS[match.group(2).lower()]
+    return float(match.group(1).replace(',', '.')) * factor, unit
+
+
+def quantity_columns(values: Sequence) -> tuple:
+    """(float amounts, unit strings) for every row; each distinct text is parsed once"""
+    parsed: Dict = {}
+    amounts = np.empty(len(values))
+    units = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        key = v if isinstance(v, str) else None
+        hit = parsed.get(key)
+        if hit is None:
+            hit = parsed[key] = parse_quantity(key)
+        amounts[i], units[i] = hit
+    return amounts, units
+
+
+def add_quantity_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Add QUANTITY_COL (float) and QUANTITY_UNIT_COL parsed from `quantity`"""
+    values = df['quantity'].tolist() if 'quantity' in df.columns else [None] * len(df)
+    amounts, units = quantity_columns(values)
+    df[QUANTITY_COL] = amounts
+    df[QUANTITY_UNIT_COL] = np.where(units == '', None, units)
+    return df
+
+
+# ============================================================================
+# ALTERNATIVE RANKINGS
+# ============================================================================
+
+
+def rank_alternatives(subcategories: Sequence[str], scores: Dict[str, np.ndarray],
+                      is_green: Dict[str, np.ndarray],
+                      top_n: int = ALTERNATIVES_TOP_N) -> Dict[str, Dict[str, List[int]]]:
+    """
+    Best-N GREEN rows per (persona, subcategory), highest score first and
+    catalogue order on ties (what the old per-item max() picked).
+    """
+    subcat_table, subcat_codes = np.unique(np.asarray(subcategories, dtype=object).astype(str),
+                                           return_inverse=True)
+    rankings: Dict[str, Dict[str, List[int]]] = {}
+    for persona, score in scores.items():
+        rows = np.flatnonzero(is_green[persona])
+        order = np.lexsort((rows, -score[rows], subcat_codes[rows]))
+        rows = rows[order]
+        codes = subcat_codes[rows]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(rows) else []
+        ends = list(starts[1:]) + [len(rows)] if len(rows) else []
+        rankings[persona] = {
+            str(subcat_table[codes[start]]): rows[start:min(end, start + top_n)].tolist()
+            for start, end in zip(starts, ends)
+        }
+    return rankings
+
+
+def alternatives_path(output_path: str) -> str:
+    return os.path.splitext(output_path)[0] + '.alternatives.json'
+
+
+def write_alternatives(df: pd.DataFrame, output_path: str, input_hash: str) -> None:
+    subcategories = df['subcategory'].tolist() if 'subcategory' in df.columns else ['Unknown'] * len(df)
+    scores = {p: df[f'health_score_{p}'].to_numpy(dtype=float) for p in personas}
+    is_green = {p: (df[f'health_label_{p}'] == 'green').to_numpy() for p in personas}
+    with open(alternatives_path(output_path), 'w', encoding='utf-8') as f:
+        json.dump({
+            'input_hash': input_hash,
+            'rows': len(df),
+            'top_n': ALTERNATIVES_TOP_N,
+            'rankings': rank_alternatives(subcategories, scores, is_green),
+        }, f)
+
+
+# ============================================================================
+# CONTENT HASH / MANIFEST
+# ============================================================================
+
+
+def manifest_path(output_path: str) -> str:
+    return os.path.splitext(output_path)[0] + '.meta.json'
+
+
+def input_fingerprint(input_path: str) -> str:
+    """Hash of the input file bytes plus everything that affects the scores"""
+    h = hashlib.sha256()
+    with open(input_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    h.update(json.dumps({
+        'version': PRECOMPUTE_VERSION,
+        'nutricols': NUTRICOLS,
+        'personas': personas,
+        'weights': weights,
+        'nova_col': NOVA_COL,
+    }, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def read_manifest(output_path: str) -> Optional[Dict]:
+    try:
+        with open(manifest_path(output_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_up_to_date(input_path: str = CATEGORIZED_CSV, output_path: str = PRECOMPUTED_CSV) -> bool:
+    manifest = read_manifest(output_path)
+    if not manifest or not Path(output_path).exists():
+        return False
+    return manifest.get('input_hash') == input_fingerprint(input_path)
+
+
+def ensure_search_index(output_path: str = PRECOMPUTED_CSV,
+                        df: Optional[pd.DataFrame] = None) -> ProductSearchIndex:
+    """Build the product search index next to the output unless it is current"""
+    if df is None:
+        import pandas as pd
+        df = pd.read_csv(output_path)
+    names = [str(v) for v in df['product_name_en'].tolist()]
+    brands = [str(v) for v in df['brands'].tolist()] if 'brands' in df.columns else [''] * len(df)
+    return ProductSearchIndex.load_or_build(index_path_for(output_path), names, brands)
+
+
+def ensure_ingredient_map(output_path: str, df: pd.DataFrame, index: ProductSearchIndex) -> None:
+    """Match every Food_Recipe.csv ingredient against the catalogue unless the map is current"""
+    categories = [str(v) for v in df['category'].tolist()] if 'category' in df.columns else ['Unknown'] * len(df)
+    IngredientMatcher.load_or_build(ingredient_map_path_for(output_path), index, categories)
+
+
+def ensure_filter_index(output_path: str, df: pd.DataFrame, fingerprint: str) -> None:
+    """Build the shopping-screen filter bitsets unless they are current"""
+    def column(name):
+        return df[name].tolist() if name in df.columns else [None] * len(df)
+    FilterIndex.load_or_build(filters_path_for(output_path), column, len(df), fingerprint)
+
+
+def write_outputs(df: pd.DataFrame, output_path: str, fingerprint: str, input_name: str) -> None:
+    """Write the scored CSV, its manifest, the binary catalogue, the alternatives, the search index,
+    the recipe ingredient map and the filter bitsets"""
+    df.to_csv(output_path, index=False)
+    write_catalogue(df, catalogue_path_for(output_path), fingerprint, personas)
+
+    with open(manifest_path(output_path), 'w', encoding='utf-8') as f:
+        json.dump({
+            'input': input_name,
+            'input_hash': fingerprint,
+            'version': PRECOMPUTE_VERSION,
+            'rows': len(df),
+            'personas': personas,
+        }, f, indent=2)
+
+    write_alternatives(df, output_path, fingerprint)
+    index = ensure_search_index(output_path, df)
+    ensure_ingredient_map(output_path, df, index)
+    ensure_filter_index(output_path, df, fingerprint)
+
+
+def run(input_path: str = CATEGORIZED_CSV, output_path: str = PRECOMPUTED_CSV,
+        force: bool = False) -> bool:
+    """Precompute scores if the inputs changed. Returns True if work was done."""
+    import pandas as pd
+
+    if not Path(input_path).exists():
+        raise FileNotFoundError(f"Required CSV not found: {input_path}")
+
+    fingerprint = input_fingerprint(input_path)
+    manifest = read_manifest(output_path)
+    if (not force and manifest and Path(output_path).exists()
+            and manifest.get('input_hash') == fingerprint):
+        print(f"{output_path} is up to date (hash {fingerprint[:12]}), skipping precompute")
+        df = pd.read_csv(output_path)
+        if Catalogue.open(catalogue_path_for(output_path), fingerprint) is None:
+            write_catalogue(df, catalogue_path_for(output_path), fingerprint, personas)
+        if not Path(alternatives_path(output_path)).exists():
+            write_alternatives(df, output_path, fingerprint)
+        ensure_ingredient_map(output_path, df, ensure_search_index(output_path, df))
+        ensure_filter_index(output_path, df, fingerprint)
+        return False
+
+    start = time.perf_counter()
+    print(f"Precomputing health scores for all {len(personas)} personas...")
+    df = pd.read_csv(input_path)
+    df = compute_persona_scores(df)
+    df = add_quantity_columns(df)
+    write_outputs(df, output_path, fingerprint, os.path.basename(input_path))
+
+    elapsed = time.perf_counter() - start
+    print(f"SAVED {output_path} - {len(df)} products, {len(personas)*3} columns added in {elapsed:.2f}s")
+    print("Columns: health_score_X, health_label_X, health_confidence_X for all personas")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute persona health scores")
+    parser.add_argument('--input', default=CATEGORIZED_CSV, help="categorized CSV to score")
+    parser.add_argument('--output', default=PRECOMPUTED_CSV, help="precomputed CSV to write")
+    parser.add_argument('--force', action='store_true', help="recompute even if inputs are unchanged")
+    args = parser.parse_args(argv)
+    run(args.input, args.output, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Catalogue filter bitmaps for the shopping screen.
+
+Every filter the product grid offers is a precomputed bitset over the
+catalogue rows (one bit per product, packed into uint8):
+
+  category:<value> / subcategory:<value>   exact category match
+  free_of:<allergen>                       has_<allergen> is not 1
+  diet:<label>                             `labels` contains the label (case-insensitive)
+  grade:<a-e>                              normalised off:nutriscore_grade
+  listed                                   rows with a product name
+
+A query ANDs the bitsets it needs, so answering it never touches the
+product rows. Results are paged in a fixed order per sort key, and the
+cursor is a position in that order. The next page therefore never skips
+or repeats a product, even while other clients page the same catalogue.
+
+precompute.py writes the bitsets next to the catalogue
+(openfoodfacts_precomputed.filters.npz). FastEngine loads them, or builds
+them from the store when they are missing or stale.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Bump when the bitset definitions or the on-disk layout change
+FILTERS_VERSION = 1
+
+DEFAULT_PAGE_SIZE = 60
+MAX_PAGE_SIZE = 200
+
+ALLERGENS = ("gluten", "milk", "soybeans", "nuts", "mustards", "peanuts",
+             "sulphur-dioxide-and-sulphites", "sesame-seeds")
+NUTRI_GRADES = ("a", "b", "c", "d", "e")
+
+# The diet tags on the shopping screen's filter sheet (index.html); others
+# are computed on first use
+DIET_LABELS = ("no cholesterol", "no gluten", "vegan", "no gmos", "plant-based",
+               "no added sugar", "high proteins", "no preservatives", "low or no sodium",
+               "no artificial colors", "no artificial preservatives", "no artificial flavors",
+               "no artificial sweeteners", "no trans fat", "no lactose", "high fibres",
+               "no palm oil")
+
+# catalogue: file order; nutri: grade a first, then file order; score: persona health score, best first
+SORTS = ("catalogue", "nutri", "score")
+
+# Rows examined per step while filling a page
+PAGE_SCAN_CHUNK = 4096
+
+
+def filters_path_for(csv_path: str) -> str:
+    """Where the filter bitsets for a precomputed CSV live"""
+    return os.path.splitext(csv_path)[0] + ".filters.npz"
+
+
+def nutri_grade(value: Any) -> str:
+    """app.js getNutriGrade: unknown / not-applicable / missing count as 'd'"""
+    grade = "" if value is None or value != value else str(value).strip().lower()
+    return "d" if grade in ("", "unknown", "not-applicable") else grade
+
+
+def _present(value: Any) -> bool:
+    return value is not None and value == value and str(value).strip() != ""
+
+
+# ============================================================================
+# BITSETS
+# ============================================================================
+
+
+def pack(mask: np.ndarray) -> np.ndarray:
+    return np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+
+
+def count(bits: np.ndarray) -> int:
+    return int(np.bitwise_count(bits).sum())
+
+
+def test(bits: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Bit value for each row, without unpacking the whole set"""
+    return ((bits[rows >> 3] >> (rows & 7).astype(np.uint8)) & 1).astype(bool)
+
+
+def score_order(scores: np.ndarray) -> np.ndarray:
+    """Rows best score first, file order on ties"""
+    return np.lexsort((np.arange(len(scores)), -np.asarray(scores, dtype=np.float64))).astype(np.int32)
+
+
+class FilterIndex:
+    def __init__(self, size: int, bitsets: Dict[str, np.ndarray], digest: str,
+                 grade_order: np.ndarray,
+                 labels: Optional[Callable[[], Sequence[Any]]] = None):
+        self.size = size
+        self.bitsets = bitsets
+        self.digest = digest
+        # Rows by (nutri grade, row): the NutriMax ordering
+        self.grade_order = grade_order
+        # Source of the labels column, for diet tags without a precomputed bitset
+        self._labels = labels
+        self._empty = np.zeros((size + 7) // 8, dtype=np.uint8)
+        self._score_orders: Dict[str, np.ndarray] = {}
+        self._diet_bits = lru_cache(maxsize=64)(self._diet_bits_uncached)
+
+    # ------------------------------------------------------------------ build
+
+    @classmethod
+    def build(cls, column: Callable[[str], Sequence[Any]], size: int, digest: str) -> "FilterIndex":
+        """`column(name)` returns a source column, None/NaN where missing"""
+        bitsets: Dict[str, np.ndarray] = {}
+
+        bitsets["listed"] = pack([_present(v) for v in column("product_name_en")])
+
+        for field in ("category", "subcategory"):
+            values = np.array([str(v) if _present(v) else "" for v in column(field)], dtype=object)
+            table, codes = np.unique(values, return_inverse=True)
+            for code, value in enumerate(table.tolist()):
+                if value:
+                    bitsets[f"{field}:{value}"] = pack(codes == code)
+
+        for allergen in ALLERGENS:
+            flags = column(f"has_{allergen}")
+            # app.js kept a product unless the flag was exactly "1"
+            bitsets[f"free_of:{allergen}"] = pack([not (_present(v) and float(v) == 1) for v in flags])
+
+        labels = [str(v).lower() if _present(v) else "" for v in column("labels")]
+        for diet in DIET_LABELS:
+            bitsets[f"diet:{diet}"] = pack([diet in text for text in labels])
+
+        grades = np.array([nutri_grade(v) for v in column("off:nutriscore_grade")], dtype=object)
+        for grade in NUTRI_GRADES:
+            bitsets[f"grade:{grade}"] = pack(grades == grade)
+        rank = {g: i for i, g in enumerate(NUTRI_GRADES)}
+        grade_codes = np.array([rank.get(g, len(NUTRI_GRADES)) for g in grades], dtype=np.int8)
+        grade_order = np.argsort(grade_codes, kind="stable").astype(np.int32)
+
+        return cls(size, bitsets, digest, grade_order, labels=lambda: labels)
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp.npz"
+        keys = sorted(self.bitsets)
+        np.savez(
+            tmp,
+            digest=np.array(self.digest),
+            size=np.array(self.size),
+            keys=np.array(keys, dtype=str),
+            bits=np.stack([self.bitsets[k] for k in keys]) if keys else np.empty((0, 0), np.uint8),
+            grade_order=self.grade_order,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, digest: str,
+             labels: Optional[Callable[[], Sequence[Any]]] = None) -> Optional["FilterIndex"]:
+        """Load saved bitsets; None if missing or built from different data"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data["digest"]) != digest:
+                    return None
+                bits = data["bits"]
+                bitsets = dict(zip(data["keys"].tolist(), bits))
+                size = int(data["size"])
+                grade_order = data["grade_order"]
+        except (OSError, KeyError, ValueError):
+            return None
+        return cls(size, bitsets, digest, grade_order, labels=labels)
+
+    @classmethod
+    def load_or_build(cls, path: Optional[str], column: Callable[[str], Sequence[Any]],
+                      size: int, input_hash: str) -> "FilterIndex":
+        digest = fingerprint(input_hash)
+        # Loaded bitsets only need the labels column for uncommon diet tags
+        labels = lambda: [str(v).lower() if _present(v) else "" for v in column("labels")]
+        if path:
+            index = cls.load(path, digest, labels)
+            if index is not None and index.size == size:
+                print(f"[FilterIndex] Loaded {path}")
+                return index
+
+        index = cls.build(column, size, digest)
+        if path:
+            try:
+                index.save(path)
+                print(f"[FilterIndex] Saved {path}")
+            except OSError as e:
+                # Read-only deployments just keep the in-memory bitsets
+                print(f"[FilterIndex] Could not save {path}: {e}")
+        return index
+
+    # ------------------------------------------------------------------ query
+
+    def _diet_bits_uncached(self, diet: str) -> np.ndarray:
+        if self._labels is None:
+            return self._empty
+        return pack([diet in text for text in self._labels()])
+
+    def bits(self, key: str) -> np.ndarray:
+        """Bitset for one filter key; unknown categories / diets match nothing"""
+        found = self.bitsets.get(key)
+        if found is not None:
+            return found
+        if key.startswith("diet:"):
+            return self._diet_bits(key[len("diet:"):])
+        return self._empty
+
+    def select(self, category: Optional[str] = None, subcategory: Optional[str] = None,
+               diets: Sequence[str] = (), allergens: Sequence[str] = (),
+               grades: Sequence[str] = (), within: Optional[np.ndarray] = None) -> np.ndarray:
+        """AND of every requested filter; `grades` is an OR (any of them)"""
+        parts = [self.bitsets["listed"]]
+        if category:
+            parts.append(self.bits(f"category:{category}"))
+        if subcategory:
+            parts.append(self.bits(f"subcategory:{subcategory}"))
+        for diet in diets:
+            parts.append(self.bits(f"diet:{diet.strip().lower()}"))
+        for allergen in allergens:
+            if allergen not in ALLERGENS:
+                raise ValueError(f"unknown allergen {allergen!r} (one of {', '.join(ALLERGENS)})")
+            parts.append(self.bitsets[f"free_of:{allergen}"])
+        if grades:
+            unknown = [g for g in grades if g not in NUTRI_GRADES]
+            if unknown:
+                raise ValueError(f"unknown nutri grade {unknown[0]!r}")
+            parts.append(np.bitwise_or.reduce([self.bitsets[f"grade:{g}"] for g in grades]))
+        if within is not None:
+            parts.append(within)
+        return np.bitwise_and.reduce(parts)
+
+    def order(self, sort: str, scores: Optional[np.ndarray] = None,
+              persona: str = "") -> Optional[np.ndarray]:
+        """
+        Row order for a sort key (None = file order). Score orders are kept
+        per persona, so `persona` must be a precomputed one; orders for
+        custom personas belong with the caller's vector cache.
+        """
+        if sort == "catalogue":
+            return None
+        if sort == "nutri":
+            return self.grade_order
+        if sort == "score":
+            if persona not in self._score_orders:
+                self._score_orders[persona] = score_order(scores)
+            return self._score_orders[persona]
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+
+    def page(self, bits: np.ndarray, order: Optional[np.ndarray], start: int,
+             limit: int) -> Tuple[List[int], Optional[int]]:
+        """
+        Up to `limit` selected rows from position `start` of the order, and
+        the position to continue from (None at the end)
+        """
+        rows: List[int] = []
+        pos = start
+        while pos < self.size and len(rows) <= limit:
+            end = min(pos + max(PAGE_SCAN_CHUNK, limit * 4), self.size)
+            chunk = np.arange(pos, end, dtype=np.int64) if order is None else order[pos:end].astype(np.int64)
+            hit = np.flatnonzero(test(bits, chunk))
+            for i in hit.tolist():
+                if len(rows) == limit:
+                    return rows, pos + i
+                rows.append(int(chunk[i]))
+            pos = end
+        return rows, None
+
+
+def fingerprint(input_hash: str) -> str:
+    h = hashlib.sha256(f"v{FILTERS_VERSION}".encode("utf-8"))
+    h.update(input_hash.encode("utf-8"))
+    h.update(json.dumps([ALLERGENS, NUTRI_GRADES, DIET_LABELS]).encode("utf-8"))
+    return h.hexdigest()
+
+
+# ============================================================================
+# CURSORS
+# ============================================================================
+
+
+def encode_cursor(digest: str, sort: str, persona: str, position: int) -> str:
+    raw = f"{digest[:16]}:{sort}:{persona}:{position}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, digest: str, sort: str, persona: str) -> int:
+    """Position a cursor points at; ValueError if it is malformed or from another query / catalogue"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        # Custom persona keys contain ":"; the digest and sort never do
+        cursor_digest, cursor_sort, rest = raw.split(":", 2)
+        cursor_persona, position = rest.rsplit(":", 1)
+        position = int(position)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError("invalid cursor")
+    if cursor_digest != digest[:16]:
+        raise ValueError("the catalogue changed since this cursor was issued; start again")
+    if (cursor_sort, cursor_persona) != (sort, persona) or position < 0:
+        raise ValueError("cursor belongs to a different sort")
+    return position
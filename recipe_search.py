@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""Recipe search over Food_Recipe.csv.
+
+Replaces the linear scans in app.js (findRecipesByDish,
+getAutocompleteSuggestions) with an index built once per process:
+  - an inverted index from name words to recipes
+  - a trie over every suffix of every name word, so "recipes whose name
+    contains s" is a single walk instead of a scan
+  - facet indexes for cuisine / course / diet, with a prefix trie for
+    completing their values
+
+The index only generates candidates. Candidates are then scored with the
+same tiers as app.js, so results and their order are unchanged:
+  100 exact, 90 starts with, 80 contains every word, 70 contains the term,
+  else (matched words / words longer than 2) * 60.
+Ties keep file order.
+
+The stdlib csv module is enough here (no pandas), so the serverless
+handlers in api/recipes/ stay light.
+"""
+
+import csv
+import os
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Resolve file paths relative to this module so relative CWDs won't break imports
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RECIPES_CSV = os.path.join(BASE_DIR, "Food_Recipe.csv")
+
+SEARCH_TOP_K = 5          # findRecipesByDish returned the best 5
+AUTOCOMPLETE_TOP_K = 8    # getAutocompleteSuggestions returned the best 8
+AUTOCOMPLETE_MIN_CHARS = 2
+MAX_TOP_K = 50
+
+FACETS = ("cuisine", "course", "diet")
+
+# Trie node key holding the term ids below that node
+_IDS = None
+
+
+class Trie:
+    """
+    Character trie over `terms`. With suffixes=True every suffix is inserted,
+    so ids(s) returns the terms that contain s; otherwise the terms starting with s.
+    """
+
+    def __init__(self, terms: List[str], suffixes: bool = False):
+        self.size = len(terms)
+        self.root: Dict[Any, Any] = {}
+        for tid, term in enumerate(terms):
+            for start in range(len(term) if suffixes else min(len(term), 1)):
+                node = self.root
+                for ch in term[start:]:
+                    node = node.setdefault(ch, {})
+                    node.setdefault(_IDS, set()).add(tid)
+
+    def ids(self, s: str) -> Set[int]:
+        if not s:
+            return set(range(self.size))
+        node = self.root
+        for ch in s:
+            node = node.get(ch)
+            if node is None:
+                return set()
+        return node.get(_IDS, set())
+
+
+def score_name(name: str, term: str, words: List[str], long_words: List[str]) -> Tuple[float, str]:
+    """The findRecipesByDish tiers for one lower-cased recipe name"""
+    if name == term:
+        return 100, "exact"
+    if name.startswith(term):
+        return 90, "starts_with"
+    if all(w in name for w in words):
+        return 80, "all_words"
+    if term in name:
+        return 70, "contains"
+
+    recipe_words = name.split(" ")
+    matches = sum(1 for sw in long_words if any(sw in rw for rw in recipe_words))
+    if matches:
+        return matches / len(long_words) * 60, "partial_words"
+    return 0, ""
+
+
+class RecipeIndex:
+    def __init__(self, recipes: List[Dict[str, str]]):
+        self.recipes = recipes
+        self.names = [r["name"].lower() for r in recipes]
+
+        # name word -> recipes, and a suffix trie over the words
+        postings: Dict[str, Set[int]] = {}
+        for row, name in enumerate(self.names):
+            for word in name.split(" "):
+                postings.setdefault(word, set()).add(row)
+        self.words = list(postings)
+        self.postings = [postings[w] for w in self.words]
+        self.word_trie = Trie(self.words, suffixes=True)
+
+        # facet -> lower-cased value -> recipes, plus a prefix trie per facet
+        self.facets: Dict[str, Dict[str, Set[int]]] = {}
+        self.facet_values: Dict[str, List[str]] = {}
+        self.facet_tries: Dict[str, Trie] = {}
+        for facet in FACETS:
+            index: Dict[str, Set[int]] = {}
+            display: Dict[str, str] = {}
+            for row, recipe in enumerate(recipes):
+                value = recipe.get(facet, "").strip()
+                if value:
+                    index.setdefault(value.lower(), set()).add(row)
+                    display.setdefault(value.lower(), value)
+            self.facets[facet] = index
+            self.facet_values[facet] = [display[v] for v in index]
+            self.facet_tries[facet] = Trie(list(index))
+
+        self._rows_containing = lru_cache(maxsize=4096)(self._rows_containing_uncached)
+
+    @classmethod
+    def load(cls, path: str = RECIPES_CSV) -> "RecipeIndex":
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            recipes = [
+                {k: (v or "").strip() for k, v in row.items() if k is not None}
+                for row in csv.DictReader(f)
+            ]
+        # app.js skipped rows without a name
+        return cls([r for r in recipes if r.get("name")])
+
+    def __len__(self) -> int:
+        return len(self.recipes)
+
+    # ------------------------------------------------------------- candidates
+
+    def _rows_containing_uncached(self, s: str) -> frozenset:
+        """Recipes with a name word containing s"""
+        rows: Set[int] = set()
+        for wid in self.word_trie.ids(s):
+            rows |= self.postings[wid]
+        return frozenset(rows)
+
+    def _filter(self, filters: Dict[str, Optional[str]]) -> Optional[Set[int]]:
+        allowed: Optional[Set[int]] = None
+        for facet, value in filters.items():
+            if not value:
+                continue
+            rows = self.facets.get(facet, {}).get(value.strip().lower(), set())
+            allowed = set(rows) if allowed is None else allowed & rows
+        return allowed
+
+    # ----------------------------------------------------------------- search
+
+    def search(self, query: str, k: int = SEARCH_TOP_K,
+               **filters: Optional[str]) -> List[Tuple[int, float, str]]:
+        """Top-k (row, score, match_type), best first, file order on ties"""
+        term = (query or "").lower().strip()
+        if not term:
+            return []
+        words = term.split(" ")
+        long_words = [w for w in words if len(w) > 2]
+
+        # Tiers 100-70 need every word inside the name; each word has no
+        # spaces, so it sits inside a single name word
+        every: Optional[frozenset] = None
+        for w in words:
+            if w:
+                rows = self._rows_containing(w)
+                every = rows if every is None else every & rows
+        allowed = self._filter(filters)
+        full = set(every or ())
+        if allowed is not None:
+            full &= allowed
+
+        scored = []
+        for row in full:
+            score, match_type = score_name(self.names[row], term, words, long_words)
+            scored.append((row, score, match_type))
+
+        # Partial tier: scores are at most 60 and every full match scores
+        # 80+, so partial rows only matter with fewer than k full matches.
+        # A row's partial count is the number of long words whose postings
+        # contain it, which is the app.js per-word check.
+        if len(scored) < k and long_words:
+            counts: Counter = Counter()
+            for w in long_words:
+                counts.update(self._rows_containing(w))
+            for row, matches in counts.items():
+                if row in full or (allowed is not None and row not in allowed):
+                    continue
+                scored.append((row, matches / len(long_words) * 60, "partial_words"))
+
+        scored.sort(key=lambda x: (-x[1], x[0]))
+        return scored[:k]
+
+    def autocomplete(self, query: str, k: int = AUTOCOMPLETE_TOP_K) -> List[Dict[str, Any]]:
+        """getAutocompleteSuggestions: names containing the query, prefix hits first"""
+        if not query or len(query) < AUTOCOMPLETE_MIN_CHARS:
+            return []
+        term = query.lower().strip()
+        words = [w for w in term.split(" ") if w]
+        if not words:
+            return []
+
+        rows = self._rows_containing(words[0])
+        for w in words[1:]:
+            rows = rows & self._rows_containing(w)
+
+        hits = []
+        for row in rows:
+            name = self.names[row]
+            if term in name:
+                hits.append((10 if name.startswith(term) else 5, row))
+        hits.sort(key=lambda x: (-x[0], x[1]))
+
+        return [
+            {
+                "name": self.recipes[row]["name"],
+                "cuisine": self.recipes[row].get("cuisine") or "International",
+                "score": score,
+            }
+            for score, row in hits[:k]
+        ]
+
+    def complete_facet(self, facet: str, prefix: str, k: int = AUTOCOMPLETE_TOP_K) -> List[Dict[str, Any]]:
+        """Facet values starting with prefix, most recipes first"""
+        ids = self.facet_tries[facet].ids(prefix.lower().strip())
+        values = self.facet_values[facet]
+        index = self.facets[facet]
+        hits = sorted(ids, key=lambda i: (-len(index[values[i].lower()]), i))
+        return [{"value": values[i], "count": len(index[values[i].lower()])} for i in hits[:k]]
+
+    def examples(self, n: int = 3) -> List[str]:
+        return [r["name"] for r in self.recipes[:n]]
+
+
+# ============================================================================
+# SHARED INDEX + REQUEST HELPERS (used by backend_api and api/recipes/*)
+# ============================================================================
+
+_index: Optional[RecipeIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index(path: str = RECIPES_CSV) -> RecipeIndex:
+    """Process-wide index, built on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RecipeIndex.load(path)
+    return _index
+
+
+def _top_k(args: Dict[str, Any], default: int) -> int:
+    try:
+        k = int(args.get("k", default))
+    except (TypeError, ValueError):
+        raise ValueError("k must be an integer")
+    return max(1, min(k, MAX_TOP_K))
+
+
+def search_response(args: Dict[str, Any], index: Optional[RecipeIndex] = None) -> Dict[str, Any]:
+    """
+    Query: q, k (default 5), cuisine / course / diet filters.
+    Raises ValueError on bad input.
+    """
+    index = index or get_index()
+    query = (args.get("q") or "").strip()
+    if not query:
+        raise ValueError("q is required")
+    results = index.search(query, k=_top_k(args, SEARCH_TOP_K),
+                           **{f: args.get(f) for f in FACETS})
+    response: Dict[str, Any] = {
+        "query": query,
+        "results": [
+            {"recipe": index.recipes[row], "score": score, "match_type": match_type}
+            for row, score, match_type in results
+        ],
+    }
+    if not results:
+        response["examples"] = index.examples()
+    return response
+
+
+def autocomplete_response(args: Dict[str, Any], index: Optional[RecipeIndex] = None) -> Dict[str, Any]:
+    """
+    Query: q, k (default 8), field = name (default) | cuisine | course | diet.
+    Raises ValueError on bad input.
+    """
+    index = index or get_index()
+    query = args.get("q") or ""
+    field = args.get("field") or "name"
+    k = _top_k(args, AUTOCOMPLETE_TOP_K)
+    if field == "name":
+        return {"query": query, "suggestions": index.autocomplete(query, k=k)}
+    if field in FACETS:
+        return {"query": query, "field": field, "suggestions": index.complete_facet(field, query, k=k)}
+    raise ValueError(f"field must be one of name, {', '.join(FACETS)}")
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Whole-report cache for FastEngine.analyze_cart.
+
+Apart from the narrative, a cart report depends only on the item names,
+the persona and the catalogue build. Recipe-generated carts repeat a lot,
+so the finished report and its LLM payload are kept under a hash of:
+  - the (item name, quantity) lines, names lower-cased and stripped, then
+    sorted (order doesn't matter, repeats do)
+  - the persona (custom personas are already a hash of their weights)
+  - the engine's data version: the catalogue's input_hash and anything
+    else that changes results
+A rebuilt catalogue gets a new input_hash, so its old entries stop
+matching and age out. An entry keeps the normalised line of each report
+item, so a hit is put back in the order of the cart asking for it
+(line_order; repeated lines pair up by occurrence).
+
+Same tiers as narrative_cache.py: an in-process LRU, plus an optional
+SQLite file (table "reports") shared by every worker on the box. Both
+have a TTL and a size bound.
+"""
+
+import hashlib
+import json
+import os
+from typing import Iterable, Optional, Sequence
+
+from narrative_cache import NarrativeCache
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+REPORT_CACHE_SIZE = int(os.environ.get("REPORT_CACHE_SIZE", "1024"))  # ~20 KB each; 0 = no in-process tier
+REPORT_CACHE_TTL_S = float(os.environ.get("REPORT_CACHE_TTL_S", "3600"))
+REPORT_CACHE_DB = os.environ.get("REPORT_CACHE_DB")  # unset = memory only
+REPORT_CACHE_DB_MAX_ENTRIES = int(os.environ.get("REPORT_CACHE_DB_MAX_ENTRIES", "100000"))
+
+# Bump when the cached report layout changes
+REPORT_FORMAT_VERSION = 3
+
+
+def normalise_lines(item_names: Iterable[str], quantities: Optional[Sequence[float]] = None) -> list:
+    """[name, quantity] lines, names as FastMatcher compares them, in cart order"""
+    names = [str(name).lower().strip() for name in item_names]
+    quantities = [float(q) for q in quantities] if quantities is not None else [1.0] * len(names)
+    return [[name, quantity] for name, quantity in zip(names, quantities)]
+
+
+def normalise_cart(item_names: Iterable[str], quantities: Optional[Sequence[float]] = None) -> list:
+    """normalise_lines in a fixed order"""
+    return sorted(normalise_lines(item_names, quantities))
+
+
+def line_order(cached_lines: Sequence[Sequence], lines: Sequence[Sequence]) -> list:
+    """Positions in cached_lines of each of lines, in the order of lines.
+
+    The nth repeat of a line takes the nth cached copy; lines with no
+    cached copy (items that matched nothing) are left out.
+    """
+    positions: dict = {}
+    for i, line in enumerate(cached_lines):
+        positions.setdefault(tuple(line), []).append(i)
+    order = []
+    for line in lines:
+        free = positions.get(tuple(line))
+        if free:
+            order.append(free.pop(0))
+    return order
+
+
+class ReportCache(NarrativeCache):
+    TABLE = "reports"
+    LABEL = "Report cache"
+
+    def __init__(self, data_version: str,
+                 max_entries: int = REPORT_CACHE_SIZE,
+                 ttl_s: float = REPORT_CACHE_TTL_S,
+                 db_path: Optional[str] = REPORT_CACHE_DB,
+                 db_max_entries: int = REPORT_CACHE_DB_MAX_ENTRIES):
+        super().__init__(max_entries, ttl_s, db_path, db_max_entries)
+        self.data_version = data_version
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.max_entries > 0 or self.disk is not None
+
+    def key(self, item_names: Iterable[str], persona: str,
+            quantities: Optional[Sequence[float]] = None) -> str:
+        payload = json.dumps(
+            {"items": normalise_cart(item_names, quantities), "persona": persona,
+             "data": self.data_version, "format": REPORT_FORMAT_VERSION},
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def stats(self):
+        stats = super().stats()
+        stats["data_version"] = self.data_version
+        return stats
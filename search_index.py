@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Product search index for cart item matching.
+
+Built once over `product_name_en` + `brands`:
+  - a token inverted index (whole words)
+  - a character trigram inverted index (typo tolerance)
+
+Both are stored CSR-style (one flat int32 postings array plus offsets), so
+candidate generation is a handful of NumPy slices and the whole index can be
+saved to / loaded from a single .npz file instead of being rebuilt by every
+worker. Candidates are re-ranked by an exact similarity score and the top-k
+are returned. The trigram postings also narrow the shopping screen's
+name/brand substring search to the rows that can contain the text.
+"""
+
+import hashlib
+import os
+import re
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Bump when tokenisation or the on-disk layout changes
+INDEX_VERSION = 1
+
+# Minimum similarity for a candidate to count as a match
+MIN_SCORE = 0.35
+
+# Upper bound on postings touched per query; the rarest grams are used first
+POSTINGS_BUDGET = 200_000
+
+# Candidates re-ranked exactly after the postings pass
+RERANK_CANDIDATES = 64
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalise(text: str) -> str:
+    return _NON_ALNUM.sub(" ", str(text).lower()).strip()
+
+
+def tokens(text: str) -> List[str]:
+    return normalise(text).split()
+
+
+def trigrams(text: str) -> set:
+    """Character trigrams of each word, padded so short words still index"""
+    grams = set()
+    for tok in tokens(text):
+        padded = f" {tok} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def index_path_for(csv_path: str) -> str:
+    """Where the index for a precomputed CSV lives"""
+    return os.path.splitext(csv_path)[0] + ".search.npz"
+
+
+def fingerprint(names: Sequence[str], brands: Sequence[str]) -> str:
+    h = hashlib.sha256(f"v{INDEX_VERSION}".encode("utf-8"))
+    for name, brand in zip(names, brands):
+        h.update(name.encode("utf-8"))
+        h.update(b"\x00")
+        h.update(brand.encode("utf-8"))
+        h.update(b"\x01")
+    return h.hexdigest()
+
+
+class _Postings:
+    """term -> sorted doc ids, stored as one flat array plus offsets"""
+
+    def __init__(self, vocab: List[str], offsets: np.ndarray, postings: np.ndarray):
+        self.vocab = vocab
+        self.lookup: Dict[str, int] = {t: i for i, t in enumerate(vocab)}
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def build(cls, docs: Iterable[Iterable[str]]) -> "_Postings":
+        lookup: Dict[str, int] = {}
+        term_ids = array("i")
+        doc_ids = array("i")
+        for doc, terms in enumerate(docs):
+            for term in terms:
+                tid = lookup.get(term)
+                if tid is None:
+                    tid = lookup[term] = len(lookup)
+                term_ids.append(tid)
+                doc_ids.append(doc)
+
+        term_arr = np.frombuffer(term_ids, dtype=np.int32) if len(term_ids) else np.empty(0, np.int32)
+        doc_arr = np.frombuffer(doc_ids, dtype=np.int32) if len(doc_ids) else np.empty(0, np.int32)
+        order = np.argsort(term_arr, kind="stable")
+        counts = np.bincount(term_arr, minlength=len(lookup))
+        offsets = np.zeros(len(lookup) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        vocab = [""] * len(lookup)
+        for term, tid in lookup.items():
+            vocab[tid] = term
+        return cls(vocab, offsets, doc_arr[order].copy())
+
+    def df(self, term: str) -> int:
+        tid = self.lookup.get(term)
+        return 0 if tid is None else int(self.offsets[tid + 1] - self.offsets[tid])
+
+    def get(self, term: str) -> np.ndarray:
+        tid = self.lookup.get(term)
+        if tid is None:
+            return self.postings[:0]
+        return self.postings[self.offsets[tid]:self.offsets[tid + 1]]
+
+
+class ProductSearchIndex:
+    def __init__(self, names: Sequence[str], brands: Sequence[str],
+                 token_index: _Postings, gram_index: _Postings, digest: str):
+        self.names = names
+        self.brands = brands
+        self.token_index = token_index
+        self.gram_index = gram_index
+        self.digest = digest
+
+    # ------------------------------------------------------------------ build
+
+    @classmethod
+    def build(cls, names: Sequence[str], brands: Sequence[str]) -> "ProductSearchIndex":
+        texts = [f"{n} {b}" for n, b in zip(names, brands)]
+        token_index = _Postings.build(set(tokens(t)) for t in texts)
+        gram_index = _Postings.build(trigrams(t) for t in texts)
+        return cls(names, brands, token_index, gram_index, fingerprint(names, brands))
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            digest=np.array(self.digest),
+            token_vocab=np.array(self.token_index.vocab, dtype=str),
+            token_offsets=self.token_index.offsets,
+            token_postings=self.token_index.postings,
+            gram_vocab=np.array(self.gram_index.vocab, dtype=str),
+            gram_offsets=self.gram_index.offsets,
+            gram_postings=self.gram_index.postings,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, names: Sequence[str], brands: Sequence[str],
+             digest: Optional[str] = None) -> Optional["ProductSearchIndex"]:
+        """Load a saved index; None if missing or built from different data"""
+        digest = digest or fingerprint(names, brands)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data["digest"]) != digest:
+                    return None
+                token_index = _Postings(data["token_vocab"].tolist(),
+                                        data["token_offsets"], data["token_postings"])
+                gram_index = _Postings(data["gram_vocab"].tolist(),
+                                       data["gram_offsets"], data["gram_postings"])
+        except (OSError, KeyError, ValueError):
+            return None
+        return cls(names, brands, token_index, gram_index, digest)
+
+    @classmethod
+    def load_or_build(cls, path: Optional[str], names: Sequence[str],
+                      brands: Sequence[str]) -> "ProductSearchIndex":
+        digest = fingerprint(names, brands)
+        if path:
+            index = cls.load(path, names, brands, digest)
+            if index is not None:
+                print(f"[SearchIndex] Loaded {path}")
+                return index
+
+        index = cls.build(names, brands)
+        if path:
+            try:
+                index.save(path)
+                print(f"[SearchIndex] Saved {path}")
+            except OSError as e:
+                # Read-only deployments just keep the in-memory index
+                print(f"[SearchIndex] Could not save {path}: {e}")
+        return index
+
+    # ----------------------------------------------------------------- search
+
+    def _candidates(self, query_tokens: List[str], query_grams: set) -> np.ndarray:
+        """Docs sharing the most (rarest-first) grams/tokens with the query"""
+        lists = []
+        touched = 0
+        for gram in sorted(query_grams, key=self.gram_index.df):
+            postings = self.gram_index.get(gram)
+            if lists and touched + len(postings) > POSTINGS_BUDGET:
+                break
+            lists.append(postings)
+            touched += len(postings)
+
+        # Whole-word hits count double so exact words outrank shared fragments
+        for tok in query_tokens:
+            postings = self.token_index.get(tok)
+            if len(postings) and touched + len(postings) <= POSTINGS_BUDGET:
+                lists.extend((postings, postings))
+                touched += len(postings)
+
+        if not lists:
+            return np.empty(0, dtype=np.int32)
+
+        docs, counts = np.unique(np.concatenate(lists), return_counts=True)
+        if len(docs) > RERANK_CANDIDATES:
+            top = np.argpartition(-counts, RERANK_CANDIDATES - 1)[:RERANK_CANDIDATES]
+            docs = docs[top]
+        return docs
+
+    def similarity(self, query: str, idx: int,
+                   query_tokens: Optional[List[str]] = None,
+                   query_grams: Optional[set] = None) -> float:
+        """Similarity in [0, 1] between a query and one product"""
+        q_norm = normalise(query)
+        name_norm = normalise(self.names[idx])
+        if not q_norm or not name_norm:
+            return 0.0
+        if q_norm == name_norm:
+            return 1.0
+
+        query_tokens = query_tokens if query_tokens is not None else q_norm.split()
+        query_grams = query_grams if query_grams is not None else trigrams(q_norm)
+
+        name_grams = trigrams(name_norm)
+        full_grams = name_grams | trigrams(self.brands[idx])
+        dice = max(
+            2 * len(query_grams & grams) / (len(query_grams) + len(grams))
+            for grams in (name_grams, full_grams)
+            if grams
+        )
+
+        doc_tokens = set(name_norm.split()) | set(tokens(self.brands[idx]))
+        overlap = sum(1 for t in query_tokens if t in doc_tokens) / len(query_tokens)
+
+        score = 0.6 * dice + 0.4 * overlap
+        # Either name containing the other is a strong signal (old substring rule)
+        if q_norm in name_norm or name_norm in q_norm:
+            score += 0.2
+        return min(score, 0.99)
+
+    def rows_containing(self, text: str) -> np.ndarray:
+        """
+        Rows whose name or brand contains `text` (case-insensitive), in
+        catalogue order. Every 3-letter run of the text must be one of the
+        row's grams, so only those rows are checked.
+        """
+        needle = str(text).lower()
+        if not needle:
+            return np.arange(len(self.names), dtype=np.int64)
+        grams = {run[i:i + 3] for run in _NON_ALNUM.split(needle) for i in range(len(run) - 2)}
+        if grams:
+            rows = None
+            for gram in sorted(grams, key=self.gram_index.df):
+                postings = self.gram_index.get(gram)
+                rows = postings if rows is None else np.intersect1d(rows, postings, assume_unique=True)
+                if not len(rows):
+                    break
+            candidates = rows.tolist()
+        else:
+            candidates = range(len(self.names))
+        return np.array(
+            [idx for idx in candidates
+             if needle in self.names[idx].lower() or needle in self.brands[idx].lower()],
+            dtype=np.int64,
+        )
+
+    def search(self, query: str, k: int = 5,
+               min_score: float = MIN_SCORE) -> List[Tuple[int, float]]:
+        """Top-k (row, score) pairs, best first"""
+        query_tokens = tokens(query)
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        scored = []
+        for idx in self._candidates(query_tokens, query_grams).tolist():
+            score = self.similarity(query, idx, query_tokens, query_grams)
+            if score >= min_score:
+                scored.append((idx, score))
+
+        # Best score first, catalogue order on ties
+        scored.sort(key=lambda x: (-x[1], x[0]))
+        return scored[:k]
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Prefork production server for the B4UBuy API.
+
+The master builds and warms the FastEngine once, opens the listening socket
+and forks one worker per core by default. Workers inherit the engine
+copy-on-write. Its catalogue arrays are memory-mapped, so those pages are
+shared outright. Each worker serves the shared socket with a fixed-size
+thread pool, and gets its own LLM clients and narrative pools.
+
+    python3 serve.py --workers 8 --threads 16 --port 5000
+
+Environment equivalents: SERVE_HOST, SERVE_PORT, SERVE_WORKERS,
+SERVE_THREADS, SERVE_GRACEFUL_TIMEOUT_S.
+
+SIGTERM / SIGINT shut down gracefully:
+  1. Workers flip /api/ready to 503 and stop accepting connections.
+  2. In-flight requests get up to --graceful-timeout seconds to finish.
+  3. The master waits for the workers, then SIGKILLs any stragglers.
+A worker that dies unexpectedly is replaced.
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend_api import DEFAULT_CSV, create_app
+from cart_llm import FastEngine
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+SERVE_HOST = os.environ.get("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.environ.get("SERVE_PORT", "5000"))
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", str(os.cpu_count() or 1)))
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", "8"))
+SERVE_GRACEFUL_TIMEOUT_S = float(os.environ.get("SERVE_GRACEFUL_TIMEOUT_S", "30"))
+
+# Pending connections the kernel queues on the shared socket
+LISTEN_BACKLOG = 2048
+
+# A worker that dies sooner than this after starting is respawned with a delay
+MIN_WORKER_LIFETIME_S = 1.0
+
+
+class RequestHandler(WSGIRequestHandler):
+    # One request per connection: an idle keep-alive client must not pin a pool thread
+    protocol_version = "HTTP/1.0"
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug server that handles connections on a fixed-size thread pool"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+
+    def get_request(self):
+        # The listening socket is non-blocking (shared by every worker);
+        # accepted connections are not
+        conn, addr = self.socket.accept()
+        conn.setblocking(True)
+        return conn, addr
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self):
+        """Wait for in-flight requests, then close the socket"""
+        self.pool.shutdown(wait=True)
+        self.server_close()
+
+
+# ============================================================================
+# WORKER
+# ============================================================================
+
+
+def run_worker(engine, sock, host, port, threads, graceful_timeout):
+    engine.reinit_after_fork()
+    app = create_app(engine=engine)
+    server = PooledWSGIServer(host, port, app, threads, fd=sock.fileno())
+    stopping = threading.Event()
+    deadline = []
+
+    def stop(signum, frame):
+        if stopping.is_set():
+            return
+        stopping.set()
+        app.extensions['b4ubuy'].draining = True
+        # serve_forever() runs on this thread, so it has to be stopped from another
+        threading.Thread(target=server.shutdown, daemon=True).start()
+        # Hard deadline for requests that never finish; cancelled by a clean drain
+        timer = threading.Timer(graceful_timeout, os._exit, args=(1,))
+        timer.daemon = True
+        timer.start()
+        deadline.append(timer)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"[worker {os.getpid()}] serving with {threads} threads")
+    server.serve_forever(poll_interval=0.5)
+    server.drain()
+    for timer in deadline:
+        timer.cancel()
+    engine.narratives.shutdown()
+    print(f"[worker {os.getpid()}] stopped")
+
+
+# ============================================================================
+# MASTER
+# ============================================================================
+
+
+class Master:
+    def __init__(self, engine, sock, args):
+        self.engine = engine
+        self.sock = sock
+        self.args = args
+        self.workers = {}  # pid -> start time
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                run_worker(self.engine, self.sock, self.args.host, self.args.port,
+                           self.args.threads, self.args.graceful_timeout)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        """Collect exited workers; returns their start times"""
+        exited = []
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self.workers.pop(pid, None)
+            if started is not None:
+                if not self.stopping:
+                    print(f"[master] worker {pid} exited ({os.waitstatus_to_exitcode(status)}), respawning")
+                exited.append(started)
+        return exited
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for _ in range(self.args.workers):
+            self.spawn()
+        print(f"[master {os.getpid()}] {self.args.workers} workers on "
+              f"http://{self.args.host}:{self.args.port}")
+
+        while not self.stopping:
+            for started in self.reap():
+                if self.stopping:
+                    break
+                if time.monotonic() - started < MIN_WORKER_LIFETIME_S:
+                    time.sleep(MIN_WORKER_LIFETIME_S)  # don't spin on a crashing worker
+                self.spawn()
+            time.sleep(0.2)
+
+        self.shutdown()
+
+    def shutdown(self):
+        print(f"[master] stopping {len(self.workers)} workers...")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.args.graceful_timeout + 1.0
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for pid in list(self.workers):
+            print(f"[master] worker {pid} did not stop in time, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            self.workers.pop(pid, None)
+
+        self.sock.close()
+        print("[master] stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prefork production server for the B4UBuy API")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS,
+                        help="request threads per worker")
+    parser.add_argument("--graceful-timeout", type=float, default=SERVE_GRACEFUL_TIMEOUT_S,
+                        help="seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="precomputed catalogue")
+    args = parser.parse_args(argv)
+
+    # Build and warm once; every worker inherits the result
+    engine = FastEngine(csv_path=args.csv)
+    engine.warm_up()
+
+    sock = socket.create_server((args.host, args.port), backlog=LISTEN_BACKLOG)
+    sock.setblocking(False)
+
+    if not hasattr(os, "fork") or args.workers <= 1:
+        # Single process (and the only option where fork is unavailable)
+        run_worker(engine, sock, args.host, args.port, args.threads, args.graceful_timeout)
+        sock.close()
+        return
+
+    # Objects that exist now are never collected, so the GC does not touch
+    # (and un-share) their pages in the workers
+    gc.freeze()
+    Master(engine, sock, args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Synthetic OpenFoodFacts-shaped catalogue for benchmarks.
+
+Writes a TSV with the same columns and value shapes as
+openfoodfacts_export.tsv, so the whole data-prep chain (data_ingestion ->
+data_transformation -> data_structuring -> precompute) and FastEngine can
+run against 3k to 1M products.
+
+Every synthetic row copies a template row from the bundled export
+(categories, labels, allergen tags, units, nutri grade) and then varies it:
+  - nutrients are jittered multiplicatively, and missing values stay missing
+  - most names get an extra word drawn from the export's name vocabulary,
+    so the search index sees a vocabulary that grows with the catalogue
+  - half the brands are swapped for another brand from the export
+The same seed and row count always give the same file.
+
+Usage:
+    python3 synthetic_catalogue.py --rows 100000 --output /tmp/off_100k.tsv
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_ingestion
+
+# Resolve file paths relative to this module so relative CWDs won't break runs
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED_TSV = os.path.join(BASE_DIR, "openfoodfacts_export.tsv")
+
+DEFAULT_SEED = 20240601
+
+# Rows generated and written per chunk; memory stays flat at 1M rows
+CHUNK_ROWS = 100_000
+
+# Columns written besides data_ingestion.cols_to_keep, so ingestion still
+# has to skip columns it does not use
+EXTRA_COLUMNS = ["code", "lc", "product_name_fr", "countries_en"]
+
+# Share of names left as the template's (real catalogues repeat names), and
+# share of brands swapped for another brand
+KEEP_NAME_SHARE = 0.3
+SWAP_BRAND_SHARE = 0.5
+
+# Spread of the multiplicative nutrient jitter (log-normal sigma)
+NUTRIENT_JITTER = 0.15
+
+
+def load_templates(path: str = SEED_TSV) -> pd.DataFrame:
+    """Export rows to copy from, every column as text (missing = NaN)"""
+    columns = data_ingestion.select_columns(path)
+    return pd.read_csv(path, sep="\t", usecols=columns, dtype=str)[columns]
+
+
+def name_vocabulary(names: pd.Series) -> np.ndarray:
+    words = names.dropna().str.lower().str.findall(r"[a-z]{3,}").explode().dropna()
+    return np.array(sorted(set(words)), dtype=object)
+
+
+def generate_chunk(templates: pd.DataFrame, vocab: np.ndarray, brands: np.ndarray,
+                   start: int, rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Rows start .. start+rows-1 of the synthetic catalogue"""
+    picks = rng.integers(0, len(templates), size=rows)
+    df = templates.iloc[picks].reset_index(drop=True)
+
+    names = df["product_name_en"]
+    extra = vocab[rng.integers(0, len(vocab), size=rows)]
+    vary = names.notna().to_numpy() & (rng.random(rows) >= KEEP_NAME_SHARE)
+    df["product_name_en"] = np.where(vary, names.fillna("") + " " + extra.astype(str), names)
+
+    swap = rng.random(rows) < SWAP_BRAND_SHARE
+    df["brands"] = np.where(swap, brands[rng.integers(0, len(brands), size=rows)], df["brands"])
+
+    for col in data_ingestion.numeric_cols:
+        if col not in df.columns or col == "off:nova_groups":
+            continue
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+        jitter = np.exp(rng.normal(0.0, NUTRIENT_JITTER, size=rows))
+        df[col] = pd.Series(np.round(values * jitter, 2)).map(lambda v: "" if v != v else f"{v:g}")
+
+    df.insert(0, "code", [f"{890_0000_00000 + start + i:013d}" for i in range(rows)])
+    df.insert(1, "lc", "en")
+    df["product_name_fr"] = ""
+    df["countries_en"] = "India"
+    return df
+
+
+def generate(rows: int, output_path: str, seed: int = DEFAULT_SEED,
+             seed_path: str = SEED_TSV, chunk_rows: int = CHUNK_ROWS) -> int:
+    """Write `rows` synthetic products to output_path; returns bytes written"""
+    templates = load_templates(seed_path)
+    vocab = name_vocabulary(templates["product_name_en"])
+    brands = np.array(sorted(set(templates["brands"].dropna())), dtype=object)
+    rng = np.random.default_rng(seed)
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+        for start in range(0, rows, chunk_rows):
+            chunk = generate_chunk(templates, vocab, brands, start, min(chunk_rows, rows - start), rng)
+            chunk.to_csv(out, sep="\t", index=False, header=(start == 0))
+    os.replace(tmp_path, output_path)
+    return os.path.getsize(output_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic OpenFoodFacts-shaped TSV")
+    parser.add_argument("--rows", type=int, default=3000)
+    parser.add_argument("--output", required=True, help="TSV to write")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--from", dest="seed_path", default=SEED_TSV,
+                        help="export whose rows are used as templates")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    size = generate(args.rows, args.output, args.seed, args.seed_path)
+    print(f"Saved {args.rows:,} synthetic products to {args.output} "
+          f"({size / 1e6:.1f} MB, {time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
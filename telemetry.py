@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""In-process latency metrics and sampled request traces.
+
+Spans time the engine's stages (load, match, score, alternatives,
+improvement, narrative) and every LLM provider call. Each finished span
+feeds a histogram. render() prints every metric in the Prometheus text
+format that /api/metrics serves.
+
+A fraction of requests (TRACE_SAMPLE_RATE) also keep a full trace: every
+span with its offset, duration and attributes, such as which provider
+answered. The last TRACE_BUFFER_SIZE traces are kept for /api/traces.
+
+Everything is per process. Under serve.py each worker reports its own
+numbers, labelled with its pid.
+"""
+
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))  # 0 = no traces, 1 = every request
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "100"))
+
+# Seconds; from sub-millisecond matcher work up to LLM timeouts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_label_text(self.label_names, key)} {_number(v)}" for key, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.series: Dict[Tuple[str, ...], list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self.series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names, key, le)} {cumulative}")
+            labels = _label_text(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "b4ubuy_stage_seconds", "Time spent in each engine stage", ("stage",))
+LLM_CALL_SECONDS = Histogram(
+    "b4ubuy_llm_call_seconds", "LLM provider call latency", ("provider", "outcome"))
+NARRATIVES = Counter(
+    "b4ubuy_narratives_total", "Narratives by where they came from (provider, cache or fallback)",
+    ("source",))
+HTTP_SECONDS = Histogram(
+    "b4ubuy_http_request_seconds", "API request latency", ("endpoint", "method", "status"))
+TRACES_SAMPLED = Counter(
+    "b4ubuy_traces_sampled_total", "Requests whose full trace was kept")
+
+METRICS = [STAGE_SECONDS, LLM_CALL_SECONDS, NARRATIVES, HTTP_SECONDS, TRACES_SAMPLED]
+
+
+def render(extra: Sequence[Any] = ()) -> str:
+    """Every metric (plus `extra` ones) in the Prometheus text exposition format"""
+    pid = str(os.getpid())
+    lines = [
+        "# HELP b4ubuy_process_info The process these numbers belong to",
+        "# TYPE b4ubuy_process_info gauge",
+        f'b4ubuy_process_info{{pid="{pid}"}} 1',
+    ]
+    for metric in list(METRICS) + list(extra):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+# ============================================================================
+# TRACES
+# ============================================================================
+
+
+class Trace:
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float, attrs: Dict[str, Any]) -> None:
+        span = {"name": name, "start_ms": round((start - self.start) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3)}
+        span.update(attrs)
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dict(self, duration: float) -> Dict[str, Any]:
+        return {"name": self.name, "started_at": self.started_at,
+                "duration_ms": round(duration * 1000, 3), "pid": os.getpid(),
+                **self.attrs, "spans": self.spans}
+
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("b4ubuy_trace", default=None)
+_traces: "deque[Dict[str, Any]]" = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def start_trace(name: str, sample_rate: Optional[float] = None, **attrs: Any):
+    """
+    Begin a sampled trace for this context; returns a token for finish_trace
+    (None when not sampled or a trace is already running)
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if _current.get() is not None or rate <= 0 or random.random() >= rate:
+        return None
+    trace_obj = Trace(name, attrs)
+    return trace_obj, _current.set(trace_obj)
+
+
+def finish_trace(token, **attrs: Any) -> None:
+    if token is None:
+        return
+    trace_obj, var_token = token
+    _current.reset(var_token)
+    trace_obj.attrs.update(attrs)
+    _traces.append(trace_obj.to_dict(time.perf_counter() - trace_obj.start))
+    TRACES_SAMPLED.inc()
+
+
+@contextlib.contextmanager
+def trace(name: str, **attrs: Any) -> Iterator[None]:
+    token = start_trace(name, **attrs)
+    try:
+        yield
+    finally:
+        finish_trace(token)
+
+
+def annotate(**attrs: Any) -> None:
+    """Attach attributes to the running trace, if this request is sampled"""
+    trace_obj = _current.get()
+    if trace_obj is not None:
+        trace_obj.attrs.update(attrs)
+
+
+def recent_traces(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Newest first"""
+    traces = list(_traces)[::-1]
+    return traces if limit is None else traces[:limit]
+
+
+# ============================================================================
+# SPANS
+# ============================================================================
+
+
+def record_span(name: str, start: float, duration: float, **attrs: Any) -> None:
+    """Add an already-timed span to the running trace (no histogram)"""
+    trace_obj = _current.get()
+    if trace_obj is not None:
+        trace_obj.add(name, start, duration, attrs)
+
+
+def end_stage(stage: str, start: float, **attrs: Any) -> float:
+    """
+    Close a stage that began at `start` (a time.perf_counter() reading);
+    returns now, so consecutive stages can chain
+    """
+    now = time.perf_counter()
+    STAGE_SECONDS.observe(now - start, stage=stage)
+    record_span(stage, start, now - start, **attrs)
+    return now
+
+
+@contextlib.contextmanager
+def span(stage: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time a block as one engine stage. The yielded dict can take more
+    attributes for the trace while the block runs.
+    """
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        end_stage(stage, start, **attrs)
+
+
+def record_llm_call(provider: str, outcome: str, start: float, duration: float) -> None:
+    LLM_CALL_SECONDS.observe(duration, provider=provider, outcome=outcome)
+    record_span(f"llm.{provider}", start, duration, outcome=outcome)
+
+
+def record_narrative(source: str) -> None:
+    NARRATIVES.inc(source=source)
+    annotate(narrative_source=source)